@@ -15,9 +15,12 @@
  * - EEPROM storage for calibration data to persist across power cycles.
  * - A serial command interface for integration with a higher-level controller (e.g., a Python server).
  * - Support for aborting command sequences via 'abort' command.
+ * - An optional COBS/CRC16 framed binary protocol, accepted alongside the text protocol
+ *   (see python/mcp_server/binary_protocol.py).
  */
 
 // --- Physical Parameters of the Robot Arm (in millimeters) ---
+// Mirrored in python/mcp_server/kinematics.py for host-side reachability checks; keep both in sync.
 const float L1 = 80.0;           // Length of the first arm segment (shoulder to elbow).
 const float L2 = 80.0;           // Length of the second arm segment (elbow to wrist joint).
 const float L_OFF_J4_TCP = 51.0; // Horizontal offset from the wrist joint (J4) to the Tool Center Point (TCP).
@@ -36,6 +39,29 @@ const int STEP_DELAY = 10;       // Delay in milliseconds between each step of a
 Adafruit_PWMServoDriver pwm = Adafruit_PWMServoDriver();
 #define SERVO_FREQ 50            // Standard PWM frequency for analog servos (50 Hz -> 20ms period).
 
+// --- Serial Configuration ---
+// Override at build time (e.g., -DSERIAL_BAUD=115200) and start the server with the matching --baud.
+#ifndef SERIAL_BAUD
+#define SERIAL_BAUD 9600
+#endif
+
+// --- Binary Frame Protocol (must match binary_protocol.py) ---
+// Frame: 0x00 | COBS( type | seq | body | CRC16-CCITT (little endian) ) | 0x00
+#define MSG_TEXT     0x01
+#define MSG_MOVE     0x02
+#define MSG_SERVO    0x03
+#define MSG_STATUS   0x04
+#define MSG_PING     0x05
+#define REPLY_ACK    0x80
+#define REPLY_TEXT   0x81
+#define REPLY_STATUS 0x82
+#define ACK_OK         0
+#define ACK_BAD_FRAME  1
+#define ACK_UNKNOWN    2
+#define MOVE_KEEP      0x7FFF
+#define MAX_FRAME_SIZE 72       // Encoded frame size limit (without delimiters).
+#define TEXT_CHUNK_SIZE 32      // Text output is sent in REPLY_TEXT frames of up to this many bytes.
+
 /**
  * @struct Config
  * @brief Defines the configuration data structure to be stored in EEPROM.
@@ -54,6 +80,7 @@ struct Config {
 float curX = 150.0, curY = 0.0, curZ = 50.0;  // Current logical XYZ coordinates of the Tool Center Point (TCP).
 int current_us[4] = {1500, 1500, 1500, 1500}; // Current pulse width in microseconds for each servo channel (0-3).
 int cmd_interval_ms = 0;                      // Optional delay between semicolon-separated commands in a sequence.
+Print* out = &Serial;                         // Destination of command output (Serial, or framed text in binary mode).
 
 /**
  * @brief Saves the current configuration `conf` struct to EEPROM.
@@ -181,12 +208,12 @@ void executeCommand(String cmd) {
   else if (cmd.startsWith("calibg")) {
     if (cmd.indexOf("open") != -1) {
       conf.grip_open = current_us[3];
-      Serial.print(F("Grip OPEN registered: ")); Serial.println(conf.grip_open);
+      out->print(F("Grip OPEN registered: ")); out->println(conf.grip_open);
     } else if (cmd.indexOf("close") != -1) {
       conf.grip_close = current_us[3];
-      Serial.print(F("Grip CLOSE registered: ")); Serial.println(conf.grip_close);
+      out->print(F("Grip CLOSE registered: ")); out->println(conf.grip_close);
     } else {
-      Serial.println(F("Usage: calibg <open|close>"));
+      out->println(F("Usage: calibg <open|close>"));
     }
   }
   // Command: 'calib<0|1> x=... y=... z=...'
@@ -202,7 +229,7 @@ void executeCommand(String cmd) {
       conf.j_pulse[0][ptIdx] = current_us[0]; conf.j_angle[0][ptIdx] = tj1;
       conf.j_pulse[1][ptIdx] = current_us[1]; conf.j_angle[1][ptIdx] = tj2;
       conf.j_pulse[2][ptIdx] = current_us[2]; conf.j_angle[2][ptIdx] = tj3; 
-      Serial.print(F("Point ")); Serial.print(ptIdx); Serial.println(F(" IK registered."));
+      out->print(F("Point ")); out->print(ptIdx); out->println(F(" IK registered."));
     }
   }
   // Command: 'grip <open|close>'
@@ -291,81 +318,224 @@ void executeCommand(String cmd) {
   // Saves the current calibration configuration to EEPROM.
   else if (cmd == "save") { 
     saveConfig(); 
-    Serial.println(F("Config Saved to EEPROM.")); 
+    out->println(F("Config Saved to EEPROM.")); 
   }
   // Command: 'dump'
   // Prints the current configuration and robot state to the serial monitor.
   else if (cmd == "dump") {
-    Serial.print(F("{\"joints\":["));
+    out->print(F("{\"joints\":["));
     for(int i=0; i<3; i++) {
-      Serial.print(F("{\"ch\":")); Serial.print(i);
-      Serial.print(F(",\"p0\":")); Serial.print(conf.j_pulse[i][0]);
-      Serial.print(F(",\"a0\":")); Serial.print(conf.j_angle[i][0], 1);
-      Serial.print(F(",\"p1\":")); Serial.print(conf.j_pulse[i][1]);
-      Serial.print(F(",\"a1\":")); Serial.print(conf.j_angle[i][1], 1);
-      Serial.print(F(",\"cur_us\":")); Serial.print(current_us[i]);
-      Serial.print(F(",\"cur_angle\":")); Serial.print(usToAngle(i, current_us[i]), 1);
-      Serial.print(F("}"));
-      if(i<2) Serial.print(F(","));
+      out->print(F("{\"ch\":")); out->print(i);
+      out->print(F(",\"p0\":")); out->print(conf.j_pulse[i][0]);
+      out->print(F(",\"a0\":")); out->print(conf.j_angle[i][0], 1);
+      out->print(F(",\"p1\":")); out->print(conf.j_pulse[i][1]);
+      out->print(F(",\"a1\":")); out->print(conf.j_angle[i][1], 1);
+      out->print(F(",\"cur_us\":")); out->print(current_us[i]);
+      out->print(F(",\"cur_angle\":")); out->print(usToAngle(i, current_us[i]), 1);
+      out->print(F("}"));
+      if(i<2) out->print(F(","));
     }
-    Serial.print(F("],\"gripper\":{\"open\":")); Serial.print(conf.grip_open);
-    Serial.print(F(",\"close\":")); Serial.print(conf.grip_close);
-    Serial.print(F(",\"speed\":")); Serial.print(conf.grip_speed_ms);
-    Serial.print(F(",\"cur_us\":")); Serial.print(current_us[3]);
-    Serial.print(F("},\"tcp\":{\"x\":")); Serial.print(curX);
-    Serial.print(F(",\"y\":")); Serial.print(curY);
-    Serial.print(F(",\"z\":")); Serial.print(curZ);
-    Serial.println(F("}}"));
+    out->print(F("],\"gripper\":{\"open\":")); out->print(conf.grip_open);
+    out->print(F(",\"close\":")); out->print(conf.grip_close);
+    out->print(F(",\"speed\":")); out->print(conf.grip_speed_ms);
+    out->print(F(",\"cur_us\":")); out->print(current_us[3]);
+    out->print(F("},\"tcp\":{\"x\":")); out->print(curX);
+    out->print(F(",\"y\":")); out->print(curY);
+    out->print(F(",\"z\":")); out->print(curZ);
+    out->println(F("}}"));
   }
   // Command: 'status'
   // Prints the current configuration and robot state in JSON format.
   else if (cmd == "status") {
-    Serial.println(F("\n--- CONFIG DUMP ---"));
+    out->println(F("\n--- CONFIG DUMP ---"));
     for(int i=0; i<3; i++) {
-      Serial.print("Ch"); Serial.print(i);
-      Serial.print(": [P0="); Serial.print(conf.j_pulse[i][0]);
-      Serial.print(", A0="); Serial.print(conf.j_angle[i][0], 1);
-      Serial.print("] [P1="); Serial.print(conf.j_pulse[i][1]);
-      Serial.print(", A1="); Serial.print(conf.j_angle[i][1], 1);
-      Serial.print("] | CUR="); Serial.print(current_us[i]);
-      Serial.print(" ("); Serial.print(usToAngle(i, current_us[i]), 1);
-      Serial.println(" deg)");
+      out->print("Ch"); out->print(i);
+      out->print(": [P0="); out->print(conf.j_pulse[i][0]);
+      out->print(", A0="); out->print(conf.j_angle[i][0], 1);
+      out->print("] [P1="); out->print(conf.j_pulse[i][1]);
+      out->print(", A1="); out->print(conf.j_angle[i][1], 1);
+      out->print("] | CUR="); out->print(current_us[i]);
+      out->print(" ("); out->print(usToAngle(i, current_us[i]), 1);
+      out->println(" deg)");
     }
-    Serial.print(F("Grip: Open=")); Serial.print(conf.grip_open);
-    Serial.print(F(", Close=")); Serial.print(conf.grip_close);
-    Serial.print(F(" | CUR=")); Serial.println(current_us[3]);
-    Serial.print(F("Current Logic TCP: X=")); Serial.print(curX);
-    Serial.print(F(" Y=")); Serial.print(curY);
-    Serial.print(F(" Z=")); Serial.println(curZ);
-    Serial.println(F("-------------------\n"));
+    out->print(F("Grip: Open=")); out->print(conf.grip_open);
+    out->print(F(", Close=")); out->print(conf.grip_close);
+    out->print(F(" | CUR=")); out->println(current_us[3]);
+    out->print(F("Current Logic TCP: X=")); out->print(curX);
+    out->print(F(" Y=")); out->print(curY);
+    out->print(F(" Z=")); out->println(curZ);
+    out->println(F("-------------------\n"));
   }
   // Command: 'help'
   // Prints a list of available commands.
   else if (cmd == "help") {
-    Serial.println(F("\n--- COMMAND HELP ---"));
-    Serial.println(F("[Movement]"));
-    Serial.println(F("  move x=.. y=.. z=.. s=..      : Move TCP to world coordinates (speed 1-100)."));
-    Serial.println(F("  c<ch>=<us>                    : Direct servo control by pulse width (e.g., c0=1500)."));
-    Serial.println(F(""));
-    Serial.println(F("[Gripper]"));
-    Serial.println(F("  grip <p=..|open|close [width]> [s=..] : Control gripper. p=%, open=50%, close to [width]mm (0-25). s=speed 1-100."));
-    Serial.println(F(""));
-    Serial.println(F("[Calibration & Config]"));
-    Serial.println(F("  calib<0|1> x=.. y=.. z=..     : Register IK calibration point (0 or 1)."));
-    Serial.println(F("  calibg <open|close>           : Register gripper open/close pulse limits."));
-    Serial.println(F("  save                          : Save current calibration to EEPROM."));
-    Serial.println(F("  cmdint <ms>                   : Set interval between sequenced commands."));
-    Serial.println(F(""));
-    Serial.println(F("[Status & Utility]"));
-    Serial.println(F("  dump                          : Get robot status as JSON."));
-    Serial.println(F("  status                        : Get robot status as human-readable text."));
-    Serial.println(F("  delay <ms>                    : Pause execution for <ms> milliseconds."));
-    Serial.println(F("  help                          : Display this help message."));
-    Serial.println(F("--------------------\n"));
+    out->println(F("\n--- COMMAND HELP ---"));
+    out->println(F("[Movement]"));
+    out->println(F("  move x=.. y=.. z=.. s=..      : Move TCP to world coordinates (speed 1-100)."));
+    out->println(F("  c<ch>=<us>                    : Direct servo control by pulse width (e.g., c0=1500)."));
+    out->println(F(""));
+    out->println(F("[Gripper]"));
+    out->println(F("  grip <p=..|open|close [width]> [s=..] : Control gripper. p=%, open=50%, close to [width]mm (0-25). s=speed 1-100."));
+    out->println(F(""));
+    out->println(F("[Calibration & Config]"));
+    out->println(F("  calib<0|1> x=.. y=.. z=..     : Register IK calibration point (0 or 1)."));
+    out->println(F("  calibg <open|close>           : Register gripper open/close pulse limits."));
+    out->println(F("  save                          : Save current calibration to EEPROM."));
+    out->println(F("  cmdint <ms>                   : Set interval between sequenced commands."));
+    out->println(F(""));
+    out->println(F("[Status & Utility]"));
+    out->println(F("  dump                          : Get robot status as JSON."));
+    out->println(F("  status                        : Get robot status as human-readable text."));
+    out->println(F("  delay <ms>                    : Pause execution for <ms> milliseconds."));
+    out->println(F("  help                          : Display this help message."));
+    out->println(F("--------------------\n"));
   }
   else {
-    Serial.print(F("Unknown Command: ")); Serial.println(cmd);
+    out->print(F("Unknown Command: ")); out->println(cmd);
+  }
+}
+
+/**
+ * @brief Calculates CRC-16/CCITT-FALSE (polynomial 0x1021, initial value 0xFFFF).
+ */
+uint16_t crc16(const uint8_t* data, size_t len) {
+  uint16_t crc = 0xFFFF;
+  for (size_t i = 0; i < len; i++) {
+    crc ^= (uint16_t)data[i] << 8;
+    for (int b = 0; b < 8; b++) {
+      crc = (crc & 0x8000) ? (crc << 1) ^ 0x1021 : (crc << 1);
+    }
+  }
+  return crc;
+}
+
+/**
+ * @brief Decodes a COBS block in place.
+ * @return The decoded length, or -1 if the block is malformed.
+ */
+int cobsDecode(uint8_t* buf, int len) {
+  int in = 0, outIdx = 0;
+  while (in < len) {
+    uint8_t code = buf[in];
+    if (code == 0 || in + code > len) return -1;
+    for (int i = 1; i < code; i++) buf[outIdx++] = buf[in + i];
+    in += code;
+    if (code < 0xFF && in < len) buf[outIdx++] = 0;
+  }
+  return outIdx;
+}
+
+/**
+ * @brief Encodes a reply (type, seq, body, CRC) with COBS and writes it with delimiters.
+ */
+void sendFrame(uint8_t type, uint8_t seq, const uint8_t* body, int len) {
+  uint8_t payload[TEXT_CHUNK_SIZE + 4];
+  payload[0] = type;
+  payload[1] = seq;
+  memcpy(payload + 2, body, len);
+  uint16_t crc = crc16(payload, len + 2);
+  payload[len + 2] = crc & 0xFF;
+  payload[len + 3] = crc >> 8;
+
+  uint8_t enc[TEXT_CHUNK_SIZE + 6];
+  int codeIdx = 0, outIdx = 1;
+  uint8_t code = 1;
+  for (int i = 0; i < len + 4; i++) {
+    if (payload[i] == 0) {
+      enc[codeIdx] = code; codeIdx = outIdx++; code = 1;
+    } else {
+      enc[outIdx++] = payload[i]; code++;
+    }
   }
+  enc[codeIdx] = code;
+  Serial.write((uint8_t)0);
+  Serial.write(enc, outIdx);
+  Serial.write((uint8_t)0);
+}
+
+/**
+ * @class FramedTextPrint
+ * @brief A Print target that wraps command output into REPLY_TEXT frames.
+ * `executeCommand` prints through `out`, so the same code serves both protocols.
+ */
+class FramedTextPrint : public Print {
+public:
+  uint8_t seq = 0;
+  size_t write(uint8_t c) override {
+    buf[len++] = c;
+    if (len == TEXT_CHUNK_SIZE) sendPending();
+    return 1;
+  }
+  void sendPending() {
+    if (len > 0) sendFrame(REPLY_TEXT, seq, buf, len);
+    len = 0;
+  }
+private:
+  uint8_t buf[TEXT_CHUNK_SIZE];
+  int len = 0;
+};
+FramedTextPrint framedOut;
+
+int16_t readInt16(const uint8_t* p) { return (int16_t)(p[0] | (p[1] << 8)); }
+void writeInt16(uint8_t* p, int16_t v) { p[0] = v & 0xFF; p[1] = (v >> 8) & 0xFF; }
+
+/**
+ * @brief Reads one binary frame (the leading 0x00 is still in the buffer), executes it and replies.
+ * Every frame is answered with exactly one REPLY_ACK, the binary counterpart of the ';' heartbeat.
+ */
+void handleBinaryFrame() {
+  uint8_t buf[MAX_FRAME_SIZE];
+  int len = 0;
+  bool overflow = false;
+  Serial.read(); // Leading delimiter.
+  unsigned long start = millis();
+  while (true) {
+    if (Serial.available() == 0) {
+      if (millis() - start > 1000) return; // Incomplete frame; drop it.
+      continue;
+    }
+    uint8_t c = Serial.read();
+    if (c == 0) break;
+    if (len < MAX_FRAME_SIZE) buf[len++] = c; else overflow = true;
+  }
+  if (len == 0) return; // Consecutive delimiters.
+
+  int n = overflow ? -1 : cobsDecode(buf, len);
+  if (n < 4 || crc16(buf, n - 2) != (uint16_t)(buf[n - 2] | (buf[n - 1] << 8))) {
+    // The sequence number cannot be trusted; the server treats any ACK_BAD_FRAME as a failure of its pending frame.
+    uint8_t result = ACK_BAD_FRAME;
+    sendFrame(REPLY_ACK, 0, &result, 1);
+    return;
+  }
+  uint8_t type = buf[0], seq = buf[1];
+  uint8_t* body = buf + 2;
+  int bodyLen = n - 4;
+  uint8_t result = ACK_OK;
+
+  if (type == MSG_TEXT) {
+    body[bodyLen] = 0; // Overwrites the CRC, which has already been checked.
+    framedOut.seq = seq;
+    out = &framedOut;
+    executeCommand(String((char*)body));
+    framedOut.sendPending();
+    out = &Serial;
+  } else if (type == MSG_MOVE && bodyLen == 7) {
+    int16_t x = readInt16(body), y = readInt16(body + 2), z = readInt16(body + 4);
+    moveTo(x == MOVE_KEEP ? curX : x / 10.0, y == MOVE_KEEP ? curY : y / 10.0, z == MOVE_KEEP ? curZ : z / 10.0, body[6]);
+  } else if (type == MSG_SERVO && bodyLen == 3) {
+    moveServo(body[0], body[1] | (body[2] << 8));
+  } else if (type == MSG_STATUS) {
+    uint8_t status[14];
+    writeInt16(status, (int16_t)round(curX * 10));
+    writeInt16(status + 2, (int16_t)round(curY * 10));
+    writeInt16(status + 4, (int16_t)round(curZ * 10));
+    for (int i = 0; i < 4; i++) writeInt16(status + 6 + i * 2, current_us[i]);
+    sendFrame(REPLY_STATUS, seq, status, sizeof(status));
+  } else if (type != MSG_PING) {
+    result = ACK_UNKNOWN;
+  }
+  sendFrame(REPLY_ACK, seq, &result, 1);
+  if (cmd_interval_ms > 0) delay(cmd_interval_ms);
 }
 
 /**
@@ -373,7 +543,7 @@ void executeCommand(String cmd) {
  * Initializes Serial, PWM driver, loads configuration from EEPROM, and moves to a safe start position.
  */
 void setup() {
-  Serial.begin(9600);
+  Serial.begin(SERIAL_BAUD);
   pwm.begin();
   pwm.setPWMFreq(SERVO_FREQ);
 
@@ -410,9 +580,13 @@ void setup() {
  * @brief Main loop, runs continuously.
  * Listens for incoming serial commands, parses them, and executes them.
  * Handles command sequences separated by semicolons ';'.
+ * A line starting with 0x00 is a binary frame (text commands never contain 0x00).
  */
 void loop() {
-  if (Serial.available() > 0) {
+  if (Serial.available() > 0 && Serial.peek() == 0x00) {
+    handleBinaryFrame();
+  }
+  else if (Serial.available() > 0) {
     String input = Serial.readStringUntil('\n');
     input.trim();
     int startIdx = 0;
@@ -431,5 +605,7 @@ void loop() {
     Serial.println(";"); // Acknowledgment for the last command.
     
     Serial.println(("!")); // Send final prompt '!' to signal the end of the entire sequence.
+    // The server may stream a sequence one sub-command per line; keep the interval between those lines too.
+    if (cmd_interval_ms > 0 && Serial.available() > 0) delay(cmd_interval_ms);
   }
 }
\ No newline at end of file
@@ -0,0 +1,191 @@
+import re
+import struct
+
+"""
+ロボットコントローラとのバイナリフレームプロトコル (テキストプロトコルの代替)。
+
+フレーム形式:
+    0x00 | COBS( type(u8) | seq(u8) | body | CRC16(u16, little endian) ) | 0x00
+
+    - COBS (Consistent Overhead Byte Stuffing) で 0x00 を含まないバイト列に変換し、0x00 をフレーム区切りとする。
+    - CRC16 は CRC-16/CCITT-FALSE (多項式 0x1021, 初期値 0xFFFF) で type から body までを対象とする。
+    - 先頭にも 0x00 を送るのは、ファームウェアがテキスト行とバイナリフレームを先頭バイトで見分けるため。
+
+サーバー → ロボット:
+    MSG_TEXT    body = UTF-8のテキストコマンド (固定レイアウトが無いコマンド用)
+    MSG_MOVE    body = <hhhB> x, y, z [0.1mm] (MOVE_KEEP は現在値のまま), speed (1-100)
+    MSG_SERVO   body = <BH> ch, パルス幅 [us]
+    MSG_STATUS  body = なし (REPLY_STATUS が返る)
+    MSG_PING    body = なし (プロトコルの判定用。REPLY_ACK だけが返る)
+
+ロボット → サーバー:
+    REPLY_ACK     body = <B> result (ACK_OK など)。各コマンドの完了時に必ず1回返る (テキストの ';' に相当)
+    REPLY_TEXT    body = テキスト出力の断片 (改行を含む。連結してから行に分割する)
+    REPLY_STATUS  body = <hhh4H> x, y, z [0.1mm], 各サーボのパルス幅 [us]
+"""
+
+MSG_TEXT = 0x01
+MSG_MOVE = 0x02
+MSG_SERVO = 0x03
+MSG_STATUS = 0x04
+MSG_PING = 0x05
+
+REPLY_ACK = 0x80
+REPLY_TEXT = 0x81
+REPLY_STATUS = 0x82
+
+ACK_OK = 0
+ACK_BAD_FRAME = 1
+ACK_UNKNOWN = 2
+
+# MSG_MOVE で「この軸は現在値のまま」を表す値
+MOVE_KEEP = 0x7FFF
+# ファームウェアの受信バッファ (COBS符号化後、区切りを除く) の上限
+MAX_FRAME_SIZE = 72
+
+_MOVE = struct.Struct("<hhhB")
+_SERVO = struct.Struct("<BH")
+_STATUS = struct.Struct("<hhh4H")
+
+_MOVE_PATTERN = re.compile(r"^move((?:\s+[xyzs]=-?\d+(?:\.\d+)?)*)\s*$")
+_MOVE_ARG = re.compile(r"([xyzs])=(-?\d+(?:\.\d+)?)")
+_SERVO_PATTERN = re.compile(r"^c([0-3])=(\d+)$")
+
+class ProtocolError(Exception):
+    """フレームの破損 (CRC不一致、COBSの不正など)"""
+    pass
+
+def crc16(data, crc=0xFFFF):
+    """CRC-16/CCITT-FALSE を計算する"""
+    for byte in data:
+        crc ^= byte << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x1021) if crc & 0x8000 else (crc << 1)
+            crc &= 0xFFFF
+    return crc
+
+def cobs_encode(data):
+    """0x00 を含まないバイト列に符号化する"""
+    out = bytearray()
+    code_index = 0
+    out.append(0)
+    code = 1
+    for byte in data:
+        if byte == 0:
+            out[code_index] = code
+            code_index = len(out)
+            out.append(0)
+            code = 1
+            continue
+        out.append(byte)
+        code += 1
+        if code == 0xFF:
+            out[code_index] = code
+            code_index = len(out)
+            out.append(0)
+            code = 1
+    out[code_index] = code
+    return bytes(out)
+
+def cobs_decode(data):
+    """cobs_encode の逆変換。不正な場合は ProtocolError"""
+    out = bytearray()
+    i = 0
+    n = len(data)
+    while i < n:
+        code = data[i]
+        if code == 0:
+            raise ProtocolError("invalid COBS block")
+        end = i + code
+        if end > n:
+            raise ProtocolError("truncated COBS block")
+        out.extend(data[i + 1:end])
+        i = end
+        if code < 0xFF and i < n:
+            out.append(0)
+    return bytes(out)
+
+def encode_frame(msg_type, seq, body=b""):
+    """メッセージを区切り付きのフレームに符号化する"""
+    payload = bytes([msg_type, seq & 0xFF]) + bytes(body)
+    payload += struct.pack("<H", crc16(payload))
+    return b"\x00" + cobs_encode(payload) + b"\x00"
+
+def decode_frame(data):
+    """
+    区切りを除いたフレーム1個を復号する。
+
+    Returns:
+        tuple: (msg_type, seq, body)
+    """
+    payload = cobs_decode(data)
+    if len(payload) < 4:
+        raise ProtocolError("frame too short")
+    body, (crc,) = payload[:-2], struct.unpack("<H", payload[-2:])
+    if crc16(body) != crc:
+        raise ProtocolError("CRC mismatch")
+    return body[0], body[1], body[2:]
+
+def _to_tenths(value):
+    return int(round(float(value) * 10))
+
+def encode_command(cmd, seq):
+    """
+    テキストコマンド1個 (';' を含まない) をフレームに符号化する。
+    固定レイアウトのある move / c<ch>= は専用メッセージに、それ以外は MSG_TEXT にする。
+    座標は0.1mm単位に丸める。
+    """
+    cmd = cmd.strip()
+    match = _MOVE_PATTERN.match(cmd)
+    if match:
+        args = dict(_MOVE_ARG.findall(match.group(1)))
+        speed = float(args.get("s", 50))
+        coords = [_to_tenths(args[k]) if k in args else MOVE_KEEP for k in ("x", "y", "z")]
+        # 固定レイアウトで表せない値はテキストで送る
+        if speed.is_integer() and 1 <= speed <= 255 and all(-32768 <= c < MOVE_KEEP for c in coords if c != MOVE_KEEP):
+            return encode_frame(MSG_MOVE, seq, _MOVE.pack(*coords, int(speed)))
+    match = _SERVO_PATTERN.match(cmd)
+    if match and int(match.group(2)) <= 0xFFFF:
+        return encode_frame(MSG_SERVO, seq, _SERVO.pack(int(match.group(1)), int(match.group(2))))
+    frame = encode_frame(MSG_TEXT, seq, cmd.encode("utf-8"))
+    if len(frame) - 2 > MAX_FRAME_SIZE:
+        raise ProtocolError(f"command too long for a binary frame: {cmd[:20]}...")
+    return frame
+
+def decode_status(body):
+    """REPLY_STATUS の本文を辞書に変換する"""
+    x, y, z, *us = _STATUS.unpack(body)
+    return {"x": x / 10.0, "y": y / 10.0, "z": z / 10.0, "us": list(us)}
+
+class FrameReader:
+    """受信バイト列から区切り (0x00) ごとのフレームを取り出す"""
+    def __init__(self):
+        self.buffer = bytearray()
+        self.dropped = 0
+
+    def feed(self, data):
+        self.buffer.extend(data)
+
+    def clear(self):
+        self.buffer.clear()
+
+    def frames(self):
+        """
+        完結したフレームを復号して返す。破損したフレーム (テキスト出力の混入など) は読み捨てる。
+
+        Returns:
+            list: [(msg_type, seq, body), ...]
+        """
+        result = []
+        while True:
+            idx = self.buffer.find(b"\x00")
+            if idx < 0:
+                return result
+            chunk = bytes(self.buffer[:idx])
+            del self.buffer[:idx + 1]
+            if not chunk:
+                continue
+            try:
+                result.append(decode_frame(chunk))
+            except ProtocolError:
+                self.dropped += 1
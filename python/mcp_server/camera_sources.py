@@ -0,0 +1,315 @@
+import os
+import glob
+import time
+import threading
+import cv2
+import numpy as np
+
+"""
+カメラ入力の差し替え (カメラソース)。
+
+VisionSystem と FrameGrabber は cv2.VideoCapture 互換のインターフェース
+(isOpened / read / set / get / release) だけを使うため、
+実機のカメラの代わりに録画した動画、静止画のディレクトリ、合成画像を入力にできます。
+ベンチマークや回帰テストを実機なしで実行するために使います。
+
+open_camera_source() に渡す指定 (spec) の例:
+    0                       カメラデバイス (番号)
+    /dev/video2             カメラデバイス (パス)
+    rtsp://...              ネットワークカメラ (cv2.VideoCaptureで開けるURL)
+    capture.mp4             録画した動画ファイル
+    ../../training/images   静止画のディレクトリ (ファイル名順)
+    synthetic               ArUcoマーカーと物体を描いた合成画像
+"""
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+
+class Pacer:
+    """フレームの読み出し間隔を指定したフレームレートに合わせる"""
+    def __init__(self, fps=None):
+        """
+        Args:
+            fps (float, optional): フレームレート。None または 0 以下の場合は待たずに返す。
+        """
+        self.interval = 1.0 / fps if fps and fps > 0 else 0.0
+        self.next_time = None
+
+    def wait(self):
+        """次のフレーム時刻まで待機する"""
+        if self.interval <= 0:
+            return
+        now = time.monotonic()
+        if self.next_time is None or now - self.next_time > self.interval:
+            # 初回、または大きく遅れた場合は基準時刻を取り直す
+            self.next_time = now
+        elif self.next_time > now:
+            time.sleep(self.next_time - now)
+        self.next_time += self.interval
+
+class CameraSource:
+    """
+    cv2.VideoCapture 互換のカメラソースの基底クラス。
+
+    派生クラスは _read_frame() を実装します。read() はフレームレートに合わせて待機してから
+    フレームを返します。get() / set() は幅・高さ・FPSなど一部のプロパティのみ対応し、
+    それ以外は無視します (cv2.VideoCaptureで未対応のプロパティを指定した場合と同じ)。
+    """
+    def __init__(self, fps=None, loop=True):
+        """
+        Args:
+            fps (float, optional): 読み出しのフレームレート。Noneの場合は待たずに返す。
+            loop (bool): 最後まで読んだら先頭に戻るか。Falseの場合は終端で read() が失敗する。
+        """
+        self.fps = fps
+        self.loop = loop
+        self.pacer = Pacer(fps)
+        self.opened = False
+        self.frame_count = 0
+        self.width = 0
+        self.height = 0
+        self.lock = threading.Lock()
+
+    def isOpened(self):
+        return self.opened
+
+    def read(self):
+        """
+        Returns:
+            tuple: (ret, frame)
+        """
+        if not self.opened:
+            return False, None
+        self.pacer.wait()
+        with self.lock:
+            frame = self._read_frame()
+        if frame is None:
+            return False, None
+        self.frame_count += 1
+        return True, frame
+
+    def _read_frame(self):
+        raise NotImplementedError
+
+    def set(self, prop, value):
+        if prop == cv2.CAP_PROP_FPS:
+            self.fps = value
+            self.pacer = Pacer(value)
+            return True
+        return False
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            return float(self.width)
+        if prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            return float(self.height)
+        if prop == cv2.CAP_PROP_FPS:
+            return float(self.fps or 0.0)
+        return 0.0
+
+    def release(self):
+        self.opened = False
+
+    def describe(self):
+        """ソースの説明 (ログ表示用)"""
+        return self.__class__.__name__
+
+class DeviceSource(CameraSource):
+    """実機のカメラ (cv2.VideoCapture) をそのまま使うソース"""
+    def __init__(self, device, width=1920, height=1080):
+        """
+        Args:
+            device (int or str): カメラ番号、デバイスパス、またはストリームのURL。
+            width (int): カメラの横解像度。
+            height (int): カメラの縦解像度。
+        """
+        super().__init__(fps=None, loop=False)
+        self.device = device
+        self.cap = cv2.VideoCapture(device)
+        self.opened = self.cap.isOpened()
+        if self.opened:
+            self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+            self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+            # ドライバ側に古いフレームが溜まらないようにする (対応していないバックエンドでは無視される)
+            self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+
+    def read(self):
+        # カメラ自身がフレームレートを決めるので待機しない
+        return self.cap.read()
+
+    def set(self, prop, value):
+        return self.cap.set(prop, value)
+
+    def get(self, prop):
+        return self.cap.get(prop)
+
+    def release(self):
+        self.opened = False
+        self.cap.release()
+
+    def describe(self):
+        return f"device {self.device}"
+
+class VideoFileSource(CameraSource):
+    """録画した動画ファイルを再生するソース"""
+    def __init__(self, path, loop=True, fps=None):
+        """
+        Args:
+            path (str): 動画ファイルのパス。
+            loop (bool): 最後まで再生したら先頭に戻るか。
+            fps (float, optional): 再生のフレームレート。Noneの場合は動画のフレームレート、
+                0以下の場合は待たずに読み出す (ベンチマーク用)。
+        """
+        self.path = path
+        self.cap = cv2.VideoCapture(path)
+        if fps is None:
+            native = self.cap.get(cv2.CAP_PROP_FPS) if self.cap.isOpened() else 0.0
+            fps = native if native and native > 0 else 30.0
+        super().__init__(fps=fps, loop=loop)
+        self.opened = self.cap.isOpened()
+        if self.opened:
+            self.width = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+            self.height = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+
+    def _read_frame(self):
+        ret, frame = self.cap.read()
+        if not ret and self.loop:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ret, frame = self.cap.read()
+        return frame if ret else None
+
+    def release(self):
+        self.opened = False
+        self.cap.release()
+
+    def describe(self):
+        return f"video {self.path} ({self.fps:g} fps, loop={self.loop})"
+
+class ImageDirectorySource(CameraSource):
+    """ディレクトリ内の静止画をファイル名順に1枚ずつ返すソース"""
+    def __init__(self, path, loop=True, fps=10.0):
+        """
+        Args:
+            path (str): 画像のディレクトリ、またはワイルドカードを含むパターン (例: "images/*.jpg")。
+            loop (bool): 最後の画像まで読んだら先頭に戻るか。
+            fps (float): 読み出しのフレームレート。0以下の場合は待たずに読み出す。
+        """
+        super().__init__(fps=fps, loop=loop)
+        self.path = path
+        if os.path.isdir(path):
+            files = [os.path.join(path, name) for name in os.listdir(path)]
+        else:
+            files = glob.glob(path)
+        self.files = sorted(f for f in files if f.lower().endswith(IMAGE_EXTENSIONS))
+        self.index = 0
+        self.opened = bool(self.files)
+        if self.opened:
+            first = cv2.imread(self.files[0])
+            if first is not None:
+                self.height, self.width = first.shape[:2]
+
+    def _read_frame(self):
+        # 読み込めないファイルは飛ばす (全て失敗したら終了)
+        for _ in range(len(self.files)):
+            if self.index >= len(self.files):
+                if not self.loop:
+                    return None
+                self.index = 0
+            path = self.files[self.index]
+            self.index += 1
+            frame = cv2.imread(path)
+            if frame is not None:
+                return frame
+            print(f"Warning: 画像を読み込めません: {path}")
+        return None
+
+    def describe(self):
+        return f"images {self.path} ({len(self.files)} files, {self.fps:g} fps, loop={self.loop})"
+
+class SyntheticSource(CameraSource):
+    """
+    ArUcoマーカーと色付きの物体を描いた合成画像を生成するソース。
+
+    マーカーは画像中央付近に固定され、物体はゆっくり円を描いて移動します。
+    乱数のシードを固定しているため、毎回同じ画像列が生成されます。
+    """
+    def __init__(self, width=1920, height=1080, fps=30.0, marker_id=0, marker_size_px=None, num_objects=4, seed=0):
+        """
+        Args:
+            width, height (int): 画像サイズ。
+            fps (float): 生成のフレームレート。0以下の場合は待たずに生成する。
+            marker_id (int): 描画するArUcoマーカーのID (DICT_4X4_50)。
+            marker_size_px (int, optional): マーカーの一辺のピクセル数。Noneの場合は画像の高さの1/5。
+            num_objects (int): 描画する物体の数。
+            seed (int): 物体の配置と色を決める乱数のシード。
+        """
+        super().__init__(fps=fps, loop=True)
+        self.width = width
+        self.height = height
+        self.marker_id = marker_id
+        size = int(marker_size_px or height // 5)
+        aruco_dict = cv2.aruco.getPredefinedDictionary(cv2.aruco.DICT_4X4_50)
+        marker = cv2.aruco.generateImageMarker(aruco_dict, marker_id, size)
+
+        # 背景 (机の天板を想定したグレーのグラデーション) とマーカーは一度だけ描画する
+        ramp = np.linspace(150, 190, width, dtype=np.float32)
+        self.background = np.repeat(np.tile(ramp, (height, 1))[:, :, None], 3, axis=2).astype(np.uint8)
+        x0, y0 = (width - size) // 2, (height - size) // 2
+        border = max(4, size // 8)
+        cv2.rectangle(self.background, (x0 - border, y0 - border), (x0 + size + border, y0 + size + border), (255, 255, 255), -1)
+        self.background[y0:y0 + size, x0:x0 + size] = marker[:, :, None]
+        self.marker_rect = (x0, y0, x0 + size, y0 + size)
+
+        rng = np.random.default_rng(seed)
+        palette = [(40, 40, 200), (40, 160, 40), (200, 80, 30), (30, 200, 220), (160, 40, 160), (40, 40, 40)]
+        self.objects = []
+        for i in range(num_objects):
+            self.objects.append({
+                "radius": int(rng.uniform(0.03, 0.05) * height),
+                "orbit": float(rng.uniform(0.28, 0.4) * height),
+                "phase": float(rng.uniform(0, 2 * np.pi)),
+                "speed": float(rng.uniform(0.05, 0.2)),
+                "color": palette[i % len(palette)]
+            })
+        self.opened = True
+
+    def _read_frame(self):
+        frame = self.background.copy()
+        t = self.frame_count / (self.fps if self.fps and self.fps > 0 else 30.0)
+        cx, cy = self.width // 2, self.height // 2
+        for obj in self.objects:
+            angle = obj["phase"] + obj["speed"] * t
+            x = int(cx + obj["orbit"] * 1.6 * np.cos(angle))
+            y = int(cy + obj["orbit"] * np.sin(angle))
+            cv2.circle(frame, (x + 4, y + 6), obj["radius"], (90, 90, 90), -1, cv2.LINE_AA)
+            cv2.circle(frame, (x, y), obj["radius"], obj["color"], -1, cv2.LINE_AA)
+        return frame
+
+    def describe(self):
+        return f"synthetic {self.width}x{self.height} ({self.fps:g} fps, marker {self.marker_id})"
+
+def open_camera_source(spec, width=1920, height=1080, loop=True, fps=None, marker_id=0):
+    """
+    指定 (spec) に応じたカメラソースを作成する。
+
+    Args:
+        spec (int or str): カメラ番号、デバイスパス、URL、動画ファイル、画像ディレクトリ、または "synthetic"。
+        width, height (int): カメラ・合成画像の解像度。
+        loop (bool): 動画・画像ディレクトリを繰り返し再生するか。
+        fps (float, optional): 読み出しのフレームレート。Noneの場合はソースごとの既定値
+            (動画: ファイルのフレームレート、画像: 10fps、合成: 30fps)。0の場合は待たずに読み出す。
+        marker_id (int): 合成画像に描画するArUcoマーカーのID。
+
+    Returns:
+        CameraSource: 開いたカメラソース。開けたかどうかは isOpened() で確認する。
+    """
+    if isinstance(spec, str) and spec.strip().isdigit():
+        spec = int(spec)
+    if isinstance(spec, int):
+        return DeviceSource(spec, width, height)
+    if spec == "synthetic":
+        return SyntheticSource(width, height, fps=30.0 if fps is None else fps, marker_id=marker_id)
+    if "://" in spec or spec.startswith("/dev/"):
+        return DeviceSource(spec, width, height)
+    if os.path.isdir(spec) or any(c in spec for c in "*?["):
+        return ImageDirectorySource(spec, loop=loop, fps=10.0 if fps is None else fps)
+    return VideoFileSource(spec, loop=loop, fps=fps)
@@ -0,0 +1,117 @@
+import threading
+import cv2
+import numpy as np
+
+COLOR_NAMES = ["black", "white", "gray", "red", "orange", "yellow", "green", "blue", "purple", "pink", "unknown"]
+
+_color_lut = None
+_color_lut_lock = threading.Lock()
+
+def _build_color_lut():
+    """
+    HSV (OpenCV: H 0-179, S/V 0-255) から色名インデックスを引く (180, 256, 256) のルックアップテーブルを作成する。
+    判定ルールは以前の VisionSystem._hsv_to_color_name と同じです。
+    """
+    h = np.arange(180, dtype=np.int16)[:, None, None]
+    s = np.arange(256, dtype=np.int16)[None, :, None]
+    v = np.arange(256, dtype=np.int16)[None, None, :]
+
+    # 色相による判定
+    hue_names = np.select(
+        [(h < 5) | (h >= 179), h < 35, h < 60, h < 95, h < 115, h < 175, h < 179],
+        [COLOR_NAMES.index(n) for n in ("red", "orange", "yellow", "green", "blue", "purple", "pink")],
+        default=COLOR_NAMES.index("unknown")
+    ).astype(np.uint8)
+
+    # 白が青っぽく誤判定されるのを防ぐため、青色領域(90-125)では彩度しきい値を上げる
+    s_thresh = np.where((h >= 90) & (h < 125), 80, 55)
+    white_or_gray = np.where(v > 190, COLOR_NAMES.index("white"), COLOR_NAMES.index("gray")).astype(np.uint8)
+
+    lut = np.where(s < s_thresh, white_or_gray, hue_names)
+    # 明度が極端に低い場合は黒
+    lut = np.where(v < 65, np.uint8(COLOR_NAMES.index("black")), lut)
+    return np.ascontiguousarray(np.broadcast_to(lut, (180, 256, 256)), dtype=np.uint8)
+
+def get_color_lut():
+    """色名ルックアップテーブルを返す（初回呼び出し時に作成）。"""
+    global _color_lut
+    with _color_lut_lock:
+        if _color_lut is None:
+            _color_lut = _build_color_lut()
+        return _color_lut
+
+def hsv_to_color_name(h, s, v):
+    """HSV値から簡易的な色名を判定する"""
+    return COLOR_NAMES[get_color_lut()[int(h) % 180, int(s), int(v)]]
+
+class ColorEngine:
+    """
+    フレーム内の複数ROIの代表色をまとめて算出するクラス。
+
+    フレーム毎に一度だけ積分画像を作成し、各ROIの平均色を4点の参照で求めます。
+    平均はBGR空間で取り（色相は円環なのでHSVのまま平均すると赤付近で破綻するため）、
+    全ROI分をまとめて1回でHSVへ変換し、色名はルックアップテーブルで判定します。
+    """
+    def __init__(self):
+        self.lut = get_color_lut()
+        self.frame_id = None
+        self.integral = None
+        self.lock = threading.Lock()
+
+    def prepare(self, frame, frame_id=0):
+        """
+        フレームの積分画像を作成する。同じ frame_id で既に作成済みの場合は再利用する。
+
+        Args:
+            frame (np.ndarray): BGR画像。
+            frame_id (int): フレームID。0の場合は常に作り直す。
+        """
+        with self.lock:
+            if frame_id and frame_id == self.frame_id and self.integral is not None:
+                return self.integral
+            integral = cv2.integral(frame, sdepth=cv2.CV_32S)
+            self.integral = integral
+            self.frame_id = frame_id
+            return integral
+
+    def roi_colors(self, frame, rects, frame_id=0):
+        """
+        ROIのリストについて代表色を算出する。
+
+        Args:
+            frame (np.ndarray): BGR画像。
+            rects (list): [(x1, y1, x2, y2), ...] ピクセル単位 (x2, y2 は含まない)。
+            frame_id (int): 積分画像の再利用に使うフレームID。
+
+        Returns:
+            list: 各ROIの {"hsv": {"h", "s", "v"}, "name": str}。空のROIはNone。
+        """
+        if len(rects) == 0:
+            return []
+        h_img, w_img = frame.shape[:2]
+        integral = self.prepare(frame, frame_id)
+
+        r = np.asarray(rects, dtype=np.int64).reshape(-1, 4)
+        x1 = np.clip(r[:, 0], 0, w_img)
+        y1 = np.clip(r[:, 1], 0, h_img)
+        x2 = np.clip(r[:, 2], 0, w_img)
+        y2 = np.clip(r[:, 3], 0, h_img)
+        area = (x2 - x1) * (y2 - y1)
+        valid = (x2 > x1) & (y2 > y1)
+
+        sums = (integral[y2, x2].astype(np.int64) - integral[y1, x2] - integral[y2, x1] + integral[y1, x1])
+        means_bgr = (sums / np.maximum(area, 1)[:, None]).astype(np.uint8)
+
+        hsv = cv2.cvtColor(means_bgr.reshape(1, -1, 3), cv2.COLOR_BGR2HSV).reshape(-1, 3)
+        names = self.lut[hsv[:, 0], hsv[:, 1], hsv[:, 2]]
+
+        results = []
+        for i in range(len(r)):
+            if not valid[i]:
+                results.append(None)
+                continue
+            results.append({
+                "hsv": {"h": int(hsv[i, 0]), "s": int(hsv[i, 1]), "v": int(hsv[i, 2])},
+                "name": COLOR_NAMES[names[i]]
+            })
+        return results
@@ -0,0 +1,132 @@
+import threading
+import time
+
+class DetectionService:
+    """
+    バックグラウンドで物体検出を繰り返し実行し、最新の検出結果(シーンスナップショット)を公開するクラス。
+
+    MCPツールは推論を待たずに最新のスナップショットを即座に読み出せます。
+    一定時間検出要求が無い場合、ワーカースレッドは自動的に休止し、
+    次の要求 (request) で再開します。
+
+    スナップショットの形式:
+        {"frame_id": int, "timestamp": float (UNIX時刻), "monotonic": float,
+         "confidence": float, "detections": [...] (マーカー座標系)}
+    """
+    def __init__(self, get_vision_system, get_model, interval_sec=0.2, idle_timeout_sec=30.0):
+        """
+        Args:
+            get_vision_system (callable): VisionSystemを返す関数（遅延初期化に対応）。
+            get_model (callable): 推論モデル (バックエンド) を返す関数。
+            interval_sec (float): 検出を実行する最小間隔(秒)。
+            idle_timeout_sec (float): 最後の要求からこの時間が経過すると休止する(秒)。
+        """
+        self.get_vision_system = get_vision_system
+        self.get_model = get_model
+        self.interval_sec = interval_sec
+        self.idle_timeout_sec = idle_timeout_sec
+        self.cond = threading.Condition()
+        self.wake = threading.Event()
+        self.snapshot = None
+        self.last_request_time = 0.0
+        self.paused = True
+        self.runs = 0
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        """ワーカースレッドを開始します（検出要求が来るまでは休止しています）。"""
+        if self.running:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """ワーカースレッドを停止します。"""
+        self.running = False
+        self.wake.set()
+        if self.thread:
+            self.thread.join(timeout=2.0)
+
+    def request(self):
+        """検出結果が必要であることを通知します（休止中であれば再開します）。"""
+        self.last_request_time = time.monotonic()
+        self.wake.set()
+
+    def latest(self):
+        """最新のスナップショットを返します。まだ無い場合はNone。"""
+        with self.cond:
+            return self.snapshot
+
+    def snapshot_age_ms(self, snapshot):
+        """スナップショットの経過時間(ミリ秒)"""
+        return (time.monotonic() - snapshot["monotonic"]) * 1000.0
+
+    def publish(self, frame_id, detections, confidence):
+        """
+        検出結果を最新のスナップショットとして公開します。
+        ツール呼び出しで同期的に検出した結果もここから共有できます。
+        """
+        snapshot = {
+            "frame_id": frame_id,
+            "timestamp": time.time(),
+            "monotonic": time.monotonic(),
+            "confidence": confidence,
+            "detections": detections
+        }
+        with self.cond:
+            # 古いフレームの結果で新しいスナップショットを上書きしない
+            if self.snapshot is None or frame_id >= self.snapshot["frame_id"]:
+                self.snapshot = snapshot
+            self.cond.notify_all()
+        return snapshot
+
+    def wait_for_snapshot(self, max_age_ms, timeout=5.0):
+        """
+        経過時間が max_age_ms 以下のスナップショットが公開されるまで待機します。
+
+        Returns:
+            dict: スナップショット。タイムアウトした場合はNone。
+        """
+        self.request()
+        with self.cond:
+            if self.cond.wait_for(lambda: self.snapshot is not None and self.snapshot_age_ms(self.snapshot) <= max_age_ms, timeout):
+                return self.snapshot
+            return None
+
+    def _loop(self):
+        """検出ループ（別スレッドで実行）"""
+        while self.running:
+            if time.monotonic() - self.last_request_time > self.idle_timeout_sec:
+                # 最近検出要求が無いので休止する
+                self.paused = True
+                self.wake.wait(1.0)
+                self.wake.clear()
+                continue
+            self.paused = False
+
+            started = time.monotonic()
+            vs = self.get_vision_system()
+            model = self.get_model() if vs else None
+            if not vs or not model:
+                time.sleep(1.0)
+                continue
+
+            try:
+                vs.update_pose(undistort_frame=True)
+                confidence = vs.detection_floor_confidence
+                if vs.tracking_enabled:
+                    detections, info = vs.track_objects(model, confidence)
+                else:
+                    detections, info = vs.detect_objects_ex(model, confidence)
+                self.publish(info["frame_id"], detections, confidence)
+                self.runs += 1
+            except Exception as e:
+                print(f"Detection service error: {e}")
+                time.sleep(1.0)
+                continue
+
+            elapsed = time.monotonic() - started
+            if elapsed < self.interval_sec:
+                time.sleep(self.interval_sec - elapsed)
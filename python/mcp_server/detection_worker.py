@@ -0,0 +1,143 @@
+import time
+import threading
+import queue
+import multiprocessing
+from frame_bus import FrameBus, FrameBusReader
+from inference_backend import load_backend, warmup
+
+def _worker_main(model_path, backend, imgsz, threads, request_queue, result_queue):
+    """検出ワーカープロセスのメインループ"""
+    try:
+        model = load_backend(model_path, backend, imgsz, threads)
+        warmup(model)
+    except Exception as e:
+        result_queue.put((0, None, str(e)))
+        return
+    readers = {}
+    result_queue.put((0, None, None))  # 準備完了の通知
+
+    while True:
+        req = request_queue.get()
+        if req is None:
+            break
+        req_id, bus_name, shape, num_slots, slot, frame_shape, confidence = req
+        try:
+            reader = readers.get(bus_name)
+            if reader is None:
+                # フレームサイズ変更などで新しいバスが作られた場合は古いものを解除する
+                for old in readers.values():
+                    old.close()
+                readers = {bus_name: FrameBusReader(bus_name, shape, num_slots)}
+                reader = readers[bus_name]
+            boxes = model.predict_boxes(reader.frame(slot, frame_shape), confidence)
+            result_queue.put((req_id, boxes, None))
+        except Exception as e:
+            result_queue.put((req_id, None, str(e)))
+
+    for reader in readers.values():
+        reader.close()
+
+class DetectionWorkerClient:
+    """
+    YOLO推論を別プロセスで実行する検出ワーカーのクライアント。
+
+    フレームは共有メモリのフレームバス経由でゼロコピーで渡し、検出結果だけを
+    キューで受け取ります。推論がMCPサーバープロセスのGILを占有しないため、
+    推論中もツール呼び出しやジョイパッドループが停止しません。
+    VisionSystem.detect_objects にモデルの代わりに渡して使用します。
+    """
+    def __init__(self, model_path, backend="auto", imgsz=640, threads=None, num_slots=4, timeout=60.0):
+        """
+        Args:
+            model_path (str): YOLOモデルファイルのパス。
+            backend (str): 推論バックエンド (inference_backend.load_backend を参照)。
+            imgsz (int): 推論時の入力サイズ。
+            threads (int, optional): 推論に使うCPUスレッド数。
+            num_slots (int): フレームバスのスロット数。
+            timeout (float): 推論結果を待つ最大時間(秒)。
+        """
+        self.model_path = model_path
+        self.num_slots = num_slots
+        self.timeout = timeout
+        ctx = multiprocessing.get_context('spawn')
+        self.request_queue = ctx.Queue()
+        self.result_queue = ctx.Queue()
+        self.process = ctx.Process(target=_worker_main, args=(model_path, backend, imgsz, threads, self.request_queue, self.result_queue), daemon=True)
+        self.process.start()
+        self.bus = None
+        self.req_id = 0
+        self.lock = threading.Lock()
+
+    def wait_ready(self, timeout=None):
+        """
+        ワーカープロセスがモデルの読み込みとウォームアップを終えるまで待機します。
+        読み込みに失敗した場合は RuntimeError を送出します。
+        """
+        deadline = time.monotonic() + (timeout or self.timeout)
+        with self.lock:
+            while True:
+                try:
+                    _, _, error = self.result_queue.get(timeout=0.5)
+                    break
+                except queue.Empty:
+                    if not self.process.is_alive():
+                        raise RuntimeError("Detection worker process exited during startup.")
+                    if time.monotonic() > deadline:
+                        raise TimeoutError("Detection worker did not become ready in time.")
+            if error:
+                raise RuntimeError(f"Detection worker failed to load model: {error}")
+
+    def reserve(self, shape):
+        """
+        指定した形状のフレームが収まるフレームバスを用意します。
+        フルフレームの形状を予約しておけば、クロップのサイズが変わってもバスを作り直しません。
+        """
+        with self.lock:
+            self._ensure_bus(shape)
+
+    def _ensure_bus(self, shape):
+        if self.bus is not None and self.bus.fits(shape):
+            return
+        # スロットは大きくするだけにする
+        shape = tuple(shape)
+        if self.bus is not None:
+            if len(self.bus.shape) == len(shape):
+                shape = tuple(max(n, m) for n, m in zip(shape, self.bus.shape))
+            self.bus.close()
+        self.bus = FrameBus(shape, self.num_slots)
+
+    def predict_boxes(self, frame, confidence, frame_id=0):
+        """
+        フレームをフレームバスへ書き込み、ワーカープロセスの推論結果を返します。
+        戻り値の形式は inference_backend の各バックエンドの predict_boxes と同じです。
+        """
+        with self.lock:
+            if not self.process.is_alive():
+                raise RuntimeError("Detection worker process is not running.")
+            self._ensure_bus(frame.shape)
+            slot = self.bus.publish(frame, frame_id)
+
+            self.req_id += 1
+            self.request_queue.put((self.req_id, self.bus.name, self.bus.shape, self.num_slots, slot, frame.shape, confidence))
+            while True:
+                try:
+                    req_id, boxes, error = self.result_queue.get(timeout=self.timeout)
+                except queue.Empty:
+                    raise TimeoutError("Detection worker did not respond in time.")
+                if req_id == self.req_id:
+                    break
+            if error:
+                raise RuntimeError(f"Detection worker error: {error}")
+            return boxes
+
+    def close(self):
+        """ワーカープロセスを停止し、フレームバスを解放します。"""
+        try:
+            self.request_queue.put(None)
+            self.process.join(timeout=2.0)
+        finally:
+            if self.process.is_alive():
+                self.process.terminate()
+            if self.bus is not None:
+                self.bus.close()
+                self.bus = None
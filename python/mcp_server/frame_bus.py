@@ -0,0 +1,85 @@
+import threading
+import numpy as np
+from multiprocessing import shared_memory
+
+class FrameBus:
+    """
+    multiprocessing.shared_memory 上の固定スロットにフレームを書き込むフレームバス（書き込み側）。
+
+    スロットはリング状に再利用されます。読み出し側のプロセスは FrameBusReader で
+    同じ共有メモリにアタッチし、コピーせずにフレームを参照します。
+    スロットより小さいフレーム (ワークスペースのクロップなど) はスロットの左上に書き込むので、
+    クロップのサイズが変わっても共有メモリを作り直す必要がありません。
+    """
+    def __init__(self, shape, num_slots=4, dtype=np.uint8):
+        """
+        Args:
+            shape (tuple): 1スロットの形状 (height, width, channels)。書き込むフレームの最大サイズ。
+            num_slots (int): スロット数。
+            dtype: 画素のデータ型。
+        """
+        self.shape = tuple(shape)
+        self.num_slots = num_slots
+        self.dtype = np.dtype(dtype)
+        slot_bytes = int(np.prod(self.shape)) * self.dtype.itemsize
+        self.shm = shared_memory.SharedMemory(create=True, size=slot_bytes * num_slots)
+        self.frames = np.ndarray((num_slots,) + self.shape, dtype=self.dtype, buffer=self.shm.buf)
+        self.slot_frame_ids = [None] * num_slots  # スロット毎の (frame_id, 形状)
+        self.next_slot = 0
+        self.lock = threading.Lock()
+
+    @property
+    def name(self):
+        """共有メモリ名（読み出し側がアタッチに使用）"""
+        return self.shm.name
+
+    def fits(self, shape):
+        """指定した形状のフレームをスロットに書き込めるか"""
+        return len(shape) == len(self.shape) and all(n <= m for n, m in zip(shape, self.shape))
+
+    def publish(self, frame, frame_id=0):
+        """
+        フレームを次のスロットの左上へ書き込み、スロット番号を返します。
+        同じ frame_id の同じ形状のフレームが既にスロットにあれば書き込みを省略します。
+        frame_id が同じでも画素が異なる場合 (同じフレームから切り出した別の領域など) は frame_id=0 を指定します。
+        """
+        if not self.fits(frame.shape):
+            raise ValueError(f"Frame {frame.shape} does not fit the frame bus slot {self.shape}")
+        key = (frame_id, frame.shape)
+        with self.lock:
+            if frame_id and key in self.slot_frame_ids:
+                return self.slot_frame_ids.index(key)
+            slot = self.next_slot
+            self.next_slot = (self.next_slot + 1) % self.num_slots
+            np.copyto(self.frames[slot][tuple(slice(0, n) for n in frame.shape)], frame)
+            self.slot_frame_ids[slot] = key
+            return slot
+
+    def close(self):
+        """共有メモリを解放します。"""
+        self.frames = None
+        self.shm.close()
+        self.shm.unlink()
+
+class FrameBusReader:
+    """
+    FrameBus の共有メモリにアタッチしてフレームを参照する読み出し側（ワーカープロセス側）。
+    """
+    def __init__(self, name, shape, num_slots, dtype=np.uint8):
+        self.shape = tuple(shape)
+        self.shm = shared_memory.SharedMemory(name=name)
+        self.frames = np.ndarray((num_slots,) + self.shape, dtype=np.dtype(dtype), buffer=self.shm.buf)
+
+    def frame(self, slot, shape=None):
+        """
+        指定スロットのフレームをコピーせずに返します。
+        shape を指定した場合は、スロットの左上の同じ形状の領域 (publish したフレーム) を返します。
+        """
+        if shape is None:
+            return self.frames[slot]
+        return self.frames[slot][tuple(slice(0, n) for n in shape)]
+
+    def close(self):
+        """アタッチを解除します（共有メモリ自体は書き込み側が解放します）。"""
+        self.frames = None
+        self.shm.close()
@@ -0,0 +1,112 @@
+import threading
+import time
+from collections import deque
+from metrics import observe
+
+class FrameGrabber:
+    """
+    カメラからのフレーム取得を専用スレッドで行うクラス。
+
+    cv2.VideoCapture はこのクラスのスレッドだけが読み出し、取得したフレームは
+    フレームIDと単調増加タイムスタンプ付きで小さなリングバッファに格納されます。
+    読み出し側(姿勢推定、MJPEG配信、GUIなど)はカメラI/Oを待たずに最新フレームを参照できます。
+    """
+    def __init__(self, cap, buffer_size=3):
+        """
+        Args:
+            cap: 読み出し対象のキャプチャオブジェクト (cv2.VideoCapture)。
+            buffer_size (int): リングバッファに保持するフレーム数。
+        """
+        self.cap = cap
+        self.buffer = deque(maxlen=buffer_size)
+        self.cond = threading.Condition()
+        self.frame_id = 0
+        self.running = False
+        self.thread = None
+        self.read_errors = 0
+
+    def start(self):
+        """キャプチャスレッドを開始します。"""
+        if self.running:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self._capture_loop, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """キャプチャスレッドを停止します。"""
+        self.running = False
+        with self.cond:
+            self.cond.notify_all()
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join(timeout=1.0)
+        self.thread = None
+
+    def _capture_loop(self):
+        """キャプチャループ（別スレッドで実行）。カメラのネイティブレートで読み続ける。"""
+        while self.running:
+            if not self.grab():
+                time.sleep(0.01)
+
+    def grab(self):
+        """
+        フレームを1枚読み出してリングバッファに格納します。
+        キャプチャスレッドを止めた状態で呼ぶと、フレームを1枚ずつ進められます (ベンチマーク用)。
+
+        Returns:
+            int: 格納したフレームのID。読み出しに失敗した場合は0。
+        """
+        started = time.perf_counter()
+        ret, frame = self.cap.read()
+        observe("capture", time.perf_counter() - started)
+        if not ret:
+            self.read_errors += 1
+            return 0
+        with self.cond:
+            self.frame_id += 1
+            self.buffer.append((self.frame_id, time.monotonic(), frame))
+            self.cond.notify_all()
+            return self.frame_id
+
+    def latest(self):
+        """
+        最新フレームを待たずに返します。
+
+        Returns:
+            tuple: (frame_id, timestamp, frame)。まだフレームがない場合は (0, 0.0, None)。
+        """
+        with self.cond:
+            if not self.buffer:
+                return 0, 0.0, None
+            return self.buffer[-1]
+
+    def wait_for_frame(self, after_id=0, timeout=1.0):
+        """
+        frame_id が after_id より新しいフレームが届くまで待機して返します。
+
+        Returns:
+            tuple: (frame_id, timestamp, frame)。タイムアウト時は (0, 0.0, None)。
+        """
+        deadline = time.monotonic() + timeout
+        with self.cond:
+            while self.running and (not self.buffer or self.buffer[-1][0] <= after_id):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return 0, 0.0, None
+                self.cond.wait(remaining)
+            if not self.buffer or self.buffer[-1][0] <= after_id:
+                return 0, 0.0, None
+            return self.buffer[-1]
+
+    def read(self, timeout=1.0):
+        """
+        cv2.VideoCapture.read() 互換の読み出し。最新フレームを返し、
+        起動直後でまだフレームがない場合のみ最初のフレームを待つ。
+
+        Returns:
+            tuple: (ret, frame, frame_id)
+        """
+        frame_id, _, frame = self.latest()
+        if frame is None:
+            frame_id, _, frame = self.wait_for_frame(0, timeout)
+        return frame is not None, frame, frame_id
@@ -0,0 +1,68 @@
+import time
+import numpy as np
+
+def _readonly(value):
+    """ndarrayを書き込み禁止のビューにする (元の配列はコピーしない)"""
+    if isinstance(value, np.ndarray) and value.flags.writeable:
+        value = value.view()
+        value.flags.writeable = False
+    return value
+
+class FrameSnapshot:
+    """
+    歪み補正済みフレームと、その時点のカメラ姿勢をまとめた不変のスナップショット。
+
+    VisionSystem は姿勢やフレームが更新されるたびに新しいスナップショットを作成し、
+    参照を丸ごと差し替えます。読み出し側は参照を1回取得するだけで、
+    ロックを保持したままフレームや姿勢をコピーする必要がありません。
+    フレームと姿勢の配列は書き込み禁止なので、描画する場合は copy_frame() でコピーしてから描画します。
+    """
+    __slots__ = ("frame", "frame_id", "timestamp", "rvec", "tvec", "R", "camera_pos")
+
+    def __init__(self, frame=None, frame_id=0, timestamp=0.0, rvec=None, tvec=None, R=None, camera_pos=None):
+        """
+        Args:
+            frame (np.ndarray, optional): 歪み補正済みのBGR画像。
+            frame_id (int): フレームID (FrameGrabberの連番)。
+            timestamp (float): フレームを処理したUNIX時刻。
+            rvec, tvec, R, camera_pos (np.ndarray, optional): カメラ姿勢。マーカー未検出の場合はNone。
+        """
+        for name, value in zip(self.__slots__, (frame, frame_id, timestamp, rvec, tvec, R, camera_pos)):
+            object.__setattr__(self, name, _readonly(value))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("FrameSnapshot is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("FrameSnapshot is immutable")
+
+    @property
+    def has_frame(self):
+        return self.frame is not None
+
+    @property
+    def has_pose(self):
+        return self.rvec is not None and self.tvec is not None
+
+    @property
+    def image_size(self):
+        """(width, height)。フレームが無い場合はNone。"""
+        if self.frame is None:
+            return None
+        return self.frame.shape[1], self.frame.shape[0]
+
+    def age(self):
+        """フレームを処理してからの経過時間(秒)"""
+        return time.time() - self.timestamp
+
+    def copy_frame(self):
+        """描画用に書き込み可能なフレームのコピーを返す"""
+        return self.frame.copy() if self.frame is not None else None
+
+    def with_pose(self, rvec, tvec, R, camera_pos):
+        """フレームはそのままで、姿勢だけを差し替えたスナップショットを返す"""
+        return FrameSnapshot(self.frame, self.frame_id, self.timestamp, rvec, tvec, R, camera_pos)
+
+    def __repr__(self):
+        size = self.image_size
+        return f"FrameSnapshot(frame_id={self.frame_id}, size={size}, pose={'yes' if self.has_pose else 'no'})"
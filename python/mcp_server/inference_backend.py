@@ -0,0 +1,265 @@
+import os
+import ast
+import glob
+import time
+import threading
+import cv2
+import numpy as np
+
+"""
+YOLO推論バックエンド。
+
+学習済みの .pt を ultralytics/PyTorch で実行する他に、GPUの無いPC向けに
+CPUで高速な書き出し形式 (ONNX Runtime / OpenVINO) を選択できます。
+どのバックエンドも predict_boxes(frame, confidence, frame_id=0) を持ち、
+戻り値は [{"xyxy": [x1, y1, x2, y2], "cls": int, "label": str, "conf": float}, ...]
+(座標は入力フレームのピクセル単位) です。
+推論はスレッドセーフではないため、各バックエンドは推論をロックで直列化します
+(検出サービスのスレッドとツールのスレッドから同時に呼ばれることがある)。
+"""
+
+BACKENDS = ("auto", "ultralytics", "onnx", "openvino")
+
+def predict_boxes(model, frame, confidence, imgsz=None):
+    """
+    ultralytics.YOLO モデルで推論し、バウンディングボックスのリストを返します。
+
+    Returns:
+        list: [{"xyxy": [x1, y1, x2, y2], "cls": int, "label": str, "conf": float}, ...]
+              (座標はピクセル単位)
+    """
+    kwargs = {"imgsz": imgsz} if imgsz else {}
+    results = model.predict(frame, conf=confidence, verbose=False, **kwargs)
+    result = results[0]
+    boxes = []
+    for box in result.boxes:
+        cls_id = int(box.cls[0])
+        boxes.append({
+            "xyxy": box.xyxy[0].tolist(),
+            "cls": cls_id,
+            "label": result.names[cls_id],
+            "conf": float(box.conf[0])
+        })
+    return boxes
+
+def _parse_names(names):
+    """メタデータのクラス名 (文字列化された辞書、辞書、リスト) を {id: name} に変換する"""
+    if isinstance(names, str):
+        try:
+            names = ast.literal_eval(names)
+        except (ValueError, SyntaxError):
+            return {}
+    if isinstance(names, (list, tuple)):
+        names = dict(enumerate(names))
+    return {int(k): str(v) for k, v in names.items()} if isinstance(names, dict) else {}
+
+class UltralyticsBackend:
+    """ultralytics/PyTorch で .pt モデル (またはultralyticsが読める任意の形式) を実行する"""
+    name = "ultralytics"
+
+    def __init__(self, model_path, imgsz=None, threads=None):
+        from ultralytics import YOLO
+        if threads:
+            try:
+                import torch
+                torch.set_num_threads(threads)
+            except ImportError:
+                pass
+        self.model = YOLO(model_path)
+        self.imgsz = imgsz
+        self.lock = threading.Lock()
+
+    def predict_boxes(self, frame, confidence, frame_id=0):
+        with self.lock:
+            return predict_boxes(self.model, frame, confidence, self.imgsz)
+
+class _ExportedYoloBackend:
+    """
+    書き出し済みYOLOモデル (出力形状 (1, 4 + クラス数, アンカー数)) の共通処理。
+    レターボックス前処理と、信頼度フィルタ・クラス毎のNMSによる後処理を行います。
+    """
+    name = None
+    iou_threshold = 0.7  # ultralytics の predict と同じ既定値
+
+    def __init__(self, imgsz=640):
+        self.imgsz = imgsz or 640
+        self.input_size = (self.imgsz, self.imgsz)  # (height, width)
+        self.names = {}
+        self.lock = threading.Lock()  # 前処理・後処理は並行に実行できるので、_infer だけを直列化する
+
+    def _infer(self, blob):
+        """(1, 3, H, W) float32 の入力から生の出力配列を返す (派生クラスで実装)"""
+        raise NotImplementedError
+
+    def _letterbox(self, frame):
+        """アスペクト比を保って入力サイズに縮小し、余白を灰色(114)で埋める"""
+        in_h, in_w = self.input_size
+        h, w = frame.shape[:2]
+        scale = min(in_h / h, in_w / w)
+        new_w, new_h = int(round(w * scale)), int(round(h * scale))
+        pad_x, pad_y = (in_w - new_w) / 2, (in_h - new_h) / 2
+        resized = cv2.resize(frame, (new_w, new_h), interpolation=cv2.INTER_LINEAR) if (new_w, new_h) != (w, h) else frame
+        top, left = int(round(pad_y - 0.1)), int(round(pad_x - 0.1))
+        bottom, right = in_h - new_h - top, in_w - new_w - left
+        padded = cv2.copyMakeBorder(resized, top, bottom, left, right, cv2.BORDER_CONSTANT, value=(114, 114, 114))
+        return padded, scale, left, top
+
+    def predict_boxes(self, frame, confidence, frame_id=0):
+        img, scale, pad_x, pad_y = self._letterbox(frame)
+        blob = cv2.dnn.blobFromImage(img, 1.0 / 255.0, swapRB=True)
+        with self.lock:
+            output = np.asarray(self._infer(blob))[0]  # (4 + nc, anchors)
+        preds = output.T
+
+        scores_all = preds[:, 4:]
+        cls_ids = scores_all.argmax(axis=1)
+        scores = scores_all[np.arange(len(preds)), cls_ids]
+        keep = scores >= confidence
+        if not np.any(keep):
+            return []
+        preds, cls_ids, scores = preds[keep], cls_ids[keep], scores[keep]
+
+        # xywh (入力画像座標) -> xyxy (元フレーム座標)
+        h, w = frame.shape[:2]
+        xy, wh = preds[:, :2], preds[:, 2:4]
+        xyxy = np.concatenate([xy - wh / 2, xy + wh / 2], axis=1)
+        xyxy -= [pad_x, pad_y, pad_x, pad_y]
+        xyxy /= scale
+        xyxy[:, [0, 2]] = xyxy[:, [0, 2]].clip(0, w)
+        xyxy[:, [1, 3]] = xyxy[:, [1, 3]].clip(0, h)
+
+        # クラス毎のNMS (クラスIDに応じて座標をずらし、1回の呼び出しで処理する)
+        offset = cls_ids[:, None] * float(max(h, w) + 1)
+        nms_boxes = xyxy + offset
+        nms_xywh = np.concatenate([nms_boxes[:, :2], nms_boxes[:, 2:] - nms_boxes[:, :2]], axis=1)
+        indices = cv2.dnn.NMSBoxes(nms_xywh.tolist(), scores.astype(float).tolist(), confidence, self.iou_threshold)
+
+        boxes = []
+        for i in np.array(indices).flatten():
+            cls_id = int(cls_ids[i])
+            boxes.append({
+                "xyxy": [float(v) for v in xyxy[i]],
+                "cls": cls_id,
+                "label": self.names.get(cls_id, str(cls_id)),
+                "conf": float(scores[i])
+            })
+        boxes.sort(key=lambda b: b["conf"], reverse=True)
+        return boxes
+
+class OnnxBackend(_ExportedYoloBackend):
+    """ONNX Runtime (CPU) で .onnx モデルを実行する"""
+    name = "onnx"
+
+    def __init__(self, model_path, imgsz=640, threads=None):
+        super().__init__(imgsz)
+        import onnxruntime as ort
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(model_path, sess_options=options, providers=["CPUExecutionProvider"])
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        # 固定形状で書き出されたモデルは、その入力サイズを優先する
+        in_h, in_w = model_input.shape[2:4]
+        if isinstance(in_h, int) and isinstance(in_w, int):
+            self.input_size = (in_h, in_w)
+        self.names = _parse_names(self.session.get_modelmeta().custom_metadata_map.get("names", {}))
+
+    def _infer(self, blob):
+        return self.session.run(None, {self.input_name: blob})[0]
+
+class OpenVinoBackend(_ExportedYoloBackend):
+    """OpenVINO (CPU) で .xml モデル、または ultralytics の *_openvino_model ディレクトリを実行する"""
+    name = "openvino"
+
+    def __init__(self, model_path, imgsz=640, threads=None):
+        super().__init__(imgsz)
+        import openvino as ov
+        if os.path.isdir(model_path):
+            xml_files = glob.glob(os.path.join(model_path, "*.xml"))
+            if not xml_files:
+                raise FileNotFoundError(f"No OpenVINO .xml model found in {model_path}")
+            model_path = xml_files[0]
+        core = ov.Core()
+        model = core.read_model(model_path)
+        partial_shape = model.inputs[0].get_partial_shape()
+        if partial_shape.is_static:
+            self.input_size = (partial_shape[2].get_length(), partial_shape[3].get_length())
+        else:
+            model.reshape([1, 3, self.input_size[0], self.input_size[1]])
+        config = {"PERFORMANCE_HINT": "LATENCY"}
+        if threads:
+            config["INFERENCE_NUM_THREADS"] = threads
+        self.compiled = core.compile_model(model, "CPU", config)
+        self.names = self._load_names(model_path)
+
+    def _load_names(self, model_path):
+        """ultralytics が書き出す metadata.yaml からクラス名を読み込む"""
+        metadata_path = os.path.join(os.path.dirname(model_path), "metadata.yaml")
+        if not os.path.exists(metadata_path):
+            return {}
+        try:
+            import yaml
+            with open(metadata_path, "r", encoding="utf-8") as f:
+                return _parse_names(yaml.safe_load(f).get("names", {}))
+        except Exception as e:
+            print(f"Warning: Failed to read class names from {metadata_path}: {e}")
+            return {}
+
+    def _infer(self, blob):
+        return self.compiled(blob)[0]
+
+def detect_backend(model_path):
+    """モデルパスの拡張子からバックエンド名を判定する"""
+    path = model_path.rstrip("/\\")
+    if path.endswith(".onnx"):
+        return "onnx"
+    if path.endswith(".xml") or path.endswith("_openvino_model"):
+        return "openvino"
+    return "ultralytics"
+
+def load_backend(model_path, backend="auto", imgsz=640, threads=None):
+    """
+    推論バックエンドを作成します。
+
+    Args:
+        model_path (str): モデルファイル (.pt / .onnx / .xml) または OpenVINO モデルディレクトリのパス。
+        backend (str): "auto" (拡張子から判定), "ultralytics", "onnx", "openvino" のいずれか。
+        imgsz (int): 推論時の入力サイズ (正方形の一辺)。
+        threads (int, optional): 推論に使うCPUスレッド数。Noneの場合はランタイムの既定値。
+    """
+    if backend == "auto":
+        backend = detect_backend(model_path)
+    if backend == "onnx":
+        return OnnxBackend(model_path, imgsz, threads)
+    if backend == "openvino":
+        return OpenVinoBackend(model_path, imgsz, threads)
+    if backend == "ultralytics":
+        return UltralyticsBackend(model_path, imgsz, threads)
+    raise ValueError(f"Unknown inference backend: {backend}")
+
+def warmup(model, frame_shape=(1080, 1920, 3), runs=2):
+    """
+    ダミーフレームで推論を実行し、初回呼び出し時の初期化コストを事前に済ませる。
+
+    Returns:
+        float: 最後の推論にかかった時間(秒)。
+    """
+    frame = np.zeros(frame_shape, dtype=np.uint8)
+    elapsed = 0.0
+    for _ in range(runs):
+        started = time.monotonic()
+        model.predict_boxes(frame, 0.99)
+        elapsed = time.monotonic() - started
+    return elapsed
+
+def export_model(model_path, fmt, imgsz=640):
+    """
+    ultralytics で .pt モデルを CPU向けの形式に書き出し、書き出したパスを返します。
+
+    Args:
+        fmt (str): "onnx" または "openvino"。
+    """
+    from ultralytics import YOLO
+    return str(YOLO(model_path).export(format=fmt, imgsz=imgsz))
@@ -0,0 +1,75 @@
+import threading
+from collections import OrderedDict
+import cv2
+from metrics import timed
+
+# 高速なJPEGエンコーダ (PyTurboJPEG) があれば使用する
+try:
+    from turbojpeg import TurboJPEG, TJPF_BGR
+    _turbo_jpeg = TurboJPEG()
+except Exception:
+    _turbo_jpeg = None
+
+def encode_jpeg(image, quality=95):
+    """BGR画像をJPEGバイト列にエンコードする。失敗した場合はNoneを返す。"""
+    if _turbo_jpeg is not None:
+        try:
+            return _turbo_jpeg.encode(image, quality=quality, pixel_format=TJPF_BGR)
+        except Exception:
+            pass
+    ok, buffer = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return buffer.tobytes() if ok else None
+
+class JpegCache:
+    """
+    フレーム毎のエンコード済みJPEGを保持するLRUキャッシュ。
+    キーは (frame_id, 描画内容, 品質, 最大幅) で、同じフレームを同じ条件で
+    何度もエンコードしないようにMCPツールとMJPEG配信で共有します。
+    """
+    def __init__(self, capacity=16):
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_encode(self, frame_id, overlay, render, quality=95, max_width=None):
+        """
+        キャッシュ済みのJPEGを返す。無ければ render() で画像を生成してエンコードする。
+
+        Args:
+            frame_id (int): フレームID。0の場合はキャッシュしない。
+            overlay (str): 描画内容を表す識別子 (例: 'none', 'axes')。
+            render (callable): エンコード対象のBGR画像を返す関数。
+            quality (int): JPEG品質 (0-100)。
+            max_width (int, optional): 指定した場合、この幅を超える画像は縮小してからエンコードする。
+
+        Returns:
+            bytes: JPEGバイト列。画像が得られない場合はNone。
+        """
+        key = (frame_id, overlay, quality, max_width)
+        if frame_id:
+            with self.lock:
+                jpeg = self.entries.get(key)
+                if jpeg is not None:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return jpeg
+
+        image = render()
+        if image is None:
+            return None
+        h, w = image.shape[:2]
+        if max_width and w > max_width:
+            image = cv2.resize(image, (max_width, int(h * max_width / w)), interpolation=cv2.INTER_AREA)
+        with timed("jpeg_encode"):
+            jpeg = encode_jpeg(image, quality)
+
+        if frame_id and jpeg is not None:
+            with self.lock:
+                self.misses += 1
+                self.entries[key] = jpeg
+                self.entries.move_to_end(key)
+                while len(self.entries) > self.capacity:
+                    self.entries.popitem(last=False)
+        return jpeg
@@ -0,0 +1,202 @@
+import re
+import numpy as np
+
+"""
+ロボットアームの逆運動学 (IK)・順運動学 (FK) と到達可能範囲の判定。
+
+ファームウェア (arduino/robot_controller/robot_controller.ino) の calculateIK と同じ幾何モデルを
+numpy でベクトル化したものです。座標は世界座標系 (ロボットベース原点, mm)、角度は度です。
+
+到達可能条件:
+    J2 (肩) から J4 (手首) までの距離 s が |L1 - L2| <= s <= L1 + L2 であること。
+    s は3次元空間での「点から J2 の描く円までの距離」と一致するため (1-リプシッツ)、
+    ボクセルの中心での余裕と対角線の半分を比べるだけで、ボクセル全体が到達可能/不可能かを厳密に判定できます。
+"""
+
+# --- アームの寸法 (mm)。ファームウェアの定数と一致させること ---
+L1 = 80.0            # 肩 (J2) から肘 (J3) まで
+L2 = 80.0            # 肘 (J3) から手首 (J4) まで
+L_OFF_J4_TCP = 51.0  # 手首 (J4) から TCP までの水平オフセット
+Z_OFF_J4_TCP = 8.0   # 手首 (J4) から TCP までの垂直オフセット
+OFF_J1_J2 = 15.0     # ベース回転軸 (J1) と肩 (J2) の水平オフセット
+BASE_H = 56.0        # ベースの高さ
+
+REACH_MIN = abs(L1 - L2)
+REACH_MAX = L1 + L2
+
+# ボクセルの分類
+OUTSIDE = 0
+INSIDE = 1
+BOUNDARY = 2
+
+_MOVE_ARG = re.compile(r"([xyzs])\s*=\s*([-+]?\d*\.?\d+)", re.IGNORECASE)
+
+def _wrist_coordinates(x, y, z):
+    """TCP座標から、J2を原点とした J4 の (水平距離, 高さ) を求める"""
+    r_j4 = np.hypot(x, y) - L_OFF_J4_TCP - OFF_J1_J2
+    z_j4 = (z + Z_OFF_J4_TCP) - BASE_H
+    return r_j4, z_j4
+
+def reach_margin(x, y, z):
+    """
+    到達可能範囲の境界までの余裕 (mm)。正なら到達可能、負なら不可能。
+    境界 (外側の球殻と内側の球殻) のうち近い方までの距離を返す。
+    """
+    x, y, z = (np.asarray(v, dtype=np.float64) for v in (x, y, z))
+    s = np.hypot(*_wrist_coordinates(x, y, z))
+    return np.minimum(REACH_MAX - s, s - REACH_MIN)
+
+def inverse_kinematics(x, y, z):
+    """
+    TCP座標から関節角度を求める (ファームウェアの calculateIK と同じ式)。
+    スカラーでも配列でも計算できます。
+
+    Returns:
+        tuple: (j1, j2, j3, reachable)。到達不可能な点の角度は NaN。
+    """
+    x, y, z = (np.asarray(v, dtype=np.float64) for v in (x, y, z))
+    j1 = np.degrees(np.arctan2(y, x))
+    r_j4, z_j4 = _wrist_coordinates(x, y, z)
+    s_sq = r_j4 * r_j4 + z_j4 * z_j4
+    s = np.sqrt(s_sq)
+    reachable = (s <= REACH_MAX) & (s >= REACH_MIN)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        t3 = np.degrees(np.arccos((L1 * L1 + L2 * L2 - s_sq) / (2.0 * L1 * L2)))
+        t2 = np.degrees(np.arccos((L1 * L1 + s_sq - L2 * L2) / (2.0 * L1 * s)))
+    j2 = np.degrees(np.arctan2(z_j4, r_j4)) + t2
+    j3 = t3 + j2
+    j2 = np.where(reachable, j2, np.nan)
+    j3 = np.where(reachable, j3, np.nan)
+    return j1, j2, j3, reachable
+
+def forward_kinematics(j1, j2, j3):
+    """
+    関節角度から TCP座標を求める (inverse_kinematics の逆変換)。
+
+    j2 は上腕の仰角、j3 - 180 は前腕の向きに相当します。
+
+    Returns:
+        tuple: (x, y, z)
+    """
+    j1, j2, j3 = (np.radians(np.asarray(v, dtype=np.float64)) for v in (j1, j2, j3))
+    r_j4 = L1 * np.cos(j2) - L2 * np.cos(j3)
+    z_j4 = L1 * np.sin(j2) - L2 * np.sin(j3)
+    r_total = r_j4 + L_OFF_J4_TCP + OFF_J1_J2
+    return r_total * np.cos(j1), r_total * np.sin(j1), z_j4 + BASE_H - Z_OFF_J4_TCP
+
+class ReachabilityGrid:
+    """
+    作業空間を立方体のボクセルに分割し、到達可能かを事前計算したグリッド。
+
+    各ボクセルは INSIDE (全体が到達可能)、OUTSIDE (全体が到達不可能)、BOUNDARY (境界を含む) のいずれかです。
+    問い合わせはボクセルの参照だけで済み、BOUNDARY のボクセルと範囲外の点だけを厳密に計算します。
+    """
+    def __init__(self, resolution=5.0, bounds=None):
+        """
+        Args:
+            resolution (float): ボクセルの一辺 (mm)。
+            bounds (tuple, optional): ((x_min, x_max), (y_min, y_max), (z_min, z_max))。
+                省略時はアームが届く範囲を囲む直方体。
+        """
+        if bounds is None:
+            r = L_OFF_J4_TCP + OFF_J1_J2 + REACH_MAX
+            z0 = BASE_H - Z_OFF_J4_TCP
+            bounds = ((-r, r), (-r, r), (z0 - REACH_MAX, z0 + REACH_MAX))
+        self.resolution = float(resolution)
+        self.origin = np.array([b[0] for b in bounds], dtype=np.float64)
+        self.shape = tuple(int(np.ceil((b[1] - b[0]) / self.resolution)) for b in bounds)
+
+        centers = [self.origin[i] + (np.arange(n) + 0.5) * self.resolution for i, n in enumerate(self.shape)]
+        cx, cy, cz = np.meshgrid(*centers, indexing="ij")
+        margin = reach_margin(cx, cy, cz)
+        half_diagonal = self.resolution * np.sqrt(3.0) / 2.0
+        self.cells = np.full(self.shape, BOUNDARY, dtype=np.uint8)
+        self.cells[margin >= half_diagonal] = INSIDE
+        self.cells[margin < -half_diagonal] = OUTSIDE
+
+    def check(self, points):
+        """
+        点の集合が到達可能かを判定する。
+
+        Args:
+            points (array_like): (N, 3) の TCP座標 [mm]。
+
+        Returns:
+            np.ndarray: (N,) の bool 配列。
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        idx = np.floor((points - self.origin) / self.resolution).astype(np.int64)
+        in_grid = np.all((idx >= 0) & (idx < np.array(self.shape)), axis=1)
+
+        state = np.full(len(points), BOUNDARY, dtype=np.uint8)
+        i = idx[in_grid]
+        state[in_grid] = self.cells[i[:, 0], i[:, 1], i[:, 2]]
+        result = state == INSIDE
+        exact = state == BOUNDARY
+        if np.any(exact):
+            p = points[exact]
+            result[exact] = reach_margin(p[:, 0], p[:, 1], p[:, 2]) >= 0.0
+        return result
+
+    def __repr__(self):
+        counts = np.bincount(self.cells.ravel(), minlength=3)
+        return (f"ReachabilityGrid(resolution={self.resolution:g}mm, shape={self.shape}, "
+                f"inside={counts[INSIDE]}, boundary={counts[BOUNDARY]}, outside={counts[OUTSIDE]})")
+
+_default_grid = None
+
+def get_reachability_grid():
+    """既定の解像度のグリッドを返す (初回呼び出し時に計算)"""
+    global _default_grid
+    if _default_grid is None:
+        _default_grid = ReachabilityGrid()
+    return _default_grid
+
+def check_sequence(commands, start=None, step_mm=5.0, grid=None):
+    """
+    コマンド列の move の移動先と、移動中の直線経路が到達可能かを判定する。
+
+    ファームウェアは move の経路を直線補間し、IK が解けない途中点では関節を動かさずに読み飛ばします。
+    そのため移動先だけでなく、step_mm 間隔の途中点も判定します。
+
+    Args:
+        commands (str): セミコロン区切りのコマンド列。
+        start (tuple, optional): 現在の TCP座標 (x, y, z)。不明な場合は None
+            (最初の move の経路と、省略された軸を含む移動先は判定できないので、座標が確定するまで読み飛ばす)。
+        step_mm (float): 経路の判定間隔 (mm)。
+        grid (ReachabilityGrid, optional): 判定に使うグリッド。
+
+    Returns:
+        list: 到達できない move のリスト [{"index", "command", "target", "unreachable_at"}, ...]。
+            unreachable_at は最初に到達できなくなる点 (移動先そのものの場合もある)。
+    """
+    grid = grid or get_reachability_grid()
+    current = None if start is None else np.asarray(start, dtype=np.float64)
+    problems = []
+    for index, cmd in enumerate(c.strip() for c in commands.split(";")):
+        if not cmd.startswith("move"):
+            continue
+        args = {k.lower(): float(v) for k, v in _MOVE_ARG.findall(cmd)}
+        if current is None and not all(k in args for k in "xyz"):
+            continue
+        base = current if current is not None else np.zeros(3)
+        target = np.array([args.get(k, base[i]) for i, k in enumerate("xyz")])
+
+        if current is None:
+            path = target[None, :]
+        else:
+            steps = max(1, int(np.ceil(np.linalg.norm(target - current) / step_mm)))
+            t = np.arange(1, steps + 1)[:, None] / steps
+            path = current + (target - current) * t
+        ok = grid.check(path)
+        if not ok.all():
+            bad = path[np.argmin(ok)]
+            problems.append({
+                "index": index,
+                "command": cmd,
+                "target": [round(float(v), 1) for v in target],
+                "unreachable_at": [round(float(v), 1) for v in bad]
+            })
+        current = target
+    return problems
@@ -6,7 +6,7 @@
 - Arduinoベースのロボットアームとのシリアル通信
 - OpenCVベースのビジョンシステム（ArUcoマーカーによる姿勢推定と座標変換）
 """
-from fastmcp import FastMCP
+from fastmcp import FastMCP, Context
 import serial
 import serial.tools.list_ports
 import time
@@ -15,17 +15,22 @@ import csv
 import json
 import re
 import queue
+import asyncio
 import argparse
 import threading
 import http.server
 import socketserver
 import os
+import copy
 from vision_system import VisionSystem
-try:
-    from ultralytics import YOLO
-except ImportError:
-    print("Warning: 'ultralytics' module not found. Object detection disabled.")
-    YOLO = None
+from mjpeg_broadcaster import MjpegBroadcaster
+from detection_worker import DetectionWorkerClient
+from detection_service import DetectionService
+from inference_backend import load_backend, warmup, export_model, BACKENDS
+from metrics import metrics, timed
+from serial_transport import SerialTransport, SerialTransportError, SerialConnectionError, PROTOCOLS
+from robot_state import RobotStateCache
+from kinematics import check_sequence, get_reachability_grid, inverse_kinematics, reach_margin
 try:
     from joypad import get_joypad_system
 except ImportError:
@@ -81,6 +86,19 @@ SERIAL_PORT = detect_serial_port()
 BAUD_RATE = 9600
 # コマンド応答のタイムアウト（秒）
 TIMEOUT = 180
+# この時間(秒)何も受信しなければ切断とみなす
+SERIAL_SOFT_TIMEOUT = 10.0
+# シリアル通信のプロトコル ("text", "binary", "auto")。binary はファームウェアが非対応ならテキストにフォールバック
+SERIAL_PROTOCOL = "text"
+# execute_sequence で先読み送信するサブコマンドの最大数 (1で先読みなし)
+SERIAL_WINDOW = 4
+# 回線が空いている間にロボットの状態 (dump) を再取得する間隔（秒）。0で無効
+STATE_POLL_SEC = 2.0
+# ロボットの状態を変えないコマンド (送信してもキャッシュを無効化しない)
+READ_ONLY_COMMANDS = ("dump", "status", "help")
+CONFIG_COMMANDS = ("calib",)  # キャリブレーションを変えるコマンド (calib0, calib1, calibg)
+# execute_sequence で、送信前に move の移動先と経路が到達可能かを判定する
+REACH_CHECK = True
 
 # --- ビジョンシステム設定 ---
 # カメラキャリブレーションによって得られた内部パラメータファイル
@@ -89,8 +107,18 @@ CAMERA_PARAMS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.
 ARUCO_MARKER_ID = 14
 # ArUcoマーカーの物理的な一辺の長さ (mm)
 ARUCO_MARKER_SIZE_MM = 63.0
-# 使用するカメラのデバイスID
+# 使用するカメラのデバイスID (動画ファイル・画像ディレクトリ・"synthetic" も指定可能。camera_sources.py を参照)
 CAMERA_ID = 0
+# 動画・画像ディレクトリを繰り返し再生するか、読み出しのフレームレート (Noneはソースの既定値)
+CAMERA_LOOP = True
+CAMERA_FPS = None
+# 歪み補正マップをキャリブレーションファイルの隣に保存して再利用するか
+PERSIST_UNDISTORT_MAPS = False
+# 姿勢ロックモード (カメラとマーカーが固定されている場合に姿勢推定を省略する)
+POSE_LOCK = False
+POSE_LOCK_FRAMES = 10
+POSE_RECHECK_SEC = 5.0
+POSE_DRIFT_PX = 3.0
 
 # ロボットベースのオフセット設定 (mm)
 # マーカー座標系(ArUco原点)からロボットベース座標系（世界座標系）への変換
@@ -99,6 +127,27 @@ CAMERA_ID = 0
 ROBOT_BASE_OFFSET_X = 140.0 + 56.0
 ROBOT_BASE_OFFSET_Y = 100.0
 YOLO_MODEL_PATH = "best.pt"
+# YOLO推論を別プロセスの検出ワーカーで実行するか (共有メモリのフレームバス経由)
+DETECT_WORKER = False
+# 推論バックエンド ("auto" はモデルの拡張子から判定: .pt=ultralytics, .onnx=ONNX Runtime, .xml=OpenVINO)
+INFERENCE_BACKEND = "auto"
+INFERENCE_IMGSZ = 640
+INFERENCE_THREADS = None
+# バックグラウンド検出サービス (最新の検出結果を即座に返す)
+DETECT_SERVICE = False
+DETECT_INTERVAL_MS = 200
+DETECT_IDLE_SEC = 30.0
+DETECT_WAIT_MAX_SEC = 2.0     # get_live_image が検出サービスのスナップショットを待つ最大時間(秒)
+# 物体追跡 (追跡IDの付与と、キーフレーム間のYOLO省略)
+TRACK_OBJECTS = False
+TRACK_KEYFRAME_INTERVAL = 5
+# モーションゲート (シーンが変化していなければ前回の検出結果を再利用する)。
+# バックグラウンド検出と追跡のキーフレームに適用する。get_live_image では呼び出し毎に motion_gate で指定する
+MOTION_GATE = False
+MOTION_CHANGE_RATIO = 0.0005
+# ワークスペース (マーカー座標系の矩形 xm_min, ym_min, xm_max, ym_max [mm])。設定すると推論をその領域に限定する
+WORKSPACE = None
+WORKSPACE_HEIGHT_MM = 150.0
 
 # ロボットの初期位置 (ホームポジション)
 INITIAL_POS_X = 130
@@ -112,9 +161,11 @@ mcp = FastMCP(
 # --- グローバルリソース ---
 # VisionSystemとシリアル接続は、必要になるまで初期化しない（遅延初期化）
 _vision_system = None
-_serial_conn = None
+_serial_transport = None
+_robot_state = None
 _yolo_model = None
-_serial_lock = threading.Lock() # シリアル通信の排他制御用ロック
+_yolo_model_lock = threading.Lock() # モデル読み込み (起動時のウォームアップとツール呼び出し) の排他制御用ロック
+_detection_service = None
 
 # ジョイパッド状態 (グローバル)
 joypad_axis_values = {'X': 0, 'Y': 0, 'RX': 0, 'RY': 0}
@@ -269,8 +320,19 @@ def get_vision_system():
                 cam_id=CAMERA_ID,
                 robot_offset_x_mm=ROBOT_BASE_OFFSET_X,
                 robot_offset_y_mm=ROBOT_BASE_OFFSET_Y,
-                lang=LANG
+                lang=LANG,
+                persist_undistort_maps=PERSIST_UNDISTORT_MAPS,
+                source_loop=CAMERA_LOOP,
+                source_fps=CAMERA_FPS
             )
+            _vision_system.tracking_enabled = TRACK_OBJECTS
+            _vision_system.motion_gate_enabled = MOTION_GATE
+            _vision_system.motion_gate.change_ratio = MOTION_CHANGE_RATIO
+            if WORKSPACE:
+                _vision_system.set_workspace(WORKSPACE, WORKSPACE_HEIGHT_MM)
+            _vision_system.object_tracker.keyframe_interval = TRACK_KEYFRAME_INTERVAL
+            if POSE_LOCK:
+                _vision_system.enable_pose_lock(lock_frames=POSE_LOCK_FRAMES, recheck_sec=POSE_RECHECK_SEC, drift_px=POSE_DRIFT_PX)
             if not QUIET_MODE:
                 print("Vision system initialized successfully.")
         except Exception as e:
@@ -278,41 +340,93 @@ def get_vision_system():
             return None
     return _vision_system
 
+# MJPEG配信用の共有エンコーダ (全クライアントで1フレーム1回のみエンコード)
+_mjpeg_broadcaster = MjpegBroadcaster(get_vision_system, max_fps=25)
+
 def get_yolo_model():
     """YOLOモデルのシングルトンインスタンスを取得します（遅延初期化）。"""
     global _yolo_model
-    if _yolo_model is None and YOLO is not None:
-        try:
-            if not QUIET_MODE:
-                print(f"Loading YOLO model from {YOLO_MODEL_PATH}...")
-            _yolo_model = YOLO(YOLO_MODEL_PATH)
-            if not QUIET_MODE:
-                print("YOLO model loaded successfully.")
-        except Exception as e:
-            print(f"Failed to load YOLO model: {e}")
-            return None
+    with _yolo_model_lock:
+        if _yolo_model is None:
+            try:
+                if not QUIET_MODE:
+                    print(f"Loading YOLO model from {YOLO_MODEL_PATH} (backend: {INFERENCE_BACKEND}, imgsz: {INFERENCE_IMGSZ})...")
+                started = time.time()
+                if DETECT_WORKER:
+                    # モデルの読み込みとウォームアップはワーカープロセス側で行われる
+                    model = DetectionWorkerClient(YOLO_MODEL_PATH, INFERENCE_BACKEND, INFERENCE_IMGSZ, INFERENCE_THREADS)
+                    try:
+                        model.wait_ready()
+                    except Exception:
+                        model.close()
+                        raise
+                else:
+                    model = load_backend(YOLO_MODEL_PATH, INFERENCE_BACKEND, INFERENCE_IMGSZ, INFERENCE_THREADS)
+                    # 初回の検出要求で初期化コストを払わないよう、ダミーフレームで推論しておく
+                    warmup(model)
+                _yolo_model = model
+                if not QUIET_MODE:
+                    print(f"YOLO model loaded and warmed up in {time.time() - started:.1f}s.")
+            except Exception as e:
+                print(f"Failed to load YOLO model: {e}")
+                return None
     return _yolo_model
 
-def get_serial():
+def _to_world_detections(detections):
+    """検出結果の ground_center をマーカー座標系から世界座標系 (x, y, z) に変換します（リストを直接変更します）。"""
+    for det in detections:
+        if "ground_center" in det:
+            # VisionSystem returns xm, ym, zm. Convert to World x, y, z
+            det["ground_center"]["x"] = round(det["ground_center"]["xm"] + ROBOT_BASE_OFFSET_X, 1)
+            det["ground_center"]["y"] = round(det["ground_center"]["ym"] + ROBOT_BASE_OFFSET_Y, 1)
+            det["ground_center"]["z"] = round(det["ground_center"]["zm"], 1)
+            # Remove marker coords from output to avoid confusion
+            del det["ground_center"]["xm"]
+            del det["ground_center"]["ym"]
+            del det["ground_center"]["zm"]
+    return detections
+
+def get_serial_transport():
     """
-    シリアルポート接続のシングルトンインスタンスを取得します（遅延初期化）。
-    Arduinoとの接続を確立し、リセット後の安定待機を行います。
+    シリアル通信 (SerialTransport) のシングルトンインスタンスを取得します（遅延初期化）。
+    ポートへの接続は最初のコマンド送信時に行われ、切断された場合は次のコマンドで再接続します。
     """
-    global _serial_conn
-    if _serial_conn and _serial_conn.is_open:
-        return _serial_conn
-    try:
-        _serial_conn = serial.Serial(SERIAL_PORT, BAUD_RATE, timeout=TIMEOUT)
-        # Arduinoはシリアル接続時にリセットがかかるため、起動シーケンスが完了するのを待つ
-        time.sleep(2)
-        _serial_conn.reset_input_buffer()
-        return _serial_conn
-    except Exception as e:
-        return None
+    global _serial_transport
+    if _serial_transport is None:
+        _serial_transport = SerialTransport(SERIAL_PORT, BAUD_RATE, soft_timeout=SERIAL_SOFT_TIMEOUT, hard_timeout=TIMEOUT, protocol=SERIAL_PROTOCOL, window=SERIAL_WINDOW)
+        _serial_transport.start()
+    return _serial_transport
+
+def get_robot_state():
+    """
+    ロボットの状態キャッシュ (RobotStateCache) のシングルトンインスタンスを取得します（遅延初期化）。
+    """
+    global _robot_state
+    if _robot_state is None:
+        _robot_state = RobotStateCache(get_serial_transport, STATE_POLL_SEC)
+        _robot_state.start()
+    return _robot_state
+
+def _invalidate_robot_state(commands):
+    """ロボットの状態を変えるコマンドを含む場合、状態キャッシュを無効化する"""
+    if not _robot_state:
+        return
+    commands = [c.strip() for c in commands.split(";") if c.strip()]
+    if any(c not in READ_ONLY_COMMANDS for c in commands):
+        _robot_state.invalidate(config=any(c.startswith(CONFIG_COMMANDS) for c in commands))
+
+def _format_serial_error(e):
+    """SerialTransportError をツールの応答文字列に変換する"""
+    if isinstance(e, SerialConnectionError):
+        return "Error: Cannot connect to robot." if LANG == 'en' else "Error: ロボットに接続できません。"
+    return f"Error: {e}"
 
 def send_command(cmd: str) -> str:
     """
-    コマンドをArduinoに送信し、応答を待機する。
+    コマンドをArduinoに送信し、応答を待機する（同期版。ジョイパッドやGUIのスレッドから使用）。
+
+    送受信は SerialTransport のイベントループが行い、コマンドはキューに積まれて順番に実行される。
+    呼び出し側のスレッドはロックを保持せず、自分のコマンドのFutureだけを待つ。
 
     通信プロトコル：
     1. コマンド文字列の末尾に改行コード `\\n` を付与して送信。
@@ -323,39 +437,74 @@ def send_command(cmd: str) -> str:
     """
     if VERBOSE_SERIAL:
         print(f"[Serial] -> {cmd}")
+    _invalidate_robot_state(cmd)
+    try:
+        response = get_serial_transport().send(cmd)
+        return "\n".join(response) if response else "Success"
+    except SerialTransportError as e:
+        return _format_serial_error(e)
+    except Exception as e:
+        return f"Error: {e}"
+    finally:
+        # 実行中に取得された状態も移動前のものなので無効化する
+        _invalidate_robot_state(cmd)
 
-    with _serial_lock:
-        conn = get_serial()
-        if not conn: return "Error: Cannot connect to robot." if LANG == 'en' else "Error: ロボットに接続できません。"
-        try:
-            conn.reset_input_buffer()
-            full_cmd = cmd.strip() + "\n"
-            conn.write(full_cmd.encode('utf-8'))
-            response = []
-            last_activity_time = time.time()
-            SOFT_TIMEOUT = 10.0  # 10秒間応答がなければ切断とみなす
+async def send_command_async(cmd: str) -> str:
+    """
+    send_command の非同期版。MCPツールから await し、応答待ちの間ワーカースレッドを占有しない。
+    """
+    if VERBOSE_SERIAL:
+        print(f"[Serial] -> {cmd}")
+    _invalidate_robot_state(cmd)
+    try:
+        response = await get_serial_transport().request(cmd)
+        return "\n".join(response) if response else "Success"
+    except SerialTransportError as e:
+        return _format_serial_error(e)
+    except Exception as e:
+        return f"Error: {e}"
+    finally:
+        _invalidate_robot_state(cmd)
 
-            while True:
-                # ソフトウェアタイムアウトのチェック
-                if time.time() - last_activity_time > SOFT_TIMEOUT:
-                    conn.close() # 強制切断して再接続を促す
-                    return "Error: Serial command timed out (No response for 10s)."
-
-                raw_line = conn.readline()
-                if not raw_line and conn.in_waiting == 0:
-                    # ハードウェアタイムアウト (TIMEOUT=180s)
-                    return "Error: Serial command timed out (Hard limit)."
-
-                line = raw_line.decode('utf-8', errors='replace').strip()
-                if line: last_activity_time = time.time() # 何か受信したらタイマーリセット
-
-                if line == ';': continue # ハートビート
-                # コマンド完了の合図
-                if line == '!': break
-                if line: response.append(line)
-            return "\n".join(response) if response else "Success"
-        except Exception as e:
-            return f"Error: {e}"
+async def send_sequence_async(commands: str, on_step=None) -> str:
+    """
+    シーケンスをサブコマンドに分けてパイプラインで送信する。
+
+    Args:
+        commands (str): セミコロン区切りのコマンド列。
+        on_step (coroutine function, optional): サブコマンドが1つ完了するたびに
+            (完了数, サブコマンドの総数, 完了したサブコマンド) を引数に await される。
+    """
+    steps = [c.strip() for c in commands.split(";") if c.strip()]
+    if VERBOSE_SERIAL:
+        print(f"[Serial] -> {commands} ({len(steps)} steps)")
+    loop = asyncio.get_running_loop()
+    acks = asyncio.Queue()
+    _invalidate_robot_state(commands)
+    try:
+        # ';' の受信はトランスポートのスレッドで通知されるので、このイベントループのキューに移す
+        future = asyncio.wrap_future(get_serial_transport().submit_sequence(
+            steps, on_ack=lambda n: loop.call_soon_threadsafe(acks.put_nowait, n)))
+        while not future.done():
+            getter = asyncio.ensure_future(acks.get())
+            done, _ = await asyncio.wait({future, getter}, return_when=asyncio.FIRST_COMPLETED)
+            if getter in done:
+                n = getter.result()
+                if on_step:
+                    await on_step(n, len(steps), steps[n - 1])
+            else:
+                getter.cancel()
+        while on_step and not acks.empty():
+            n = acks.get_nowait()
+            await on_step(n, len(steps), steps[n - 1])
+        response = future.result()
+        return "\n".join(response) if response else "Success"
+    except SerialTransportError as e:
+        return _format_serial_error(e)
+    except Exception as e:
+        return f"Error: {e}"
+    finally:
+        _invalidate_robot_state(commands)
 
 # =================================================================
 # MCPツール群 (AIエージェントが利用するAPI)
@@ -381,6 +530,7 @@ TOOL_DOCS = {
     """,
         'execute_sequence': f"""
     Sends a sequence of operations (command sequence) separated by semicolons ';' to the robot arm.
+    Each completed command is reported as a progress notification (step, elapsed time, command).
 
     [Command Syntax]
     1. move x=<val> y=<val> z=<val> s=<speed>:
@@ -411,11 +561,17 @@ TOOL_DOCS = {
     - **Coordinate System**: Use the World Coordinate System values (x, y, z) exactly as returned by `get_live_image`. **DO NOT** subtract offsets or convert to marker coordinates manually.
     - **Release Height**: If there is an object at the place destination, release (grip open) directly above it (at the Travel Safety Height). If the place destination is a flat surface, descend to an appropriate height (e.g., gripping_height + 20mm) to release.
     - **Retreat after Release**: After releasing the object, always add a command to slowly return to the initial position {{ x: {INITIAL_POS_X}, y: {INITIAL_POS_Y}, z: {INITIAL_POS_Z} }} at speed s=50. After returning, add a 'grip open' command to prepare for the next operation.
+    - **Reachability**: A sequence whose move targets (or the straight path to them) are outside the arm's reach is rejected before anything is sent, listing the offending commands. Check uncertain targets with `is_reachable` first.
     """,
         'get_robot_status': """
     Retrieves the current status of the robot arm.
-    Returns a string containing TCP coordinates in **World Coordinate System (mm)**, joint angles, and other status info.
+    Returns JSON with the TCP coordinates in the **World Coordinate System (mm)** (`tcp`), joint angles in degrees (`joint_angles`: j1 Base, j2 Shoulder, j3 Elbow),
+    servo pulse widths (`cur_us`: c0-c3), the gripper state (`gripper`, `opening` in %), and the age of the state in ms (`age_ms`).
     Use this to understand the arm's current state before planning movements.
+
+    Args:
+        max_age_ms (int): A cached state up to this age (ms) is returned without querying the robot. Set 0 to always query the robot (default 1000).
+        calling_client (str): Client identifier.
     """,
         'dump': """
     (For Debugging) Retrieves the current status of the robot arm as a raw JSON object, providing detailed calibration and state information.
@@ -429,6 +585,21 @@ TOOL_DOCS = {
       - `cur_angle`: Current calculated joint angle in degrees.
     - `gripper`: Gripper status object, including `open`, `close` pulse values and `cur_us`.
     - `tcp`: Current logical coordinates of the Tool Center Point (`x`, `y`, `z`) in the World Coordinate System.
+
+    Args:
+        max_age_ms (int): A cached state up to this age (ms) is returned without querying the robot. Set 0 to always query the robot (default 1000).
+        calling_client (str): Client identifier.
+    """,
+        'is_reachable': """
+    Checks whether the robot arm can reach the given TCP positions, using the same inverse kinematics as the robot firmware.
+    The check runs on the server without contacting the robot, so many candidate positions can be tested at once.
+
+    Args:
+        points (list): List of positions [[x, y, z], ...] in the **World Coordinate System (Robot Base, mm)**.
+        calling_client (str): Client identifier.
+
+    Returns JSON list, one entry per point: {'x', 'y', 'z', 'reachable': bool, 'margin_mm': distance to the reach limit (negative if unreachable),
+    'joint_angles': {'j1', 'j2', 'j3'} in degrees (null if unreachable)}.
     """,
         'get_joypad_status': """
     Retrieves the current input state of the joypad.
@@ -449,6 +620,7 @@ TOOL_DOCS = {
     - **radius_u_norm, radius_v_norm**: Normalized radius on the image.
     - **color_hsv**: Representative color in HSV {h: 0-179, s: 0-255, v: 0-255}. Determined by majority vote from 5 samples along the cylinder axis (or center of bbox if 3D estimation fails).
     - **color_name**: Estimated color name (e.g., 'red', 'blue', 'green'). Use this to identify objects by color.
+    - **track_id**: (When the server runs with tracking enabled) A persistent ID of the object. The same physical object keeps the same ID across calls, so you can refer to it as "object 7". `predicted` is true when the position was propagated from the tracker without running detection on this frame.
 
     If `detect_objects` is true, `detections` includes `ground_center` containing these values for the object's base center.
 
@@ -460,6 +632,8 @@ TOOL_DOCS = {
         detect_objects (bool): If True, runs object detection.
         confidence (float): Confidence threshold for detection (default 0.7).
         return_image (bool): If True, returns the Base64 encoded image. If False, returns only detection results. Defaults to False to save bandwidth.
+        max_age_ms (int): When the background detection service is running, detections from a snapshot up to this age (ms) are returned immediately, together with `detection_age_ms`. If the snapshot is older, waits up to this long (at most 2 s) for the service to publish a newer one. Set 0 to force a fresh detection (default 1000).
+        motion_gate (bool): If True and the scene inside the workspace has not changed since the last detection, the previous detections are returned without running detection again, with `"reused": true` (and `motion_gate_hit_rate`) in the response. Set False to always run detection (default False).
         calling_client (str): Client identifier for logging (default: 'gemini').
     """,
         'convert_coordinates': """
@@ -479,6 +653,11 @@ TOOL_DOCS = {
         calling_client (str): Client identifier for logging (default: 'gemini').
     """,
         'get_tool_logs': "Retrieves the execution history of tools called by the client. Returns a list of logs.",
+        'get_metrics': """
+    Retrieves latency statistics of each processing stage (capture, undistort, marker_detect, solvepnp, yolo, cylinder, color, jpeg_encode, base64, serial_roundtrip, json and whole tool calls).
+    Returns JSON: {'stages': {stage: {'count', 'mean_ms', 'p50_ms', 'p95_ms', 'p99_ms'}}, 'caches': {...}, 'serial': {'queue_depth', 'completed', 'errors', ...}, 'robot_state': {'hits', 'refreshes', 'age_ms', ...}}.
+    Percentiles are computed over the most recent 1024 samples of each stage. The same data is available in Prometheus text format at http://<server>:8000/metrics.
+    """,
     },
     'ja': {
         'get_workpiece_catalog': """
@@ -492,6 +671,7 @@ TOOL_DOCS = {
     """,
         'execute_sequence': f"""
     ロボットアームに一連の動作（コマンドシーケンス）をセミコロン ';' 区切りで送信します。
+    コマンドが1つ完了するたびに、進捗通知（ステップ番号、経過時間、コマンド）が送られます。
 
     【コマンド文法】
     1. move x=<値> y=<値> z=<値> s=<速度>:
@@ -524,11 +704,17 @@ TOOL_DOCS = {
     - **座標系**: `get_live_image` で取得した世界座標 (x, y, z) をそのまま使用してください。**手動でオフセットを引いたり、マーカー座標系に変換したりしないでください。**
     - **リリース高度**: プレイス先に物体がある場合は、その上空（移動安全高度）でそのままリリース（grip open）を行ってください。プレイス先が平坦な場所であれば、適切な高さ（例: 把持高さ + 20mm）まで下降してリリースしてください。
     - **リリース後の退避**: 物体をリリースした後は、必ず初期位置である {{ x: {INITIAL_POS_X}, y: {INITIAL_POS_Y}, z: {INITIAL_POS_Z} }} へ、速度 s=50 でゆっくりと戻るコマンドを追加してください。初期位置へ戻った後は、次の操作に備えて 'grip open' コマンドを追加してください。
+    - **到達可能範囲**: move の移動先（またはそこまでの直線経路）がアームの届かない位置を含むシーケンスは、送信前に拒否され、該当するコマンドが返されます。不確かな移動先は先に `is_reachable` で確認してください。
     """,
         'get_robot_status': """
     ロボットアームの現在の状態を取得します。
-    **世界座標系（mm）**でのTCP座標、各関節の角度などが含まれる文字列を返します。
+    **世界座標系（mm）**でのTCP座標 (`tcp`)、各関節の角度 (`joint_angles`: j1 Base, j2 Shoulder, j3 Elbow, 度)、
+    サーボのパルス幅 (`cur_us`: c0-c3)、グリッパーの状態 (`gripper`、`opening` は開度 %)、状態の経過時間 (`age_ms`) を含むJSONを返します。
     動作計画を立てる前に、アームの現在位置を正確に把握するために使用してください。
+
+    Args:
+        max_age_ms (int): 経過時間がこの値(ミリ秒)以下のキャッシュがあれば、ロボットに問い合わせずに返します。0を指定すると必ずロボットに問い合わせます (デフォルト1000)。
+        calling_client (str): クライアント識別子。
     """,
         'dump': """
     （デバッグ用）ロボットアームの現在の状態を、詳細なキャリブレーションおよび状態情報を含む未加工のJSONオブジェクトとして取得します。
@@ -542,6 +728,21 @@ TOOL_DOCS = {
       - `cur_angle`: 現在の計算上の関節角度（度）。
     - `gripper`: グリッパーの状態オブジェクト。`open`と`close`のパルス値、`cur_us`を含みます。
     - `tcp`: ツールセンターポイントの現在の論理座標 (`x`, `y`, `z`) を世界座標系で示します。
+
+    Args:
+        max_age_ms (int): 経過時間がこの値(ミリ秒)以下のキャッシュがあれば、ロボットに問い合わせずに返します。0を指定すると必ずロボットに問い合わせます (デフォルト1000)。
+        calling_client (str): クライアント識別子。
+    """,
+        'is_reachable': """
+    ロボットアームが指定したTCP位置に届くかを、ロボットのファームウェアと同じ逆運動学で判定します。
+    ロボットと通信せずにサーバー上で判定するため、多数の候補位置を一度に確認できます。
+
+    Args:
+        points (list): 位置のリスト [[x, y, z], ...]。**世界座標系（ロボットベース原点, mm）**で指定します。
+        calling_client (str): クライアント識別子。
+
+    戻り値 (JSON): 各点について {'x', 'y', 'z', 'reachable': bool, 'margin_mm': 到達限界までの余裕 (届かない場合は負),
+    'joint_angles': {'j1', 'j2', 'j3'} (度。届かない場合はnull)} のリスト。
     """,
         'get_joypad_status': """
     現在のジョイパッドの入力状態を取得します。
@@ -563,6 +764,7 @@ TOOL_DOCS = {
     - **radius_u_norm, radius_v_norm**: 正規化された画像上の半径（幅・高さ）。
     - **color_hsv**: 物体の代表色 (HSV形式: {h: 0-179, s: 0-255, v: 0-255})。円筒軸に沿った5点のサンプリングによる多数決で決定されます（影やハイライトの影響を軽減するため）。
     - **color_name**: 推定された色名 (例: 'red', 'blue', 'green')。色で物体を指定する場合に利用してください。
+    - **track_id**: (サーバーで物体追跡が有効な場合) 物体の追跡ID。同じ物体には呼び出しをまたいで同じIDが割り当てられるため、「物体7」のように物体を指定できます。`predicted` がtrueの場合、そのフレームでは検出を行わずトラッカーの予測位置を返しています。
 
     `detect_objects=True` の場合、検出された物体情報の `ground_center` に上記座標が含まれます。
 
@@ -574,6 +776,8 @@ TOOL_DOCS = {
         detect_objects (bool): Trueの場合、物体検出を行います。
         confidence (float): 検出の信頼度しきい値 (デフォルト0.7)。
         return_image (bool): Trueの場合、Base64エンコードされた画像を返します。Falseの場合、検出結果のみを返します。帯域節約のためデフォルトはFalseです。
+        max_age_ms (int): バックグラウンド検出サービスが動作している場合、経過時間がこの値(ミリ秒)以下のスナップショットの検出結果を即座に返します（`detection_age_ms` を付加）。スナップショットが古い場合は、サービスが新しいスナップショットを公開するまで最大でこの時間 (2秒まで) 待ちます。0を指定すると必ず新しく検出します (デフォルト1000)。
+        motion_gate (bool): Trueの場合、前回の検出からワークスペース内の画像が変化していなければ検出を省略して前回の結果を返し、レスポンスに `"reused": true` (と `motion_gate_hit_rate`) を付加します。Falseの場合は常に検出を行います (デフォルトFalse)。
         calling_client (str): ログ記録用のクライアント識別子 (デフォルト: 'gemini')。
     """,
         'convert_coordinates': """
@@ -593,6 +797,11 @@ TOOL_DOCS = {
         calling_client (str): ログ記録用のクライアント識別子 (デフォルト: 'gemini')。
     """,
         'get_tool_logs': "クライアントによって呼び出されたツールの実行履歴を取得します。ログのリストを返します。",
+        'get_metrics': """
+    各処理段階 (capture, undistort, marker_detect, solvepnp, yolo, cylinder, color, jpeg_encode, base64, serial_roundtrip, json、およびツール呼び出し全体) の処理時間の統計を取得します。
+    戻り値 (JSON): {'stages': {段階名: {'count', 'mean_ms', 'p50_ms', 'p95_ms', 'p99_ms'}}, 'caches': {...}, 'serial': {'queue_depth', 'completed', 'errors', ...}, 'robot_state': {'hits', 'refreshes', 'age_ms', ...}}
+    パーセンタイルは各段階の直近1024件から計算されます。同じ情報は http://<サーバー>:8000/metrics から Prometheus テキスト形式でも取得できます。
+    """,
     }
 }
 
@@ -607,25 +816,77 @@ def get_workpiece_catalog(calling_client: str = 'gemini') -> str:
 
 @mcp.tool()
 @set_doc(DOCS['execute_sequence'])
-def execute_sequence(commands: str, description: str = "", calling_client: str = 'gemini') -> str:
+@timed("tool.execute_sequence")
+async def execute_sequence(commands: str, description: str = "", calling_client: str = 'gemini', ctx: Context = None) -> str:
+    if REACH_CHECK:
+        # 現在位置が分かっていれば、最初の move の経路も判定する
+        state = _robot_state.cached(float("inf")) if _robot_state else None
+        problems = check_sequence(commands, state.tcp if state else None)
+        if problems:
+            res = "Error: Sequence rejected, unreachable move targets or paths (nothing was sent):\n" + json.dumps(problems, ensure_ascii=False)
+            log_tool_call("execute_sequence", {"commands": commands, "description": description, "calling_client": calling_client}, res)
+            return res
+
     # サーバー側GUIでの軌道表示用に更新（クライアント動作には影響なし）
     _update_trajectory_from_commands(commands)
-    res = send_command(commands)
+    started = time.monotonic()
+
+    async def report_step(done, total, command):
+        if ctx is None:
+            return
+        try:
+            await ctx.report_progress(done, total, f"[{done}/{total}] {time.monotonic() - started:.2f}s {command}")
+        except Exception as e:
+            print(f"Progress notification failed: {e}")
+
+    res = await send_sequence_async(commands, report_step)
     log_tool_call("execute_sequence", {"commands": commands, "description": description, "calling_client": calling_client}, res)
     return res
 
 @mcp.tool()
 @set_doc(DOCS['get_robot_status'])
-def get_robot_status(calling_client: str = 'gemini') -> str:
-    res = send_command("status")
-    log_tool_call("get_robot_status", {"calling_client": calling_client}, res)
+async def get_robot_status(max_age_ms: int = 1000, calling_client: str = 'gemini') -> str:
+    try:
+        state = await get_robot_state().get_async(max_age_ms)
+        res = json.dumps(state.to_dict(), ensure_ascii=False)
+    except SerialTransportError as e:
+        res = _format_serial_error(e)
+    log_tool_call("get_robot_status", {"max_age_ms": max_age_ms, "calling_client": calling_client}, res)
     return res
 
 @mcp.tool()
 @set_doc(DOCS['dump'])
-def dump(calling_client: str = 'gemini') -> str:
-    res = send_command("dump")
-    log_tool_call("dump", {"calling_client": calling_client}, res)
+async def dump(max_age_ms: int = 1000, calling_client: str = 'gemini') -> str:
+    try:
+        state = await get_robot_state().get_async(max_age_ms)
+        res = json.dumps(state.raw, ensure_ascii=False)
+    except SerialTransportError as e:
+        res = _format_serial_error(e)
+    log_tool_call("dump", {"max_age_ms": max_age_ms, "calling_client": calling_client}, res)
+    return res
+
+@mcp.tool()
+@set_doc(DOCS['is_reachable'])
+def is_reachable(points: list[list[float]], calling_client: str = 'gemini') -> str:
+    try:
+        xyz = [[float(p[0]), float(p[1]), float(p[2])] for p in points]
+    except (TypeError, ValueError, IndexError):
+        return "Error: points must be a list of [x, y, z]."
+    result = []
+    if xyz:
+        x, y, z = zip(*xyz)
+        reachable = get_reachability_grid().check(xyz)
+        margins = reach_margin(x, y, z)
+        j1, j2, j3, _ = inverse_kinematics(x, y, z)
+        for i, ok in enumerate(reachable):
+            result.append({
+                "x": x[i], "y": y[i], "z": z[i],
+                "reachable": bool(ok),
+                "margin_mm": round(float(margins[i]), 1),
+                "joint_angles": {"j1": round(float(j1[i]), 1), "j2": round(float(j2[i]), 1), "j3": round(float(j3[i]), 1)} if ok else None
+            })
+    res = json.dumps(result, ensure_ascii=False)
+    log_tool_call("is_reachable", {"points": points, "calling_client": calling_client}, res)
     return res
 
 @mcp.tool()
@@ -635,31 +896,49 @@ def get_joypad_status(calling_client: str = 'gemini') -> str:
 
 @mcp.tool()
 @set_doc(DOCS['get_live_image'])
-def get_live_image(visualize_axes: bool = False, detect_objects: bool = False, confidence: float = 0.7, return_image: bool = False, calling_client: str = 'gemini') -> str:
+@timed("tool.get_live_image")
+def get_live_image(visualize_axes: bool = False, detect_objects: bool = False, confidence: float = 0.7, return_image: bool = False, max_age_ms: int = 1000, motion_gate: bool = False, calling_client: str = 'gemini') -> str:
     vs = get_vision_system()
     if not vs:
         return "Error: Vision system is not available."
-    
-    # 姿勢を更新。画像が不要でも検出には最新フレームが必要
-    vs.update_pose()
+
+    # バックグラウンド検出サービスが有効な場合は、十分新しいスナップショットをそのまま使う
+    # (古ければ max_age_ms まで新しいスナップショットの公開を待ち、同じフレームを二重に推論しない)
+    snapshot = None
+    if detect_objects and _detection_service:
+        snapshot = _detection_service.wait_for_snapshot(max_age_ms, timeout=min(max_age_ms / 1000.0, DETECT_WAIT_MAX_SEC))
+        if snapshot and snapshot["confidence"] > confidence:
+            snapshot = None
+
+    # 姿勢を更新。フレーム全体の歪み補正は画素が必要な場合(検出・画像返却)のみ行う
+    if snapshot is None or return_image:
+        vs.update_pose(undistort_frame=(detect_objects and snapshot is None) or return_image)
     
     detections = None
-    if detect_objects:
+    detection_age_ms = None
+    reused = None
+    if snapshot:
+        detections = [copy.deepcopy(det) for det in snapshot["detections"] if det["confidence"] >= confidence]
+        detection_age_ms = int(_detection_service.snapshot_age_ms(snapshot))
+        # 検出結果の座標をマーカー座標系から世界座標系へ変換
+        _to_world_detections(detections)
+    elif detect_objects:
         model = get_yolo_model()
         if model:
-            detections = vs.detect_objects(model, confidence)
+            # 検出サービスが有効な場合は、サービスと同じ下限信頼度で検出して結果を共有し、しきい値で絞り込んで返す
+            run_confidence = min(confidence, vs.detection_floor_confidence) if _detection_service else confidence
+            if TRACK_OBJECTS:
+                detections, info = vs.track_objects(model, run_confidence)
+            else:
+                detections, info = vs.detect_objects_ex(model, run_confidence, use_motion_gate=motion_gate)
+                if motion_gate:
+                    reused = info["reused"]
+            if _detection_service:
+                if info["frame_id"]:
+                    _detection_service.publish(info["frame_id"], copy.deepcopy(detections), run_confidence)
+                detections = [det for det in detections if det["confidence"] >= confidence]
             # 検出結果の座標をマーカー座標系から世界座標系へ変換
-            if detections:
-                for det in detections:
-                    if "ground_center" in det:
-                        # VisionSystem returns xm, ym, zm. Convert to World x, y, z
-                        det["ground_center"]["x"] = round(det["ground_center"]["xm"] + ROBOT_BASE_OFFSET_X, 1)
-                        det["ground_center"]["y"] = round(det["ground_center"]["ym"] + ROBOT_BASE_OFFSET_Y, 1)
-                        det["ground_center"]["z"] = round(det["ground_center"]["zm"], 1)
-                        # Remove marker coords from output to avoid confusion
-                        del det["ground_center"]["xm"]
-                        del det["ground_center"]["ym"]
-                        del det["ground_center"]["zm"]
+            _to_world_detections(detections)
         else:
             # 検出が要求されたがモデルがない場合はエラー
             res = "Error: YOLO model not loaded."
@@ -669,6 +948,11 @@ def get_live_image(visualize_axes: bool = False, detect_objects: bool = False, c
     resp = {}
     if detections is not None:
         resp["detections"] = detections
+    if detection_age_ms is not None:
+        resp["detection_age_ms"] = detection_age_ms
+    if reused is not None:
+        resp["reused"] = reused
+        resp["motion_gate_hit_rate"] = round(vs.motion_gate.hit_rate, 3)
     
     if return_image:
         base64_image = vs.get_undistorted_image_base64(draw_axes=visualize_axes)
@@ -679,7 +963,8 @@ def get_live_image(visualize_axes: bool = False, detect_objects: bool = False, c
             log_tool_call("get_live_image", {"detect_objects": detect_objects, "calling_client": calling_client}, res)
             return res
     
-    res = json.dumps(resp, ensure_ascii=False)
+    with timed("json"):
+        res = json.dumps(resp, ensure_ascii=False)
     log_tool_call("get_live_image", {"detect_objects": detect_objects, "calling_client": calling_client}, res)
     return res
 
@@ -690,8 +975,8 @@ def convert_coordinates(x: float, y: float, z: float = 0.0, source: str = 'world
     if not vs:
         return "Error: Vision system is not available."
     
-    # Update pose
-    vs.update_pose()
+    # Update pose (pose only: corner points are undistorted instead of the full frame)
+    vs.update_pose(undistort_frame=False)
     
     # 1. Normalize to Marker Coordinates (xm, ym, zm)
     xm, ym, zm = 0.0, 0.0, 0.0
@@ -743,6 +1028,25 @@ def convert_coordinates(x: float, y: float, z: float = 0.0, source: str = 'world
 def get_tool_logs(calling_client: str = 'gemini') -> str:
     return json.dumps(TOOL_LOGS, ensure_ascii=False)
 
+def _cache_metrics():
+    """キャッシュ・モーションゲートなどの統計 (ビジョンシステムが初期化済みの場合のみ)"""
+    vs = _vision_system
+    if not vs:
+        return {}
+    return {
+        "jpeg_cache": {"hits": vs.jpeg_cache.hits, "misses": vs.jpeg_cache.misses},
+        "detection_cache": {"hits": vs.detection_cache_hits, "misses": vs.detection_cache_misses},
+        "motion_gate": vs.motion_gate.stats(),
+        "marker_detection_paths": dict(vs.detection_path_counts)
+    }
+
+@mcp.tool()
+@set_doc(DOCS['get_metrics'])
+def get_metrics(calling_client: str = 'gemini') -> str:
+    serial_stats = _serial_transport.stats() if _serial_transport else {}
+    state_stats = _robot_state.stats() if _robot_state else {}
+    return json.dumps({"stages": metrics.snapshot(), "caches": _cache_metrics(), "serial": serial_stats, "robot_state": state_stats}, ensure_ascii=False)
+
 # --- ジョイパッド制御用 ---
 servo_pulse_widths = {'c0': 1500, 'c1': 1500, 'c2': 1500, 'c3': 1500}
 JOYPAD_GAINS = {
@@ -767,22 +1071,19 @@ def joypad_control_loop():
         if not QUIET_MODE:
             print("Syncing servo positions from robot...")
         
-        # 現状のステータスを取得
-        status = send_command("dump")
-        if not QUIET_MODE:
-            print(f"Initial Robot Status: {status}")
-        
-        # ロボットから正常なステータスが返ってきた場合のみ同期
-        if status and "Error" not in status:
-            for cmd in servo_pulse_widths.keys():
-                match = re.search(rf"{cmd}[=:\s]+(\d+)", status)
-                if match:
-                    try:
-                        servo_pulse_widths[cmd] = float(match.group(1))
-                        if not QUIET_MODE:
-                            print(f"Synced {cmd} -> {servo_pulse_widths[cmd]}")
-                    except ValueError:
-                        pass
+        # 現状のステータスを取得し、ロボットから正常なステータスが返ってきた場合のみ同期
+        # (バイナリプロトコルでは MSG_STATUS、テキストプロトコルでは dump で問い合わせる)
+        try:
+            status = get_serial_transport().send_status()
+            if not QUIET_MODE:
+                print(f"Initial Robot Status: {status}")
+            for ch, us in enumerate(status["us"]):
+                cmd = f"c{ch}"
+                servo_pulse_widths[cmd] = float(us)
+                if not QUIET_MODE:
+                    print(f"Synced {cmd} -> {servo_pulse_widths[cmd]}")
+        except SerialTransportError as e:
+            print(f"Servo sync skipped: {_format_serial_error(e)}")
 
         while True:
             # 軸とコマンドのマッピング
@@ -823,25 +1124,34 @@ class StreamingHandler(http.server.BaseHTTPRequestHandler):
             self.send_header('Content-Type', 'multipart/x-mixed-replace; boundary=frame')
             self.send_header('Access-Control-Allow-Origin', '*')
             self.end_headers()
+            # カメラ読み出しとエンコードは共有エンコーダスレッドが1回だけ行い、
+            # 各クライアントは同じJPEGバイト列を受け取って送信するだけにする
+            sub = _mjpeg_broadcaster.subscribe()
             try:
+                last_id = 0
                 while True:
-                    vs = get_vision_system()
-                    if vs:
-                        frame_bytes = vs.get_jpeg_bytes()
-                        if frame_bytes:
-                            self.wfile.write(b'--frame\r\n')
-                            self.send_header('Content-Type', 'image/jpeg')
-                            self.send_header('Content-Length', len(frame_bytes))
-                            self.end_headers()
-                            self.wfile.write(frame_bytes)
-                            self.wfile.write(b'\r\n')
-                        else:
-                            time.sleep(0.05)
-                    else:
-                        time.sleep(0.1)
-                    time.sleep(0.04) # ~25 FPS
+                    frame_id, frame_bytes = sub.wait_next(last_id, timeout=1.0)
+                    if frame_bytes is None:
+                        continue
+                    last_id = frame_id
+                    self.wfile.write(b'--frame\r\n')
+                    self.send_header('Content-Type', 'image/jpeg')
+                    self.send_header('Content-Length', len(frame_bytes))
+                    self.end_headers()
+                    self.wfile.write(frame_bytes)
+                    self.wfile.write(b'\r\n')
             except Exception:
                 pass
+            finally:
+                _mjpeg_broadcaster.unsubscribe(sub)
+        elif self.path.startswith('/metrics'):
+            # 処理段階ごとのレイテンシ (Prometheus テキスト形式)
+            body = metrics.prometheus_text().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
         else:
             self.send_error(404)
 
@@ -853,6 +1163,34 @@ if __name__ == "__main__":
     parser.add_argument("--lang", type=str, default="ja", choices=["ja", "en"], help="Language (ja/en)")
     parser.add_argument("--model", type=str, default="best_20260218.pt", help="Path to YOLO model file (default: best.pt)")
     parser.add_argument("--quiet", action="store_true", help="Suppress HTTP access logs")
+    parser.add_argument("--camera", type=str, default="0", help="Camera source: device index/path, stream URL, video file, image directory or 'synthetic' (default: 0)")
+    parser.add_argument("--no-loop", action="store_true", help="Stop at the end of a video file or image directory instead of looping")
+    parser.add_argument("--fps", type=float, default=None, help="Playback rate for video, image and synthetic sources; 0 reads as fast as possible (default: source rate)")
+    parser.add_argument("--protocol", type=str, default="text", choices=PROTOCOLS, help="Serial protocol: text, binary (framed, fails if unsupported) or auto (framed, falls back to text) (default: text)")
+    parser.add_argument("--serial-window", type=int, default=4, help="Sub-commands of a sequence kept in flight ahead of the robot; 1 disables pipelining (default: 4)")
+    parser.add_argument("--no-reach-check", action="store_true", help="Send sequences without checking that move targets are within the arm's reach")
+    parser.add_argument("--state-poll-sec", type=float, default=2.0, help="Refresh the cached robot state this often while the serial link is idle; 0 disables polling (default: 2.0)")
+    parser.add_argument("--baud", type=int, default=9600, help="Serial baud rate; must match SERIAL_BAUD in the firmware (default: 9600)")
+    parser.add_argument("--persist-undistort-maps", action="store_true", help="Save undistortion remap tables next to calibration_data.npz and reuse them on restart")
+    parser.add_argument("--backend", type=str, default="auto", choices=BACKENDS, help="Inference backend (default: auto, selected by model suffix .pt/.onnx/.xml)")
+    parser.add_argument("--imgsz", type=int, default=640, help="Inference input size in pixels (default: 640)")
+    parser.add_argument("--threads", type=int, default=None, help="CPU threads used for inference (default: runtime default)")
+    parser.add_argument("--export", type=str, default=None, choices=["onnx", "openvino"], help="Export the .pt model to a CPU-friendly format before starting and use it")
+    parser.add_argument("--no-warmup", action="store_true", help="Load the YOLO model on first use instead of warming it up at startup")
+    parser.add_argument("--detect-service", action="store_true", help="Run object detection continuously in a background thread and serve the latest snapshot")
+    parser.add_argument("--detect-interval-ms", type=int, default=200, help="Minimum interval between background detection runs in ms (default: 200)")
+    parser.add_argument("--detect-idle-sec", type=float, default=30.0, help="Pause background detection after this many seconds without requests (default: 30)")
+    parser.add_argument("--track", action="store_true", help="Assign persistent track IDs to detections and skip YOLO between keyframes")
+    parser.add_argument("--track-keyframe", type=int, default=5, help="Run full detection every N frames while tracking (default: 5)")
+    parser.add_argument("--motion-gate", action="store_true", help="Reuse the previous detections in the background detection service and tracker keyframes when the scene has not changed")
+    parser.add_argument("--motion-change-ratio", type=float, default=0.0005, help="Fraction of changed thumbnail pixels that counts as scene motion (default: 0.0005)")
+    parser.add_argument("--workspace", type=str, default=None, help="Workspace rectangle in marker coordinates 'xm_min,ym_min,xm_max,ym_max' (mm). Detection runs only on its projection")
+    parser.add_argument("--workspace-height", type=float, default=150.0, help="Maximum object height inside the workspace in mm (default: 150)")
+    parser.add_argument("--detect-worker", action="store_true", help="Run YOLO inference in a separate worker process fed through shared memory")
+    parser.add_argument("--pose-lock", action="store_true", help="Freeze the camera pose after consistent frames (fixed camera and marker)")
+    parser.add_argument("--pose-lock-frames", type=int, default=10, help="Consistent frames required before the pose is locked (default: 10)")
+    parser.add_argument("--pose-recheck-sec", type=float, default=5.0, help="Interval in seconds for re-validating a locked pose (default: 5.0)")
+    parser.add_argument("--pose-drift-px", type=float, default=3.0, help="Reprojection drift in pixels that releases the pose lock (default: 3.0)")
     args = parser.parse_args()
 
     # グローバル設定の更新
@@ -860,6 +1198,49 @@ if __name__ == "__main__":
     if not os.path.isabs(YOLO_MODEL_PATH):
         YOLO_MODEL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), YOLO_MODEL_PATH)
 
+    INFERENCE_BACKEND = args.backend
+    INFERENCE_IMGSZ = args.imgsz
+    INFERENCE_THREADS = args.threads
+    if args.export:
+        try:
+            print(f"Exporting {YOLO_MODEL_PATH} to {args.export} (imgsz: {INFERENCE_IMGSZ})...")
+            YOLO_MODEL_PATH = export_model(YOLO_MODEL_PATH, args.export, INFERENCE_IMGSZ)
+            INFERENCE_BACKEND = args.export
+            print(f"Using exported model: {YOLO_MODEL_PATH}")
+        except Exception as e:
+            print(f"Model export failed, using {YOLO_MODEL_PATH}: {e}")
+
+    CAMERA_ID = int(args.camera) if args.camera.isdigit() else args.camera
+    CAMERA_LOOP = not args.no_loop
+    CAMERA_FPS = args.fps
+    SERIAL_PROTOCOL = args.protocol
+    SERIAL_WINDOW = args.serial_window
+    STATE_POLL_SEC = args.state_poll_sec
+    REACH_CHECK = not args.no_reach_check
+    BAUD_RATE = args.baud
+    PERSIST_UNDISTORT_MAPS = args.persist_undistort_maps
+    DETECT_WORKER = args.detect_worker
+    DETECT_SERVICE = args.detect_service
+    DETECT_INTERVAL_MS = args.detect_interval_ms
+    DETECT_IDLE_SEC = args.detect_idle_sec
+    TRACK_OBJECTS = args.track
+    TRACK_KEYFRAME_INTERVAL = args.track_keyframe
+    MOTION_GATE = args.motion_gate
+    MOTION_CHANGE_RATIO = args.motion_change_ratio
+    if args.workspace:
+        try:
+            WORKSPACE = tuple(float(v) for v in args.workspace.split(','))
+            if len(WORKSPACE) != 4:
+                raise ValueError("expected 4 values")
+        except ValueError as e:
+            print(f"Invalid --workspace '{args.workspace}' ({e}). Detection will use the full frame.")
+            WORKSPACE = None
+    WORKSPACE_HEIGHT_MM = args.workspace_height
+    POSE_LOCK = args.pose_lock
+    POSE_LOCK_FRAMES = args.pose_lock_frames
+    POSE_RECHECK_SEC = args.pose_recheck_sec
+    POSE_DRIFT_PX = args.pose_drift_px
+
     if args.quiet:
         QUIET_MODE = True
         VERBOSE_SERIAL = False
@@ -879,7 +1260,12 @@ if __name__ == "__main__":
                     joypad_axis_values[cmd] = value
                 elif cmd == "START":
                     print("[Joypad] START pressed -> Checking Status")
-                    print(get_robot_status())
+                    # ツールは async なので、同期版の send_status で問い合わせる (ジョイパッドのスレッドから呼ばれる)
+                    try:
+                        status = get_serial_transport().send_status()
+                        print(f"X={status['x']} Y={status['y']} Z={status['z']} us={status['us']}")
+                    except SerialTransportError as e:
+                        print(_format_serial_error(e))
                 elif value is None:
                     print(f"[Joypad] Button {cmd} pressed")
             
@@ -914,6 +1300,15 @@ if __name__ == "__main__":
         server_thread.start()
         print("MCP Server running in background thread.")
 
+        # YOLOモデルの読み込みとウォームアップ (最初の検出要求の遅延を避ける)
+        if not args.no_warmup:
+            threading.Thread(target=get_yolo_model, daemon=True).start()
+
+        # バックグラウンド検出サービス (最初の検出要求が来るまでは休止)
+        if DETECT_SERVICE:
+            _detection_service = DetectionService(get_vision_system, get_yolo_model, DETECT_INTERVAL_MS / 1000.0, DETECT_IDLE_SEC)
+            _detection_service.start()
+
         # MJPEGストリーミングサーバーの起動
         def run_mjpeg_server():
             try:
@@ -950,6 +1345,14 @@ if __name__ == "__main__":
                     pass
         finally:
             # プログラム終了時に、確保したリソースを確実に解放する
+            if _detection_service:
+                _detection_service.stop()
+            if _robot_state:
+                _robot_state.stop()
+            if _serial_transport:
+                _serial_transport.stop() # シリアルポートを閉じる
             if _vision_system:
                 _vision_system.release() # カメラを解放
-                print("Vision system resources released.")
\ No newline at end of file
+                print("Vision system resources released.")
+            if isinstance(_yolo_model, DetectionWorkerClient):
+                _yolo_model.close() # 検出ワーカーと共有メモリを解放
\ No newline at end of file
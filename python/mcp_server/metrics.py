@@ -0,0 +1,134 @@
+import functools
+import inspect
+import threading
+import time
+from collections import deque
+import numpy as np
+
+"""
+処理段階ごとのレイテンシ計測。
+
+timed("yolo") のように処理をコンテキストマネージャで囲むと、
+所要時間が段階ごとのローリングウィンドウ(直近N件)に記録されます。
+集計値 (p50/p95/p99) は get_metrics ツールと、MJPEGサーバーの /metrics
+(Prometheus テキスト形式) から参照できます。
+"""
+
+class LatencyWindow:
+    """1つの処理段階の直近の所要時間(秒)と累計値を保持する"""
+    def __init__(self, size=1024):
+        self.samples = deque(maxlen=size)
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, seconds):
+        self.samples.append(seconds)
+        self.count += 1
+        self.total += seconds
+
+    def quantiles(self, qs=(0.5, 0.95, 0.99)):
+        if not self.samples:
+            return {q: 0.0 for q in qs}
+        values = np.percentile(np.fromiter(self.samples, dtype=np.float64), [q * 100 for q in qs])
+        return dict(zip(qs, values.tolist()))
+
+class StageTimer:
+    """
+    Metrics.timed() の戻り値。with 文とデコレータの両方で使える。
+    デコレータとして使う場合、非同期関数 (async def) は await の完了までを計測する。
+    """
+    def __init__(self, registry, stage):
+        self.registry = registry
+        self.stage = stage
+        self.started = None
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.registry.observe(self.stage, time.perf_counter() - self.started)
+        return False
+
+    def __call__(self, func):
+        registry, stage = self.registry, self.stage
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with registry.timed(stage):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with registry.timed(stage):
+                return func(*args, **kwargs)
+        return wrapper
+
+class Metrics:
+    """処理段階ごとのレイテンシを集計するレジストリ"""
+    def __init__(self, window_size=1024):
+        self.window_size = window_size
+        self.stages = {}
+        self.lock = threading.Lock()
+
+    def observe(self, stage, seconds):
+        """所要時間(秒)を記録する"""
+        with self.lock:
+            window = self.stages.get(stage)
+            if window is None:
+                window = self.stages[stage] = LatencyWindow(self.window_size)
+            window.add(seconds)
+
+    def timed(self, stage):
+        """with ブロック、または関数 (同期・非同期) の所要時間を stage として記録する"""
+        return StageTimer(self, stage)
+
+    def reset(self):
+        """全ての記録を破棄する"""
+        with self.lock:
+            self.stages = {}
+
+    def snapshot(self):
+        """
+        段階ごとの集計値を返す。
+
+        Returns:
+            dict: {stage: {"count": int, "mean_ms": float, "p50_ms": float, "p95_ms": float, "p99_ms": float}}
+        """
+        with self.lock:
+            items = [(stage, list(w.samples), w.count, w.total) for stage, w in self.stages.items()]
+        result = {}
+        for stage, samples, count, total in sorted(items):
+            if samples:
+                p50, p95, p99 = np.percentile(samples, [50, 95, 99]).tolist()
+            else:
+                p50 = p95 = p99 = 0.0
+            result[stage] = {
+                "count": count,
+                "mean_ms": round(total / count * 1000.0, 3) if count else 0.0,
+                "p50_ms": round(p50 * 1000.0, 3),
+                "p95_ms": round(p95 * 1000.0, 3),
+                "p99_ms": round(p99 * 1000.0, 3)
+            }
+        return result
+
+    def prometheus_text(self, name="robot_stage_latency_seconds"):
+        """Prometheus テキスト形式 (summary) で出力する"""
+        with self.lock:
+            items = [(stage, w.quantiles(), w.count, w.total) for stage, w in self.stages.items()]
+        lines = [
+            f"# HELP {name} Latency of each processing stage (rolling window quantiles).",
+            f"# TYPE {name} summary"
+        ]
+        for stage, quantiles, count, total in sorted(items, key=lambda item: item[0]):
+            for q, value in quantiles.items():
+                lines.append(f'{name}{{stage="{stage}",quantile="{q}"}} {value:.6f}')
+            lines.append(f'{name}_sum{{stage="{stage}"}} {total:.6f}')
+            lines.append(f'{name}_count{{stage="{stage}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+# プロセス全体で共有するレジストリ
+metrics = Metrics()
+timed = metrics.timed
+observe = metrics.observe
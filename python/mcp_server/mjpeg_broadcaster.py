@@ -0,0 +1,111 @@
+import threading
+import time
+
+class MjpegSubscriber:
+    """
+    MJPEG配信の購読者（ブラウザの接続1本）ごとの受信スロット。
+    最新のJPEGだけを保持し、クライアント毎の条件変数で新フレーム到着を通知します。
+    """
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.frame_id = 0
+        self.jpeg = None
+
+    def publish(self, frame_id, jpeg):
+        """エンコード済みJPEGを受け取り、待機中のクライアントスレッドを起こします。"""
+        with self.cond:
+            self.frame_id = frame_id
+            self.jpeg = jpeg
+            self.cond.notify_all()
+
+    def wait_next(self, last_id, timeout=1.0):
+        """
+        last_id より新しいフレームが届くまで待機します。
+
+        Returns:
+            tuple: (frame_id, JPEGバイト列)。タイムアウト時は (last_id, None)。
+        """
+        with self.cond:
+            if not self.cond.wait_for(lambda: self.frame_id > last_id, timeout):
+                return last_id, None
+            return self.frame_id, self.jpeg
+
+class MjpegBroadcaster:
+    """
+    単一のエンコーダスレッドで注釈付きJPEGをフレーム毎に1回だけ生成し、
+    全ての購読者へ同じバイト列を配信するクラス。
+    購読者が居ない間はエンコーダスレッドは休止します。
+    """
+    def __init__(self, get_vision_system, max_fps=25):
+        """
+        Args:
+            get_vision_system (callable): VisionSystemを返す関数（遅延初期化に対応）。
+            max_fps (float): 配信フレームレートの上限。
+        """
+        self.get_vision_system = get_vision_system
+        self.min_interval = 1.0 / max_fps if max_fps else 0.0
+        self.subscribers = set()
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.running = False
+        self.thread = None
+
+    def subscribe(self):
+        """購読者を登録し、必要であればエンコーダスレッドを開始します。"""
+        sub = MjpegSubscriber()
+        with self.lock:
+            self.subscribers.add(sub)
+            if not self.running:
+                self.running = True
+                self.thread = threading.Thread(target=self._encode_loop, daemon=True)
+                self.thread.start()
+        self.wake.set()
+        return sub
+
+    def unsubscribe(self, sub):
+        """購読者の登録を解除します。"""
+        with self.lock:
+            self.subscribers.discard(sub)
+
+    def stop(self):
+        """エンコーダスレッドを停止します。"""
+        self.running = False
+        self.wake.set()
+
+    def _encode_loop(self):
+        """エンコードループ（別スレッドで実行）"""
+        last_id = 0
+        while self.running:
+            with self.lock:
+                subscribers = list(self.subscribers)
+            if not subscribers:
+                self.wake.wait(1.0)
+                self.wake.clear()
+                continue
+
+            vs = self.get_vision_system()
+            if not vs:
+                time.sleep(0.1)
+                continue
+
+            try:
+                # 新しいカメラフレームが届くまで待つ（同じフレームを二度エンコードしない）
+                vs.grabber.wait_for_frame(last_id, timeout=1.0)
+                started = time.monotonic()
+                frame_id, jpeg = vs.get_jpeg_frame()
+            except Exception as e:
+                print(f"MJPEG encoder error: {e}")
+                time.sleep(0.1)
+                continue
+
+            if jpeg is None or frame_id <= last_id:
+                time.sleep(0.01)
+                continue
+            last_id = frame_id
+
+            for sub in subscribers:
+                sub.publish(frame_id, jpeg)
+
+            elapsed = time.monotonic() - started
+            if elapsed < self.min_interval:
+                time.sleep(self.min_interval - elapsed)
@@ -0,0 +1,116 @@
+import threading
+import cv2
+import numpy as np
+
+class MotionGate:
+    """
+    縮小したグレースケール画像(サムネイル)の差分で、シーンが変化したかを判定するクラス。
+
+    最後に検出を行ったフレームのサムネイルを基準として保持し、
+    ワークスペースのROI内で輝度が pixel_threshold 以上変化した画素の割合が
+    change_ratio を超えなければ「変化なし」と判定します。
+    変化なしの場合、呼び出し側は前回の検出結果を再利用して推論を省略できます。
+    """
+    def __init__(self, change_ratio=0.0005, pixel_threshold=15, thumb_width=160):
+        """
+        Args:
+            change_ratio (float): 変化ありと判定する、変化画素の割合の下限。
+            pixel_threshold (int): 画素が変化したとみなす輝度差 (0-255)。
+            thumb_width (int): サムネイルの幅 (ピクセル)。高さはアスペクト比から決まる。
+        """
+        self.change_ratio = change_ratio
+        self.pixel_threshold = pixel_threshold
+        self.thumb_width = thumb_width
+        self.roi = None  # (x1, y1, x2, y2) 元フレームのピクセル座標
+        self.reference = None
+        self.lock = threading.Lock()
+        self.checks = 0
+        self.hits = 0
+        self.last_change = None
+
+    def thumbnail(self, frame):
+        """フレームからサムネイルを作成する"""
+        h, w = frame.shape[:2]
+        size = (self.thumb_width, max(1, int(round(h * self.thumb_width / w))))
+        small = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY) if small.ndim == 3 else small
+
+    def set_roi(self, roi):
+        """
+        判定対象の領域を設定する。
+
+        Args:
+            roi (tuple): 元フレームのピクセル座標 (x1, y1, x2, y2)。Noneの場合はフレーム全体。
+        """
+        with self.lock:
+            self.roi = tuple(int(v) for v in roi) if roi is not None else None
+
+    def _roi_slice(self, frame_shape, thumb_shape):
+        """ROIをサムネイル上のスライスに変換する"""
+        if self.roi is None:
+            return slice(None), slice(None)
+        fh, fw = frame_shape[:2]
+        th, tw = thumb_shape[:2]
+        x1, y1, x2, y2 = self.roi
+        tx1, tx2 = int(np.floor(x1 * tw / fw)), int(np.ceil(x2 * tw / fw))
+        ty1, ty2 = int(np.floor(y1 * th / fh)), int(np.ceil(y2 * th / fh))
+        tx1, ty1 = max(0, tx1), max(0, ty1)
+        tx2, ty2 = min(tw, max(tx2, tx1 + 1)), min(th, max(ty2, ty1 + 1))
+        return slice(ty1, ty2), slice(tx1, tx2)
+
+    def measure(self, frame):
+        """
+        基準サムネイルに対する変化画素の割合を返す。基準が無い場合は1.0。
+
+        Returns:
+            tuple: (変化画素の割合, 現在フレームのサムネイル)
+        """
+        thumb = self.thumbnail(frame)
+        with self.lock:
+            reference = self.reference
+            if reference is None or reference.shape != thumb.shape:
+                return 1.0, thumb
+            rows, cols = self._roi_slice(frame.shape, thumb.shape)
+        diff = cv2.absdiff(thumb[rows, cols], reference[rows, cols])
+        return float(np.count_nonzero(diff >= self.pixel_threshold)) / max(1, diff.size), thumb
+
+    def check(self, frame):
+        """
+        シーンが変化したかを判定し、統計 (ヒット率) を更新する。
+
+        Returns:
+            tuple: (変化したか, 変化画素の割合, 現在フレームのサムネイル)
+        """
+        change, thumb = self.measure(frame)
+        changed = change > self.change_ratio
+        with self.lock:
+            self.checks += 1
+            if not changed:
+                self.hits += 1
+            self.last_change = change
+        return changed, change, thumb
+
+    def commit(self, thumb):
+        """検出を行ったフレームのサムネイルを新しい基準として保存する"""
+        with self.lock:
+            self.reference = thumb
+
+    def reset(self):
+        """基準サムネイルを破棄する（次回は必ず変化ありと判定される）"""
+        with self.lock:
+            self.reference = None
+
+    @property
+    def hit_rate(self):
+        """変化なし (推論省略) と判定された割合"""
+        return self.hits / self.checks if self.checks else 0.0
+
+    def stats(self):
+        """統計情報を返す"""
+        with self.lock:
+            return {
+                "checks": self.checks,
+                "hits": self.hits,
+                "hit_rate": round(self.hits / self.checks, 3) if self.checks else 0.0,
+                "last_change_ratio": self.last_change
+            }
@@ -0,0 +1,231 @@
+import copy
+import itertools
+import numpy as np
+from motion_gate import MotionGate
+
+def box_iou(a, b):
+    """2つのボックス [ymin, xmin, ymax, xmax] (0-1000正規化座標) のIoUを計算する"""
+    ymin, xmin = max(a[0], b[0]), max(a[1], b[1])
+    ymax, xmax = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0.0, ymax - ymin) * max(0.0, xmax - xmin)
+    area_a = (a[2] - a[0]) * (a[3] - a[1])
+    area_b = (b[2] - b[0]) * (b[3] - b[1])
+    union = area_a + area_b - inter
+    return inter / union if union > 0 else 0.0
+
+class GroundKalmanFilter:
+    """
+    接地中心 (xm, ym) [mm] の等速度モデルのカルマンフィルタ。
+    状態は [x, y, vx, vy]、観測は [x, y] です。
+    """
+    def __init__(self, xm, ym, process_noise=50.0, measurement_noise=4.0):
+        """
+        Args:
+            xm, ym (float): 初期位置 (mm)。
+            process_noise (float): 加速度のばらつき (mm/s^2)^2 に相当する係数。
+            measurement_noise (float): 観測位置の分散 (mm^2)。
+        """
+        self.x = np.array([xm, ym, 0.0, 0.0])
+        self.P = np.diag([measurement_noise, measurement_noise, 100.0, 100.0])
+        self.q = process_noise
+        self.R = np.eye(2) * measurement_noise
+        self.H = np.array([[1.0, 0.0, 0.0, 0.0], [0.0, 1.0, 0.0, 0.0]])
+
+    def predict(self, dt):
+        """dt秒後の状態を予測する"""
+        if dt <= 0:
+            return self.x[:2]
+        F = np.eye(4)
+        F[0, 2] = F[1, 3] = dt
+        # 離散化した白色加速度ノイズ
+        g = np.array([0.5 * dt * dt, 0.5 * dt * dt, dt, dt])
+        Q = np.diag(g * g) * self.q
+        self.x = F @ self.x
+        self.P = F @ self.P @ F.T + Q
+        return self.x[:2]
+
+    def update(self, xm, ym):
+        """観測位置で状態を更新する"""
+        y = np.array([xm, ym]) - self.H @ self.x
+        S = self.H @ self.P @ self.H.T + self.R
+        K = self.P @ self.H.T @ np.linalg.inv(S)
+        self.x = self.x + K @ y
+        self.P = (np.eye(4) - K @ self.H) @ self.P
+        return self.x[:2]
+
+class Track:
+    """追跡中の1物体"""
+    def __init__(self, track_id, detection, timestamp):
+        self.track_id = track_id
+        self.detection = detection
+        self.hits = 1
+        self.misses = 0
+        self.last_time = timestamp
+        gc = detection.get("ground_center")
+        self.kf = GroundKalmanFilter(gc["xm"], gc["ym"]) if gc else None
+
+    def predict(self, timestamp):
+        """指定時刻まで状態を進める"""
+        if self.kf is not None:
+            self.kf.predict(timestamp - self.last_time)
+        self.last_time = timestamp
+
+    def correct(self, detection):
+        """検出結果で状態を更新する"""
+        self.detection = detection
+        self.hits += 1
+        self.misses = 0
+        gc = detection.get("ground_center")
+        if gc:
+            if self.kf is None:
+                self.kf = GroundKalmanFilter(gc["xm"], gc["ym"])
+            else:
+                self.kf.update(gc["xm"], gc["ym"])
+
+    def output(self, predicted=False):
+        """追跡IDと平滑化した接地中心を付けた検出結果を返す"""
+        det = copy.deepcopy(self.detection)
+        det["track_id"] = self.track_id
+        det["track_hits"] = self.hits
+        if predicted:
+            det["predicted"] = True
+        if self.kf is not None and "ground_center" in det:
+            det["ground_center"]["xm"] = float(self.kf.x[0])
+            det["ground_center"]["ym"] = float(self.kf.x[1])
+        return det
+
+class ObjectTracker:
+    """
+    検出結果に永続的な追跡IDを割り当てるマルチオブジェクトトラッカー。
+
+    キーフレーム (YOLOを実行したフレーム) では、画像上のIoUと
+    接地中心の距離で既存のトラックと対応付け、カルマンフィルタで接地中心を平滑化します。
+    キーフレームの間は推論を行わず、トラックの状態を予測して返します。
+    """
+    def __init__(self, iou_threshold=0.3, max_distance_mm=30.0, max_misses=3, keyframe_interval=5, motion_gate=None):
+        """
+        Args:
+            iou_threshold (float): 同一物体とみなすIoUの下限。
+            max_distance_mm (float): IoUで対応付けできない場合に同一物体とみなす接地中心の最大距離 (mm)。
+            max_misses (int): 連続してこの回数より多く未検出になったトラックを削除する。
+            keyframe_interval (int): YOLOを実行する間隔 (フレーム数)。
+            motion_gate (MotionGate, optional): キーフレームからの画像変化の判定に使う。変化があれば再検出する。
+        """
+        self.iou_threshold = iou_threshold
+        self.max_distance_mm = max_distance_mm
+        self.max_misses = max_misses
+        self.keyframe_interval = keyframe_interval
+        self.motion_gate = motion_gate or MotionGate()
+        self.pending_thumb = None
+        self.tracks = []
+        self.ids = itertools.count(1)
+        self.keyframe_id = 0
+        self.frames_since_keyframe = 0
+        self.last_frame_id = 0
+        self.last_output = []
+
+    def reset(self):
+        """全てのトラックを破棄する"""
+        self.tracks = []
+        self.keyframe_id = 0
+        self.frames_since_keyframe = 0
+        self.last_frame_id = 0
+        self.last_output = []
+        self.motion_gate.reset()
+
+    def needs_keyframe(self, frame_id, frame=None):
+        """このフレームでYOLOを実行すべきかを判定する"""
+        changed = False
+        if frame is not None:
+            changed, _, self.pending_thumb = self.motion_gate.check(frame)
+        if not self.tracks and self.keyframe_id == 0:
+            return True
+        if frame_id != self.last_frame_id and self.frames_since_keyframe + 1 >= self.keyframe_interval:
+            return True
+        return changed
+
+    def _associate(self, detections):
+        """トラックと検出結果を貪欲法で対応付け、(ペアのリスト, 未対応の検出インデックス) を返す"""
+        pairs = []
+        free_tracks = set(range(len(self.tracks)))
+        free_dets = set(range(len(detections)))
+
+        # 1. 画像上のIoUが大きい順に対応付ける
+        candidates = []
+        for ti in free_tracks:
+            for di in free_dets:
+                iou = box_iou(self.tracks[ti].detection["box_2d"], detections[di]["box_2d"])
+                if iou >= self.iou_threshold:
+                    candidates.append((iou, ti, di))
+        for _, ti, di in sorted(candidates, reverse=True):
+            if ti in free_tracks and di in free_dets:
+                pairs.append((ti, di))
+                free_tracks.discard(ti)
+                free_dets.discard(di)
+
+        # 2. 残りは同じラベルで接地中心が近いものを対応付ける
+        candidates = []
+        for ti in free_tracks:
+            track = self.tracks[ti]
+            if track.kf is None:
+                continue
+            for di in free_dets:
+                gc = detections[di].get("ground_center")
+                if not gc or detections[di]["label"] != track.detection["label"]:
+                    continue
+                dist = float(np.hypot(gc["xm"] - track.kf.x[0], gc["ym"] - track.kf.x[1]))
+                if dist <= self.max_distance_mm:
+                    candidates.append((dist, ti, di))
+        for _, ti, di in sorted(candidates):
+            if ti in free_tracks and di in free_dets:
+                pairs.append((ti, di))
+                free_tracks.discard(ti)
+                free_dets.discard(di)
+
+        return pairs, free_dets
+
+    def update(self, detections, timestamp, frame_id=0):
+        """
+        キーフレームの検出結果でトラックを更新する。
+
+        Returns:
+            list: 追跡IDを付けた検出結果のリスト。
+        """
+        for track in self.tracks:
+            track.predict(timestamp)
+
+        pairs, new_dets = self._associate(detections)
+        matched = set()
+        for ti, di in pairs:
+            self.tracks[ti].correct(detections[di])
+            matched.add(ti)
+        for ti, track in enumerate(self.tracks):
+            if ti not in matched:
+                track.misses += 1
+        self.tracks = [t for t in self.tracks if t.misses <= self.max_misses]
+        for di in sorted(new_dets):
+            self.tracks.append(Track(next(self.ids), detections[di], timestamp))
+
+        self.keyframe_id = frame_id
+        if self.pending_thumb is not None:
+            self.motion_gate.commit(self.pending_thumb)
+        self.frames_since_keyframe = 0
+        self.last_frame_id = frame_id
+        self.last_output = [t.output() for t in self.tracks if t.misses == 0]
+        return copy.deepcopy(self.last_output)
+
+    def predict(self, timestamp, frame_id=0):
+        """
+        推論を行わずに、現在のトラックを指定時刻まで予測して返す。
+
+        Returns:
+            list: 追跡IDを付けた検出結果のリスト ("predicted": True)。
+        """
+        if frame_id and frame_id == self.last_frame_id:
+            return copy.deepcopy(self.last_output)
+        for track in self.tracks:
+            track.predict(timestamp)
+        self.frames_since_keyframe += 1
+        self.last_frame_id = frame_id
+        self.last_output = [t.output(predicted=True) for t in self.tracks if t.misses == 0]
+        return copy.deepcopy(self.last_output)
@@ -0,0 +1,280 @@
+import copy
+import json
+import threading
+import time
+from serial_transport import SerialTransportError
+
+class RobotState:
+    """
+    ロボットの状態 (dump コマンドの応答) を1回だけ解析した構造化データ。
+
+    Attributes:
+        tcp (tuple): TCPの論理座標 (x, y, z) [mm] (世界座標系)。
+        joint_angles (list): J1 (Base), J2 (Shoulder), J3 (Elbow) の現在角度 [度]。
+        cur_us (list): 各サーボ (c0-c3) の現在のパルス幅 [us]。c3はグリッパー。
+        gripper (dict): {"open", "close", "speed", "cur_us", "opening"}。opening は開度 [%] (0=全閉, 100=全開)。
+        joints (list): 各関節のキャリブレーション点を含む dump の joints 配列。
+        timestamp (float): 状態を取得したUNIX時刻。
+        raw (dict): dump の応答をそのまま保持した辞書。
+    """
+    __slots__ = ("tcp", "joint_angles", "cur_us", "gripper", "joints", "timestamp", "monotonic", "raw")
+
+    def __init__(self, raw, timestamp=None, monotonic=None):
+        """
+        Args:
+            raw (dict): dump の応答 (JSON) を読み込んだ辞書。
+            timestamp (float, optional): 取得したUNIX時刻 (省略時は現在時刻)。
+            monotonic (float, optional): 取得した time.monotonic() の値 (省略時は現在値)。
+        """
+        try:
+            joints = raw["joints"]
+            gripper = raw["gripper"]
+            tcp = raw["tcp"]
+            self.tcp = (float(tcp["x"]), float(tcp["y"]), float(tcp["z"]))
+            self.joint_angles = [float(j["cur_angle"]) for j in joints]
+            self.cur_us = [int(j["cur_us"]) for j in joints] + [int(gripper["cur_us"])]
+            grip_open, grip_close = int(gripper["open"]), int(gripper["close"])
+        except (KeyError, TypeError, ValueError) as e:
+            raise SerialTransportError(f"Unexpected dump response: {e}")
+        span = grip_open - grip_close
+        opening = (self.cur_us[3] - grip_close) * 100.0 / span if span else 0.0
+        self.gripper = {
+            "open": grip_open,
+            "close": grip_close,
+            "speed": gripper.get("speed"),
+            "cur_us": self.cur_us[3],
+            "opening": round(opening, 1)
+        }
+        self.joints = joints
+        self.timestamp = time.time() if timestamp is None else timestamp
+        self.monotonic = time.monotonic() if monotonic is None else monotonic
+        self.raw = raw
+
+    @classmethod
+    def from_response(cls, lines):
+        """
+        dump コマンドの応答行 (SerialTransport の戻り値) から状態を作成する。
+
+        Raises:
+            SerialTransportError: 応答がJSONとして解析できない場合。
+        """
+        try:
+            raw = json.loads("".join(lines))
+        except ValueError as e:
+            raise SerialTransportError(f"Unexpected dump response: {e}")
+        return cls(raw)
+
+    def with_status(self, status):
+        """
+        現在位置とパルス幅 (SerialTransport.submit_status() の結果) で更新した新しい状態を作成する。
+        キャリブレーションなど dump にしか無い値はこの状態のものを引き継ぐ。
+
+        Args:
+            status (dict): {"x", "y", "z", "us": [c0, c1, c2, c3]}。
+        """
+        raw = copy.deepcopy(self.raw)
+        try:
+            raw["tcp"] = {"x": status["x"], "y": status["y"], "z": status["z"]}
+            for joint, us in zip(raw["joints"], status["us"]):
+                joint["cur_us"] = us
+                joint["cur_angle"] = round(_us_to_angle(joint, us), 1)
+            raw["gripper"]["cur_us"] = status["us"][3]
+        except (KeyError, TypeError, ValueError, IndexError) as e:
+            raise SerialTransportError(f"Unexpected status response: {e}")
+        return RobotState(raw)
+
+    def age_ms(self):
+        """状態を取得してからの経過時間(ミリ秒)"""
+        return (time.monotonic() - self.monotonic) * 1000.0
+
+    def pulse_widths(self):
+        """ジョイパッド制御用の {'c0': us, ..., 'c3': us}"""
+        return {f"c{ch}": us for ch, us in enumerate(self.cur_us)}
+
+    def to_dict(self):
+        """ツールの応答用の辞書"""
+        x, y, z = self.tcp
+        return {
+            "tcp": {"x": x, "y": y, "z": z},
+            "joint_angles": {"j1": self.joint_angles[0], "j2": self.joint_angles[1], "j3": self.joint_angles[2]},
+            "cur_us": self.pulse_widths(),
+            "gripper": self.gripper,
+            "timestamp": self.timestamp,
+            "age_ms": int(self.age_ms())
+        }
+
+    def __repr__(self):
+        return f"RobotState(tcp={self.tcp}, cur_us={self.cur_us}, age_ms={self.age_ms():.0f})"
+
+def _us_to_angle(joint, us):
+    """パルス幅を関節角度に変換する (ファームウェアの usToAngle と同じ式)"""
+    p0, p1 = float(joint["p0"]), float(joint["p1"])
+    a0, a1 = float(joint["a0"]), float(joint["a1"])
+    if abs(p1 - p0) < 1:
+        return a0
+    return a0 + (us - p0) * (a1 - a0) / (p1 - p0)
+
+class RobotStateCache:
+    """
+    ロボットの状態をキャッシュし、シリアル回線が空いている間にバックグラウンドで更新するクラス。
+
+    ツールは経過時間が max_age_ms 以下のキャッシュがあれば、シリアル通信を待たずに即座に応答できます。
+    ロボットを動かすコマンドを送信したら invalidate() を呼び出し、次の読み出しで必ず再取得させます。
+    ポーリングはコマンドの送受信中 (キューが空でない場合) や未接続の場合は行いません。
+
+    バイナリプロトコルで接続している場合、キャリブレーションが変わっていなければ dump の代わりに
+    固定レイアウトの MSG_STATUS で現在位置とパルス幅だけを取得します。
+    """
+    def __init__(self, get_transport, poll_interval_sec=2.0):
+        """
+        Args:
+            get_transport (callable): SerialTransport を返す関数（遅延初期化に対応）。
+            poll_interval_sec (float): バックグラウンド更新の間隔(秒)。0以下で無効。
+        """
+        self.get_transport = get_transport
+        self.poll_interval_sec = poll_interval_sec
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.state = None
+        self.generation = 0  # invalidate() のたびに増える
+        self.config_generation = 0  # キャリブレーションが変わるたびに増える
+        self.state_config = -1  # state のキャリブレーションを取得したときの config_generation
+        self.valid = False
+        self.hits = 0
+        self.refreshes = 0
+        self.polls = 0
+        self.last_error = None
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        """ポーリングスレッドを開始します。"""
+        if self.running or self.poll_interval_sec <= 0:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """ポーリングスレッドを停止します。"""
+        self.running = False
+        self.wake.set()
+        if self.thread:
+            self.thread.join(timeout=2.0)
+
+    def latest(self):
+        """最後に取得した状態を返します (古くても返す)。まだ無い場合はNone。"""
+        return self.state
+
+    def invalidate(self, config=False):
+        """
+        キャッシュを無効化します (ロボットの状態が変わるコマンドを送信した後に呼び出す)。
+
+        Args:
+            config (bool): キャリブレーションも変わった場合はTrue (次の取得は必ず dump で行う)。
+        """
+        with self.lock:
+            self.generation += 1
+            if config:
+                self.config_generation += 1
+            self.valid = False
+
+    def cached(self, max_age_ms):
+        """経過時間が max_age_ms 以下の有効なキャッシュを返します。無い場合はNone。"""
+        state = self._fresh(max_age_ms)
+        if state is not None:
+            self.hits += 1
+        return state
+
+    def _fresh(self, max_age_ms):
+        with self.lock:
+            state = self.state
+            if state is not None and self.valid and state.age_ms() <= max_age_ms:
+                return state
+        return None
+
+    def get(self, max_age_ms=1000):
+        """
+        状態を返します。有効なキャッシュが無ければ dump で再取得します (ブロックします)。
+
+        Raises:
+            SerialTransportError: 通信に失敗した場合。
+        """
+        state = self.cached(max_age_ms)
+        if state is not None:
+            return state
+        return self.refresh()
+
+    def refresh(self):
+        """状態を再取得します (ブロックします)。"""
+        transport = self.get_transport()
+        generation, config_generation = self.generation, self.config_generation
+        base = self._status_base(transport)
+        if base is not None:
+            state = base.with_status(transport.send_status())
+        else:
+            state = RobotState.from_response(transport.send("dump"))
+        return self._store(state, generation, config_generation)
+
+    async def get_async(self, max_age_ms=1000):
+        """get() の非同期版。"""
+        state = self.cached(max_age_ms)
+        if state is not None:
+            return state
+        transport = self.get_transport()
+        generation, config_generation = self.generation, self.config_generation
+        base = self._status_base(transport)
+        if base is not None:
+            state = base.with_status(await transport.query_status())
+        else:
+            state = RobotState.from_response(await transport.request("dump"))
+        return self._store(state, generation, config_generation)
+
+    def _status_base(self, transport):
+        """MSG_STATUS で更新できる場合、キャリブレーションを引き継ぐ状態を返す。dump が必要ならNone。"""
+        with self.lock:
+            if transport.active_protocol != "binary" or self.state_config != self.config_generation:
+                return None
+            return self.state
+
+    def _store(self, state, generation, config_generation):
+        with self.lock:
+            self.refreshes += 1
+            self.state = state
+            # 取得中に invalidate() された場合、この状態は移動前のものかもしれないので有効にしない
+            self.valid = generation == self.generation
+            self.state_config = config_generation
+        return state
+
+    def stats(self):
+        """統計情報を返す"""
+        state = self.state
+        return {
+            "hits": self.hits,
+            "refreshes": self.refreshes,
+            "polls": self.polls,
+            "valid": self.valid,
+            "age_ms": int(state.age_ms()) if state else None,
+            "last_error": self.last_error
+        }
+
+    def _loop(self):
+        """ポーリングループ（別スレッドで実行）"""
+        while self.running:
+            self.wake.wait(self.poll_interval_sec)
+            if not self.running:
+                break
+            transport = self.get_transport()
+            # 回線が使用中、または未接続なら何もしない (接続はツールの呼び出し時に行う)
+            if transport is None or transport.queue_depth > 0 or not transport.stats()["connected"]:
+                continue
+            if self._fresh(self.poll_interval_sec * 1000.0) is not None:
+                continue
+            try:
+                self.refresh()
+                self.polls += 1
+                self.last_error = None
+            except Exception as e:
+                if str(e) != self.last_error:
+                    print(f"Robot state polling error: {e}")
+                self.last_error = str(e)
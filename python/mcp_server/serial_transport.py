@@ -0,0 +1,535 @@
+import asyncio
+import json
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+import serial
+from metrics import observe
+from binary_protocol import (encode_command, encode_frame, decode_status, FrameReader, ProtocolError,
+                             MSG_PING, MSG_STATUS, REPLY_ACK, REPLY_TEXT, REPLY_STATUS, ACK_OK, ACK_BAD_FRAME)
+
+PROTOCOLS = ("text", "binary", "auto")
+# Arduino (AVR) のシリアル受信バッファのサイズ。先読みで送るコマンドの合計バイト数の上限
+RX_BUFFER_SIZE = 64
+
+class SerialTransportError(Exception):
+    """シリアル通信のエラー (接続失敗、タイムアウトなど)"""
+    pass
+
+class SerialConnectionError(SerialTransportError):
+    """シリアルポートに接続できない"""
+    pass
+
+class SerialTransport:
+    """
+    ロボットコントローラ (Arduino) とのシリアルポートを所有し、コマンドを順番に送受信するクラス。
+
+    専用スレッドで asyncio のイベントループを動かし、送信されたコマンドをキューに積んで1つずつ実行します。
+    submit() はコマンドごとの Future を返すので、呼び出し側はポートのロックを保持したまま
+    応答を待つ必要がありません。非同期のMCPツールからは request() を await できます。
+
+    通信プロトコル (ファームウェア側):
+        1. コマンド文字列の末尾に改行コード '\\n' を付与して送信する。
+        2. セミコロンで区切られた各サブコマンドの実行後に ';' が1行で返る (ハートビート)。
+        3. シーケンス全体が完了すると '!' が1行で返る (終端)。
+        4. それ以外の行はコマンドの応答本文。
+
+    protocol="binary" または "auto" の場合、接続時にバイナリフレームプロトコル (binary_protocol.py) に
+    対応しているかを確認し、対応していればサブコマンドごとにフレームを送ります (';' の代わりに ACK フレーム)。
+    対応していないファームウェアでは、"auto" はテキストプロトコルで通信し、"binary" は接続エラーになります。
+
+    submit_sequence() はシーケンスをサブコマンドに分けて送り、実行中のサブコマンドの後ろに最大 window 個までを
+    先読みで送信しておきます (ファームウェアの受信バッファに収まる範囲)。';' (または ACK) を受信するたびに次を送るので、
+    ファームウェアは前のサブコマンドの完了直後に次を実行でき、呼び出し側は1ステップごとに進捗を受け取れます。
+
+    ポートの読み書きはブロッキングなので、イベントループからは1スレッドのエグゼキュータ経由で実行します
+    (Windows の COM ポートでも同じ実装で動作します)。
+    """
+    def __init__(self, port, baud_rate=9600, soft_timeout=10.0, hard_timeout=180.0, open_delay=2.0, verbose=False, protocol="text", window=4):
+        """
+        Args:
+            port (str): シリアルポート (例: /dev/ttyACM0, COM3)。
+            baud_rate (int): ボーレート。
+            soft_timeout (float): この時間(秒)何も受信しなければ切断とみなす。
+            hard_timeout (float): 1コマンドの最大待ち時間(秒)。
+            open_delay (float): 接続後、Arduinoのリセット完了を待つ時間(秒)。
+            verbose (bool): 送受信の内容を表示するか。
+            protocol (str): "text"、"binary" (非対応ならテキストにフォールバック)、または "auto"。
+            window (int): submit_sequence() で同時に送信しておくサブコマンドの最大数 (1で先読みなし)。
+        """
+        self.port = port
+        self.baud_rate = baud_rate
+        self.soft_timeout = soft_timeout
+        self.hard_timeout = hard_timeout
+        self.open_delay = open_delay
+        self.verbose = verbose
+        self.protocol = protocol
+        self.window = max(1, window)
+        self.active_protocol = None  # 接続後に決定した "text" / "binary"
+        self.conn = None
+        self.rx = bytearray()
+        self.reader = FrameReader()
+        self.seq = 0
+        self.loop = None
+        self.queue = None
+        self.io = ThreadPoolExecutor(max_workers=1, thread_name_prefix="serial-io")
+        self.thread = None
+        self.started = threading.Event()
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.completed = 0
+        self.errors = 0
+
+    # --- ライフサイクル ---
+
+    def start(self):
+        """イベントループのスレッドを開始します。"""
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.thread = threading.Thread(target=self._thread_main, daemon=True)
+            self.thread.start()
+        self.started.wait()
+
+    def stop(self):
+        """イベントループを停止し、ポートを閉じます。未処理のコマンドはエラーで完了します。"""
+        with self.lock:
+            loop, thread = self.loop, self.thread
+            self.thread = None
+        if loop is None or thread is None:
+            return
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(timeout=2.0)
+        self.started.clear()
+        self._close()
+
+    def _thread_main(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.queue = asyncio.Queue()
+        worker = self.loop.create_task(self._worker())
+        self.started.set()
+        try:
+            self.loop.run_forever()
+        finally:
+            worker.cancel()
+            self.loop.run_until_complete(asyncio.gather(worker, return_exceptions=True))
+            # キューに残ったコマンドをエラーで完了させる
+            while not self.queue.empty():
+                _, _, future, _ = self.queue.get_nowait()
+                if not future.done():
+                    future.set_exception(SerialTransportError("Serial transport stopped."))
+            self.loop.close()
+
+    # --- コマンドの送信 ---
+
+    def submit(self, cmd, on_ack=None):
+        """
+        コマンドを送信キューに積み、Futureを返します (どのスレッドからでも呼び出し可能)。
+
+        Args:
+            cmd (str): 送信するコマンド (';' 区切りのシーケンスも可)。
+            on_ack (callable, optional): ';' を受信するたびに、受信数 (1始まり) を引数に
+                イベントループのスレッドから呼び出される。
+
+        Returns:
+            concurrent.futures.Future: 結果は応答本文の行リスト。失敗時は SerialTransportError。
+        """
+        return self._enqueue("command", cmd.strip(), on_ack)
+
+    def submit_sequence(self, commands, on_ack=None):
+        """
+        ';' 区切りのシーケンスをサブコマンドごとにパイプラインで送信し、Futureを返します。
+
+        Args:
+            commands (list | str): サブコマンドのリスト、または ';' 区切りの文字列。空のサブコマンドは送信しない。
+            on_ack (callable, optional): サブコマンドが1つ完了するたびに、完了数 (1始まり) を引数に呼び出される。
+
+        Returns:
+            concurrent.futures.Future: 結果は応答本文の行リスト。
+        """
+        if isinstance(commands, str):
+            commands = commands.split(";")
+        commands = [c.strip() for c in commands if c.strip()]
+        return self._enqueue("sequence", commands, on_ack)
+
+    def submit_status(self):
+        """
+        ロボットの現在位置とサーボのパルス幅を問い合わせる Future を返します。
+        バイナリプロトコルでは固定レイアウトの MSG_STATUS、テキストプロトコルでは dump を使います。
+
+        Returns:
+            concurrent.futures.Future: 結果は {"x", "y", "z", "us": [c0, c1, c2, c3]}。
+        """
+        return self._enqueue("status", None, None)
+
+    def _enqueue(self, kind, payload, on_ack):
+        self.start()
+        future = Future()
+        with self.lock:
+            self.pending += 1
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, (kind, payload, future, on_ack))
+        return future
+
+    async def request(self, cmd, on_ack=None):
+        """submit() の非同期版。応答本文の行リストを返します。"""
+        return await asyncio.wrap_future(self.submit(cmd, on_ack))
+
+    async def query_status(self):
+        """submit_status() の非同期版。"""
+        return await asyncio.wrap_future(self.submit_status())
+
+    def send(self, cmd, on_ack=None):
+        """submit() の同期版。応答が返るまでブロックします。"""
+        return self.submit(cmd, on_ack).result(timeout=self.hard_timeout + self.open_delay + 5.0)
+
+    def send_status(self):
+        """submit_status() の同期版。応答が返るまでブロックします。"""
+        return self.submit_status().result(timeout=self.hard_timeout + self.open_delay + 5.0)
+
+    @property
+    def queue_depth(self):
+        """送信待ち・実行中のコマンド数"""
+        return self.pending
+
+    def stats(self):
+        """統計情報を返す"""
+        return {
+            "port": self.port,
+            "baud_rate": self.baud_rate,
+            "connected": bool(self.conn and self.conn.is_open),
+            "protocol": self.active_protocol,
+            "queue_depth": self.pending,
+            "completed": self.completed,
+            "errors": self.errors
+        }
+
+    # --- イベントループ側の処理 ---
+
+    async def _worker(self):
+        """キューのコマンドを1つずつ実行する"""
+        while True:
+            kind, payload, future, on_ack = await self.queue.get()
+            try:
+                if future.set_running_or_notify_cancel():
+                    try:
+                        if kind == "status":
+                            result = await self._query_status()
+                        elif kind == "sequence":
+                            result = await self._execute_sequence(payload, on_ack)
+                        else:
+                            result = await self._execute(payload, on_ack)
+                        future.set_result(result)
+                        self.completed += 1
+                    except SerialTransportError as e:
+                        self.errors += 1
+                        future.set_exception(e)
+                    except Exception as e:
+                        # ポートのI/Oエラー (ケーブル抜けなど)。次のコマンドで再接続する
+                        self.errors += 1
+                        self._close()
+                        future.set_exception(SerialTransportError(str(e)))
+            finally:
+                with self.lock:
+                    self.pending -= 1
+
+    async def _run_io(self, func, *args):
+        return await self.loop.run_in_executor(self.io, func, *args)
+
+    async def _ensure_connected(self):
+        if self.conn is not None and self.conn.is_open:
+            return
+        try:
+            # 読み出しは短いタイムアウトで区切り、ソフトタイムアウトの判定をイベントループ側で行う
+            self.conn = await self._run_io(lambda: serial.Serial(self.port, self.baud_rate, timeout=0.1))
+        except Exception as e:
+            self.conn = None
+            raise SerialConnectionError(f"Cannot connect to robot ({e}).")
+        # Arduinoはシリアル接続時にリセットがかかるため、起動シーケンスが完了するのを待つ
+        await asyncio.sleep(self.open_delay)
+        await self._run_io(self.conn.reset_input_buffer)
+        self.active_protocol = "text"
+        if self.protocol in ("binary", "auto"):
+            if await self._negotiate_binary():
+                self.active_protocol = "binary"
+            elif self.protocol == "binary":
+                self._close()
+                raise SerialConnectionError("Robot firmware does not answer binary frames.")
+            else:
+                print("Robot firmware does not answer binary frames. Falling back to the text protocol.")
+
+    async def _negotiate_binary(self, timeout=1.0):
+        """
+        PINGフレームを送り、バイナリプロトコルに対応しているかを判定する。
+        末尾に改行を付けるので、非対応のファームウェアは不明なテキストコマンドとして '!' を返す。
+        """
+        seq = self._next_seq()
+        await self._run_io(self.conn.write, encode_frame(MSG_PING, seq) + b"\n")
+        deadline = time.monotonic() + timeout
+        received = bytearray()
+        supported = False
+        while time.monotonic() < deadline:
+            data = await self._run_io(self._read_chunk)
+            received.extend(data)
+            self.reader.feed(data)
+            if any(t == REPLY_ACK and s == seq for t, s, _ in self.reader.frames()):
+                supported = True
+                break
+            if b"\n!" in received or received.startswith(b"!"):
+                break
+        # 改行に対するテキスト応答などの残りを捨てる
+        await asyncio.sleep(0.05)
+        await self._run_io(self.conn.reset_input_buffer)
+        self.reader.clear()
+        self.rx.clear()
+        return supported
+
+    def _next_seq(self):
+        self.seq = (self.seq + 1) & 0xFF
+        return self.seq
+
+    def _close(self):
+        conn, self.conn = self.conn, None
+        self.active_protocol = None
+        self.rx.clear()
+        self.reader.clear()
+        if conn is not None:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def _read_chunk(self):
+        """受信済みのバイト列を読み出す (タイムアウト0.1秒でブロック)"""
+        return self.conn.read(max(1, self.conn.in_waiting))
+
+    async def _readline(self, deadline):
+        """
+        1行を読み出す。deadline (monotonic) までに改行が来なければNoneを返す。
+        """
+        while True:
+            idx = self.rx.find(b"\n")
+            if idx >= 0:
+                line = bytes(self.rx[:idx])
+                del self.rx[:idx + 1]
+                return line.decode("utf-8", errors="replace").strip()
+            if time.monotonic() >= deadline:
+                return None
+            self.rx.extend(await self._run_io(self._read_chunk))
+
+    def _notify_ack(self, on_ack, acks):
+        if on_ack is not None:
+            try:
+                on_ack(acks)
+            except Exception as e:
+                print(f"Serial ack callback error: {e}")
+
+    def _timeout_error(self, hard_deadline):
+        if time.monotonic() >= hard_deadline:
+            return SerialTransportError("Serial command timed out (Hard limit).")
+        # 強制切断して次のコマンドで再接続する
+        self._close()
+        return SerialTransportError(f"Serial command timed out (No response for {self.soft_timeout:g}s).")
+
+    async def _execute(self, cmd, on_ack=None):
+        """コマンドを送信し、応答本文の行リストを返す"""
+        await self._ensure_connected()
+        if self.verbose:
+            print(f"[Serial] -> {cmd}")
+        started = time.perf_counter()
+        if self.active_protocol == "binary":
+            response = await self._execute_binary(cmd, on_ack)
+        else:
+            response = await self._execute_text(cmd, on_ack)
+        observe("serial_roundtrip", time.perf_counter() - started)
+        if self.verbose and response:
+            print(f"[Serial] <- {' | '.join(response)}")
+        return response
+
+    async def _execute_sequence(self, commands, on_ack=None):
+        """サブコマンドのリストをパイプラインで送信し、応答本文の行リストを返す"""
+        await self._ensure_connected()
+        if self.verbose:
+            print(f"[Serial] -> {';'.join(commands)} (pipelined, window {self.window})")
+        started = time.perf_counter()
+        if self.active_protocol == "binary":
+            response = await self._execute_binary(";".join(commands), on_ack)
+        else:
+            response = await self._execute_text_pipelined(commands, on_ack)
+        observe("serial_roundtrip", time.perf_counter() - started)
+        if self.verbose and response:
+            print(f"[Serial] <- {' | '.join(response)}")
+        return response
+
+    def _can_send(self, inflight, size):
+        """
+        先読みで次を送信できるか。未完了の全体と次の送信分が受信バッファに収まる場合だけ送る。
+        ファームウェアは ';' (または ACK) を返した後に cmdint だけ待ってから次を読み出すので、
+        未完了の先頭 (次に実行する行) がまだ受信バッファに残っている場合がある。そのため先頭も含めて数える。
+        """
+        if not inflight:
+            return True
+        return len(inflight) < self.window and sum(inflight) + size <= RX_BUFFER_SIZE
+
+    async def _execute_text_pipelined(self, commands, on_ack=None):
+        """
+        テキストプロトコル: サブコマンドを1行ずつ送信する。
+        各行に ';' と '!' が返るので、';' を受信するたびに次の行を送る。
+        """
+        self.rx.clear()
+        await self._run_io(self.conn.reset_input_buffer)
+        lines = [(c + "\n").encode("utf-8") for c in commands]
+        inflight = deque()  # 送信済みで未完了の行のバイト数
+        response = []
+        sent = acks = ends = 0
+        hard_deadline = time.monotonic() + self.hard_timeout
+        while ends < len(lines):
+            while sent < len(lines) and self._can_send(inflight, len(lines[sent])):
+                await self._run_io(self.conn.write, lines[sent])
+                inflight.append(len(lines[sent]))
+                sent += 1
+            deadline = min(time.monotonic() + self.soft_timeout, hard_deadline)
+            line = await self._readline(deadline)
+            if line is None:
+                raise self._timeout_error(hard_deadline)
+            if line == ";":
+                acks += 1
+                if inflight:
+                    inflight.popleft()
+                self._notify_ack(on_ack, acks)
+            elif line == "!":
+                ends += 1
+            elif line:
+                response.append(line)
+        return response
+
+    async def _execute_text(self, cmd, on_ack=None):
+        """テキストプロトコル: 1行で送信し、'!' を受信するまでの応答行を返す"""
+        self.rx.clear()
+        await self._run_io(self.conn.reset_input_buffer)
+        await self._run_io(self.conn.write, (cmd + "\n").encode("utf-8"))
+
+        response = []
+        acks = 0
+        hard_deadline = time.monotonic() + self.hard_timeout
+        while True:
+            deadline = min(time.monotonic() + self.soft_timeout, hard_deadline)
+            line = await self._readline(deadline)
+            if line is None:
+                raise self._timeout_error(hard_deadline)
+            if line == ";":
+                # ハートビート (サブコマンド完了)
+                acks += 1
+                self._notify_ack(on_ack, acks)
+                continue
+            if line == "!":
+                # コマンド完了の合図
+                break
+            if line:
+                response.append(line)
+        return response
+
+    async def _read_frames(self, deadline):
+        """受信済みのフレームを返す。deadline までに1個も届かなければNone"""
+        while True:
+            frames = self.reader.frames()
+            if frames:
+                return frames
+            if time.monotonic() >= deadline:
+                return None
+            self.reader.feed(await self._run_io(self._read_chunk))
+
+    async def _send_frame(self, frame, seq, hard_deadline, text, status=None):
+        """
+        フレームを送信し、同じ seq の ACK を受信するまで待つ。
+        途中で届いたテキスト出力は text (bytearray) に、ステータスは status (list) に追加する。
+        """
+        await self._run_io(self.conn.write, frame)
+        while True:
+            deadline = min(time.monotonic() + self.soft_timeout, hard_deadline)
+            frames = await self._read_frames(deadline)
+            if frames is None:
+                raise self._timeout_error(hard_deadline)
+            for msg_type, reply_seq, body in frames:
+                if msg_type == REPLY_TEXT:
+                    text.extend(body)
+                elif msg_type == REPLY_STATUS and status is not None:
+                    status.append(decode_status(body))
+                elif msg_type == REPLY_ACK and body and body[0] == ACK_BAD_FRAME:
+                    # 破損したフレームには seq を信頼できないため 0 で返る。送信中のフレームの失敗とみなす
+                    raise SerialTransportError("Robot received a corrupted frame.")
+                elif msg_type == REPLY_ACK and reply_seq == seq:
+                    if body and body[0] != ACK_OK:
+                        raise SerialTransportError(f"Robot rejected frame (result {body[0]}).")
+                    return
+
+    async def _execute_binary(self, cmd, on_ack=None):
+        """
+        バイナリプロトコル: サブコマンドごとにフレームを送り、ACKを待つ。
+        先読みの送信はテキストプロトコルと同じく window と受信バッファの範囲で行う。
+        """
+        self.reader.clear()
+        await self._run_io(self.conn.reset_input_buffer)
+        frames = []
+        for sub in [s.strip() for s in cmd.split(";") if s.strip()]:
+            seq = self._next_seq()
+            try:
+                frames.append((seq, encode_command(sub, seq)))
+            except ProtocolError as e:
+                raise SerialTransportError(str(e))
+        inflight = deque()  # 送信済みで未完了のフレームのバイト数
+        pending_seqs = deque()
+        text = bytearray()
+        sent = acks = 0
+        hard_deadline = time.monotonic() + self.hard_timeout
+        while acks < len(frames):
+            while sent < len(frames) and self._can_send(inflight, len(frames[sent][1])):
+                seq, frame = frames[sent]
+                await self._run_io(self.conn.write, frame)
+                inflight.append(len(frame))
+                pending_seqs.append(seq)
+                sent += 1
+            deadline = min(time.monotonic() + self.soft_timeout, hard_deadline)
+            replies = await self._read_frames(deadline)
+            if replies is None:
+                raise self._timeout_error(hard_deadline)
+            for msg_type, reply_seq, body in replies:
+                if msg_type == REPLY_TEXT:
+                    text.extend(body)
+                elif msg_type == REPLY_ACK and body and body[0] == ACK_BAD_FRAME:
+                    raise SerialTransportError("Robot received a corrupted frame.")
+                elif msg_type == REPLY_ACK and pending_seqs and reply_seq == pending_seqs[0]:
+                    if body and body[0] != ACK_OK:
+                        raise SerialTransportError(f"Robot rejected frame (result {body[0]}).")
+                    pending_seqs.popleft()
+                    inflight.popleft()
+                    acks += 1
+                    self._notify_ack(on_ack, acks)
+        lines = text.decode("utf-8", errors="replace").splitlines()
+        return [line.strip() for line in lines if line.strip()]
+
+    async def _query_status(self):
+        """現在位置とサーボのパルス幅を問い合わせる"""
+        await self._ensure_connected()
+        started = time.perf_counter()
+        if self.active_protocol == "binary":
+            self.reader.clear()
+            seq = self._next_seq()
+            status = []
+            await self._send_frame(encode_frame(MSG_STATUS, seq), seq, time.monotonic() + self.hard_timeout, bytearray(), status)
+            if not status:
+                raise SerialTransportError("Robot returned no status.")
+            result = status[-1]
+        else:
+            lines = await self._execute_text("dump")
+            try:
+                dump = json.loads("".join(lines))
+                result = {
+                    "x": float(dump["tcp"]["x"]), "y": float(dump["tcp"]["y"]), "z": float(dump["tcp"]["z"]),
+                    "us": [int(j["cur_us"]) for j in dump["joints"]] + [int(dump["gripper"]["cur_us"])]
+                }
+            except (ValueError, KeyError, TypeError) as e:
+                raise SerialTransportError(f"Unexpected dump response: {e}")
+        observe("serial_status", time.perf_counter() - started)
+        return result
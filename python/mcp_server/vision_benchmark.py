@@ -0,0 +1,248 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import cv2
+import numpy as np
+from vision_system import VisionSystem
+from jpeg_cache import encode_jpeg
+from metrics import Metrics, metrics
+from inference_backend import BACKENDS, load_backend, warmup
+
+"""
+ビジョン処理のベンチマーク。
+
+カメラソース (camera_sources.py) から固定のフレーム列を1枚ずつ読み出し、
+姿勢推定 (update_pose)、物体検出 (detect_objects)、円柱推定 (_estimate_cylinder_3d)、
+色判定、JPEGエンコードの各段階のスループット (frames/s) とレイテンシのパーセンタイルを計測します。
+
+保存したベースライン (JSON) と比較し、いずれかの段階が許容幅 (margin) を超えて
+遅くなった場合は終了コード1で終了します。CIでの性能回帰の検出に使います。
+
+使用例:
+    # 合成画像でベースラインを保存
+    python vision_benchmark.py --camera synthetic --frames 200 --save-baseline baseline.json
+    # 学習用の静止画とYOLOモデルで計測し、ベースラインと比較
+    python vision_benchmark.py --camera ../../training/images --model best.onnx --baseline baseline.json
+"""
+
+CAMERA_PARAMS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '../vision/chessboard/calibration_data.npz')
+
+# 物体が検出されないフレームでも円柱推定・色判定を計測するための固定ボックス (0-1000正規化 [ymin, xmin, ymax, xmax])
+DEFAULT_BOXES = [
+    [300, 200, 450, 300],
+    [300, 700, 450, 800],
+    [600, 200, 750, 300],
+    [600, 700, 750, 800]
+]
+
+def run_benchmark(vs, model=None, frames=100, warmup_frames=5, confidence=0.5, jpeg_quality=95):
+    """
+    ベンチマークを実行する。
+
+    キャプチャスレッドを止め、フレームを1枚ずつ進めながら各段階を計測します。
+    モーションゲートは無効にします (全フレームで推論を行うため)。
+
+    Args:
+        vs (VisionSystem): 計測対象のビジョンシステム。
+        model: 推論バックエンド。Noneの場合は物体検出を計測しない。
+        frames (int): 計測するフレーム数。
+        warmup_frames (int): 計測前に読み捨てるフレーム数。
+        confidence (float): 物体検出の信頼度しきい値。
+        jpeg_quality (int): JPEG品質。
+
+    Returns:
+        dict: {"frames", "elapsed_sec", "throughput_fps", "pose_failures", "stages", "internal"}
+    """
+    vs.grabber.stop()
+    vs.motion_gate_enabled = False
+    stages = Metrics()
+    pose_failures = 0
+    measured = 0
+    started = None
+
+    for i in range(warmup_frames + frames):
+        if i == warmup_frames:
+            # ウォームアップ中の記録を捨ててから計測を始める
+            stages.reset()
+            metrics.reset()
+            started = time.perf_counter()
+
+        if not vs.grabber.grab():
+            print("カメラソースの終端に達しました。")
+            break
+        frame_started = time.perf_counter()
+
+        with stages.timed("update_pose"):
+            pose_ok = vs.update_pose(force_update=True, undistort_frame=True)
+        if not pose_ok:
+            pose_failures += 1
+
+        detections = []
+        if model is not None:
+            with stages.timed("detect_objects"):
+                detections = vs.detect_objects(model, confidence)
+
+        snapshot = vs.snapshot
+        frame, frame_id = snapshot.frame, snapshot.frame_id
+        rvec, tvec, R, camera_pos = snapshot.rvec, snapshot.tvec, snapshot.R, snapshot.camera_pos
+        if frame is None:
+            continue
+        h, w = frame.shape[:2]
+        boxes = [d["box_2d"] for d in detections] or DEFAULT_BOXES
+
+        if rvec is not None:
+            with stages.timed("estimate_cylinder_3d"):
+                for box in boxes:
+                    vs._estimate_cylinder_3d(box, rvec, tvec, R, camera_pos)
+
+        rects = [(int(b[1] * w / 1000), int(b[0] * h / 1000), int(b[3] * w / 1000), int(b[2] * h / 1000)) for b in boxes]
+        with stages.timed("color_naming"):
+            vs.color_engine.roi_colors(frame, rects, frame_id)
+
+        with stages.timed("jpeg_encode"):
+            encode_jpeg(frame, jpeg_quality)
+
+        stages.observe("total", time.perf_counter() - frame_started)
+        if i >= warmup_frames:
+            measured += 1
+
+    elapsed = time.perf_counter() - started if started is not None else 0.0
+    result = {
+        "frames": measured,
+        "elapsed_sec": round(elapsed, 3),
+        "throughput_fps": round(measured / elapsed, 2) if elapsed > 0 else 0.0,
+        "pose_failures": pose_failures,
+        "stages": stages.snapshot(),
+        # VisionSystem内部の処理段階 (undistort, marker_detect, yolo など)
+        "internal": metrics.snapshot()
+    }
+    for stats in result["stages"].values():
+        stats["fps"] = round(1000.0 / stats["mean_ms"], 2) if stats["mean_ms"] > 0 else 0.0
+    return result
+
+def compare_to_baseline(result, baseline, margin=0.15, min_delta_ms=0.5, keys=("p50_ms", "p95_ms")):
+    """
+    計測結果をベースラインと比較する。
+
+    ある段階の値が baseline * (1 + margin) + min_delta_ms を超えた場合を回帰とみなします。
+    min_delta_ms は数十マイクロ秒程度の短い段階で計測誤差を回帰と誤判定しないための余裕です。
+
+    Returns:
+        list: 回帰した項目 [(stage, key, baseline_ms, current_ms), ...]
+    """
+    regressions = []
+    current = result.get("stages", {})
+    for stage, base_stats in baseline.get("stages", {}).items():
+        stats = current.get(stage)
+        if stats is None:
+            print(f"Warning: ベースラインの段階 '{stage}' が計測されていません。")
+            continue
+        for key in keys:
+            base_value = base_stats.get(key)
+            if base_value is None:
+                continue
+            if stats[key] > base_value * (1.0 + margin) + min_delta_ms:
+                regressions.append((stage, key, base_value, stats[key]))
+    return regressions
+
+def format_report(result, baseline=None):
+    """計測結果を表形式の文字列にする"""
+    lines = [f"{'stage':<22}{'fps':>10}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'base p50':>10}"]
+    base_stages = baseline.get("stages", {}) if baseline else {}
+    for stage, s in result["stages"].items():
+        base = base_stages.get(stage, {}).get("p50_ms")
+        base_text = f"{base:>10.3f}" if base is not None else f"{'-':>10}"
+        lines.append(f"{stage:<22}{s['fps']:>10.1f}{s['mean_ms']:>10.3f}{s['p50_ms']:>10.3f}{s['p95_ms']:>10.3f}{s['p99_ms']:>10.3f}{base_text}")
+    lines.append("")
+    for stage, s in result["internal"].items():
+        lines.append(f"  {stage:<20}{s['count']:>10}{s['mean_ms']:>10.3f}{s['p50_ms']:>10.3f}{s['p95_ms']:>10.3f}{s['p99_ms']:>10.3f}")
+    lines.append("")
+    lines.append(f"frames: {result['frames']}, elapsed: {result['elapsed_sec']} s, throughput: {result['throughput_fps']} frames/s, pose failures: {result['pose_failures']}")
+    return "\n".join(lines)
+
+def main():
+    parser = argparse.ArgumentParser(description="Vision pipeline benchmark over a fixed corpus of frames")
+    parser.add_argument("--camera", type=str, default="synthetic", help="Camera source: video file, image directory, 'synthetic' or device (default: synthetic)")
+    parser.add_argument("--frames", type=int, default=100, help="Number of measured frames (default: 100)")
+    parser.add_argument("--warmup", type=int, default=5, help="Frames processed before measuring (default: 5)")
+    parser.add_argument("--width", type=int, default=1920, help="Frame width of the synthetic source / camera (default: 1920)")
+    parser.add_argument("--height", type=int, default=1080, help="Frame height of the synthetic source / camera (default: 1080)")
+    parser.add_argument("--params", type=str, default=CAMERA_PARAMS_PATH, help="Camera calibration file (calibration_data.npz)")
+    parser.add_argument("--marker-id", type=int, default=14, help="ArUco marker ID (default: 14)")
+    parser.add_argument("--marker-size", type=float, default=63.0, help="ArUco marker size in mm (default: 63)")
+    parser.add_argument("--model", type=str, default=None, help="YOLO model file. Object detection is skipped when omitted")
+    parser.add_argument("--backend", type=str, default="auto", choices=BACKENDS, help="Inference backend (default: auto)")
+    parser.add_argument("--imgsz", type=int, default=640, help="Inference input size in pixels (default: 640)")
+    parser.add_argument("--threads", type=int, default=None, help="CPU threads used for inference (default: runtime default)")
+    parser.add_argument("--confidence", type=float, default=0.5, help="Detection confidence threshold (default: 0.5)")
+    parser.add_argument("--baseline", type=str, default=None, help="Baseline JSON to compare against; exits with 1 on regression")
+    parser.add_argument("--margin", type=float, default=0.15, help="Allowed slowdown relative to the baseline (default: 0.15 = 15%%)")
+    parser.add_argument("--min-delta-ms", type=float, default=0.5, help="Absolute slack in ms added to the allowed slowdown (default: 0.5)")
+    parser.add_argument("--save-baseline", type=str, default=None, help="Write the result as a new baseline JSON")
+    parser.add_argument("--json", type=str, default=None, help="Write the full result JSON to this path")
+    args = parser.parse_args()
+
+    model = None
+    if args.model:
+        model = load_backend(args.model, args.backend, args.imgsz, args.threads)
+        warmup(model, (args.height, args.width, 3))
+
+    vs = VisionSystem(
+        camera_params_path=args.params,
+        marker_id=args.marker_id,
+        marker_size_mm=args.marker_size,
+        cam_id=args.camera,
+        width=args.width,
+        height=args.height,
+        source_loop=True,
+        source_fps=0
+    )
+    try:
+        print(f"Benchmarking {vs.cap.describe()} ...")
+        result = run_benchmark(vs, model, args.frames, args.warmup, args.confidence)
+    finally:
+        vs.release()
+
+    result["meta"] = {
+        "camera": args.camera,
+        "model": args.model,
+        "backend": args.backend if args.model else None,
+        "imgsz": args.imgsz,
+        "python": platform.python_version(),
+        "opencv": cv2.__version__,
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S")
+    }
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    print(format_report(result, baseline))
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+        print(f"Baseline saved to {args.save_baseline}")
+
+    if baseline is not None:
+        regressions = compare_to_baseline(result, baseline, args.margin, args.min_delta_ms)
+        if regressions:
+            print(f"\nRegression (margin {args.margin:.0%} + {args.min_delta_ms} ms):")
+            for stage, key, base_value, value in regressions:
+                print(f"  {stage} {key}: {base_value:.3f} -> {value:.3f} ms")
+            return 1
+        print("\nNo regression against the baseline.")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
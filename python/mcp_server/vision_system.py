@@ -3,13 +3,27 @@ import numpy as np
 import base64
 import time
 import threading
-from collections import Counter
+import os
+import sys
+import copy
+from collections import Counter, OrderedDict
+from frame_grabber import FrameGrabber
+from camera_sources import open_camera_source
+from frame_snapshot import FrameSnapshot
+from inference_backend import predict_boxes
+from jpeg_cache import JpegCache
+from color_engine import ColorEngine, hsv_to_color_name
+from object_tracker import ObjectTracker
+from motion_gate import MotionGate
+from metrics import timed
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../vision'))
+from undistortion import get_undistorter
 
 class VisionSystem:
     """
     カメラを用いた姿勢推定と座標変換を管理するクラス。
     """
-    def __init__(self, camera_params_path, marker_id, marker_size_mm, cam_id=0, width=1920, height=1080, display_width=None, robot_offset_x_mm=0.0, robot_offset_y_mm=0.0, lang='ja'):
+    def __init__(self, camera_params_path, marker_id, marker_size_mm, cam_id=0, width=1920, height=1080, display_width=None, robot_offset_x_mm=0.0, robot_offset_y_mm=0.0, lang='ja', persist_undistort_maps=False, source_loop=True, source_fps=None):
         """
         VisionSystemを初期化します。
 
@@ -17,13 +31,16 @@ class VisionSystem:
             camera_params_path (str): カメラパラメータファイル(.npz)へのパス。
             marker_id (int): 追跡するArUcoマーカーのID。
             marker_size_mm (float): ArUcoマーカーのサイズ(mm)。
-            cam_id (int): 使用するカメラのID。
+            cam_id (int or str): 使用するカメラのID、または動画ファイル・画像ディレクトリ・"synthetic" などのカメラソース指定。
             width (int): カメラの横解像度。
             height (int): カメラの縦解像度。
             display_width (int, optional): 表示ウィンドウの横幅。Noneの場合はリサイズしない。
             robot_offset_x_mm (float): ロボットベースのXオフセット(mm)。
             robot_offset_y_mm (float): ロボットベースのYオフセット(mm)。
             lang (str): 言語設定 ('ja' or 'en')。
+            persist_undistort_maps (bool): 歪み補正マップをキャリブレーションファイルの隣に保存して再利用するか。
+            source_loop (bool): 動画・画像ディレクトリを繰り返し再生するか。
+            source_fps (float, optional): 動画・画像・合成画像の読み出しフレームレート。Noneの場合はソースの既定値。
         """
         self.marker_id = marker_id
         self.marker_size_mm = marker_size_mm
@@ -45,6 +62,7 @@ class VisionSystem:
                 self.mtx, self.dist = data['mtx'], data['dist']
         except Exception as e:
             raise IOError(f"カメラパラメータの読み込みエラー {camera_params_path}: {e}")
+        self.undistort_maps_path = camera_params_path if persist_undistort_maps else None
 
         # ArUco検出器のセットアップ
         self.aruco_dict = cv2.aruco.getPredefinedDictionary(cv2.aruco.DICT_4X4_50)
@@ -52,14 +70,16 @@ class VisionSystem:
         self.obj_points = self._get_marker_model_mm(marker_size_mm)
 
         # カメラキャプチャのセットアップ
-        self.cap = cv2.VideoCapture(cam_id)
+        # (実機のカメラの代わりに動画・静止画・合成画像も使える。camera_sources.py を参照)
+        self.cap = open_camera_source(cam_id, width, height, loop=source_loop, fps=source_fps, marker_id=marker_id)
         if not self.cap.isOpened():
             raise IOError(f"カメラ {cam_id} を開けません。")
-        self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
-        self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
-        self.cap_lock = threading.Lock()
         self.state_lock = threading.Lock()
 
+        # キャプチャ専用スレッド (cv2.VideoCaptureはこのスレッドのみが読み出す)
+        self.grabber = FrameGrabber(self.cap)
+        self.grabber.start()
+
         # 姿勢データ (update_pose()で更新)
         self.rvec = None
         self.tvec = None
@@ -67,8 +87,67 @@ class VisionSystem:
         self.camera_pos = None
         self.last_pose_update_time = 0
         self.pose_cache_duration = 0.1  # 秒
-        self.last_processed_frame = None
-        self.last_frame_capture_time = 0
+        self.last_pose_frame_id = 0  # 姿勢を計算したフレームのID
+        # 歪み補正済みフレームと姿勢の不変スナップショット (更新時は参照ごと差し替える)
+        self.snapshot = FrameSnapshot()
+
+        # エンコード済みJPEGのキャッシュ (MCPツールとMJPEG配信で共有)
+        self.jpeg_cache = JpegCache()
+
+        # 検出物の色判定 (積分画像とHSV色名テーブル)
+        self.color_engine = ColorEngine()
+
+        # 検出結果のキャッシュ (フレームID・モデル毎)
+        # 推論は下限信頼度で行い、より高いしきい値の要求はキャッシュを絞り込んで返す
+        self.detection_floor_confidence = 0.25
+        self.detection_cache = OrderedDict()
+        self.detection_cache_capacity = 8
+        self.detection_cache_lock = threading.Lock()
+        self.detection_cache_hits = 0
+        self.detection_cache_misses = 0
+        # predict_boxes を持たない ultralytics の YOLO を直接渡された場合の推論の排他制御用ロック
+        # (inference_backend のバックエンドと検出ワーカーのクライアントは自身のロックで直列化している)
+        self.inference_lock = threading.Lock()
+
+        # ワークスペース (マーカー座標系の矩形, mm)。設定すると推論をその領域の画像だけで行う
+        self.workspace = None          # (xm_min, ym_min, xm_max, ym_max)
+        self.workspace_height_mm = 150.0
+        self.workspace_margin_px = 16
+        self.workspace_grid_px = 32    # ROIをこの単位に揃え、姿勢の微小な揺れでクロップサイズが変わらないようにする
+
+        # モーションゲート (前回の検出からシーンが変化していなければ検出結果を再利用する)
+        self.motion_gate_enabled = False
+        self.motion_gate = MotionGate()
+        self.gated_detections = None  # (信頼度, フレームID, 検出結果) 最後に推論した結果
+
+        # 物体追跡 (キーフレームの間はYOLOを実行せず、トラックを予測して返す)
+        self.tracking_enabled = False
+        self.object_tracker = ObjectTracker()
+        self.tracker_lock = threading.Lock()
+
+        # ArUcoマーカーのROI追跡
+        # 前回検出したコーナー周辺の窓だけを探索し、見失った場合のみ全画面を探索する
+        self.roi_tracking = True
+        self.roi_padding_ratio = 1.0  # マーカー外接矩形の長辺に対するパディング比率
+        self.roi_min_padding_px = 40
+        self.last_marker_corners = None
+        self.last_detection_path = None  # 直近に実行された探索経路 ('roi' / 'full')
+        self.detection_path_counts = Counter()
+
+        # 姿勢ロックモード (カメラとマーカーが固定されている環境向け)
+        # 連続して一致する姿勢が得られたら姿勢を固定し、以降のフレームでは検出とsolvePnPを省略する。
+        # 一定間隔で再投影誤差を確認し、ずれが閾値を超えたらロックを解除する。
+        self.pose_lock_enabled = False
+        self.pose_locked = False
+        self.pose_lock_frames = 10          # ロックに必要な連続一致フレーム数
+        self.pose_lock_tolerance_mm = 2.0   # 一致とみなすカメラ位置の差 (mm)
+        self.pose_lock_recheck_sec = 5.0    # 再検証の間隔 (秒)
+        self.pose_lock_drift_px = 3.0       # ロック解除する再投影誤差 (px)
+        self.last_pose_drift_px = None
+        self._pose_lock_streak = 0
+        self._pose_lock_prev_pos = None
+        self._pose_lock_stop = threading.Event()
+        self._pose_lock_thread = None
         
         # インタラクティブモード用の状態
         self.pick_point = None
@@ -93,46 +172,237 @@ class VisionSystem:
             [0, size_mm, 0]         # 3: 左下
         ], dtype=np.float32)
 
-    def update_pose(self, force_update=False):
+    def _undistort(self, frame):
+        """事前計算済みのリマップテーブルでフレームの歪みを補正する"""
+        h, w = frame.shape[:2]
+        undistorter = get_undistorter(self.mtx, self.dist, (w, h), persist_path=self.undistort_maps_path)
+        with timed("undistort"):
+            return undistorter.apply(frame)
+
+    def _find_marker(self, gray):
+        """画像中から追跡対象マーカーのコーナー(1x4x2)を探す。見つからない場合はNone。"""
+        corners, ids, _ = self.detector.detectMarkers(gray)
+        if ids is not None and self.marker_id in ids:
+            idx = np.where(ids == self.marker_id)[0][0]
+            return corners[idx]
+        return None
+
+    def _detect_marker(self, gray):
+        """
+        マーカーを検出し、(コーナー, 探索経路) を返す。
+        ROI追跡が有効で前回の検出位置が既知であれば、その周辺の窓だけを探索する ('roi')。
+        見失った場合は全画面を探索する ('full')。
+        """
+        # update_pose は複数のスレッドから呼ばれるので、前回の位置は一度だけ読み出してローカル変数で扱う
+        last = self.last_marker_corners
+        if self.roi_tracking and last is not None:
+            pts = last.reshape(-1, 2)
+            x_min, y_min = pts.min(axis=0)
+            x_max, y_max = pts.max(axis=0)
+            pad = max(self.roi_min_padding_px, self.roi_padding_ratio * max(x_max - x_min, y_max - y_min))
+            h, w = gray.shape[:2]
+            x1, y1 = max(0, int(x_min - pad)), max(0, int(y_min - pad))
+            x2, y2 = min(w, int(x_max + pad)), min(h, int(y_max + pad))
+            if x2 > x1 and y2 > y1:
+                corners = self._find_marker(gray[y1:y2, x1:x2])
+                if corners is not None:
+                    corners = corners + np.array([x1, y1], dtype=np.float32)
+                    self.last_marker_corners = corners
+                    return corners, 'roi'
+
+        corners = self._find_marker(gray)
+        self.last_marker_corners = corners
+        return corners, 'full'
+
+    def enable_pose_lock(self, lock_frames=10, recheck_sec=5.0, drift_px=3.0, tolerance_mm=2.0):
+        """
+        姿勢ロックモードを有効にし、バックグラウンドの再検証スレッドを開始する。
+
+        Args:
+            lock_frames (int): 姿勢をロックするまでに必要な連続一致フレーム数。
+            recheck_sec (float): ロック中に再投影誤差を確認する間隔(秒)。
+            drift_px (float): ロックを解除する平均再投影誤差(px)。
+            tolerance_mm (float): 連続フレームのカメラ位置が一致しているとみなす差(mm)。
+        """
+        self.pose_lock_frames = max(1, int(lock_frames))
+        self.pose_lock_recheck_sec = recheck_sec
+        self.pose_lock_drift_px = drift_px
+        self.pose_lock_tolerance_mm = tolerance_mm
+        self.pose_lock_enabled = True
+        if self._pose_lock_thread is None:
+            self._pose_lock_stop.clear()
+            self._pose_lock_thread = threading.Thread(target=self._pose_lock_loop, daemon=True)
+            self._pose_lock_thread.start()
+
+    def unlock_pose(self):
+        """姿勢ロックを解除し、次のフレームから再び姿勢推定を行う。"""
+        with self.state_lock:
+            self.pose_locked = False
+            self._pose_lock_streak = 0
+            self._pose_lock_prev_pos = None
+
+    def _update_pose_lock_streak(self, camera_pos):
+        """連続一致フレーム数を更新し、条件を満たしたら姿勢をロックする (state_lock保持中に呼ぶ)"""
+        if not self.pose_lock_enabled:
+            return
+        if self._pose_lock_prev_pos is not None and np.linalg.norm(camera_pos - self._pose_lock_prev_pos) < self.pose_lock_tolerance_mm:
+            self._pose_lock_streak += 1
+        else:
+            self._pose_lock_streak = 1
+        self._pose_lock_prev_pos = camera_pos
+        if self._pose_lock_streak >= self.pose_lock_frames:
+            self.pose_locked = True
+            print(f"Pose locked after {self._pose_lock_streak} consistent frames.")
+
+    def revalidate_pose_lock(self):
+        """
+        ロック中の姿勢を最新フレームで検証する（オンデマンドでも呼び出し可能）。
+        マーカーの再投影誤差が閾値を超えた場合はロックを解除する。
+        マーカーが見えない場合（アームによる遮蔽など）はロックを維持する。
+
+        Returns:
+            dict: {"locked": bool, "marker_visible": bool, "drift_px": float | None}
+        """
+        with self.state_lock:
+            locked = self.pose_locked
+            rvec, tvec = self.rvec, self.tvec
+        if not locked or rvec is None:
+            return {"locked": locked, "marker_visible": False, "drift_px": None}
+
+        ret, frame, _ = self.grabber.read()
+        if not ret:
+            return {"locked": locked, "marker_visible": False, "drift_px": None}
+
+        # 歪み補正前の画像で検出し、コーナー4点のみ歪み補正する
+        raw_corners = self._find_marker(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY))
+        if raw_corners is None:
+            return {"locked": True, "marker_visible": False, "drift_px": None}
+        corners = self._undistort_corners(raw_corners)
+
+        projected, _ = cv2.projectPoints(self.obj_points, rvec, tvec, self.mtx, np.zeros((5, 1)))
+        drift = float(np.mean(np.linalg.norm(projected.reshape(-1, 2) - corners.reshape(-1, 2), axis=1)))
+        self.last_pose_drift_px = drift
+        if drift > self.pose_lock_drift_px:
+            print(f"Pose lock released: reprojection drift {drift:.2f}px > {self.pose_lock_drift_px:.2f}px")
+            self.unlock_pose()
+            return {"locked": False, "marker_visible": True, "drift_px": drift}
+        return {"locked": True, "marker_visible": True, "drift_px": drift}
+
+    def _pose_lock_loop(self):
+        """姿勢ロックの定期再検証ループ（別スレッドで実行）"""
+        while not self._pose_lock_stop.wait(self.pose_lock_recheck_sec):
+            if self.pose_locked:
+                try:
+                    self.revalidate_pose_lock()
+                except Exception as e:
+                    print(f"Pose lock revalidation error: {e}")
+
+    def _undistort_corners(self, corners):
+        """生画像上のマーカーコーナー4点だけを歪み補正し、歪み補正済み画像の座標に変換する"""
+        pts = cv2.undistortPoints(corners.reshape(-1, 1, 2).astype(np.float32), self.mtx, self.dist, P=self.mtx)
+        return pts.reshape(1, -1, 2)
+
+    @property
+    def last_processed_frame(self):
+        """最後に処理した歪み補正済みフレーム (書き込み禁止)"""
+        return self.snapshot.frame
+
+    @property
+    def last_frame_id(self):
+        """last_processed_frame のフレームID"""
+        return self.snapshot.frame_id
+
+    @property
+    def last_frame_capture_time(self):
+        return self.snapshot.timestamp
+
+    def _publish_snapshot(self, undistorted_frame=None, frame_id=0):
+        """
+        現在の姿勢で新しいスナップショットを作成して差し替える (state_lock保持中に呼ぶ)。
+        undistorted_frame がNoneの場合は前回のフレームをそのまま引き継ぐ。
+        """
+        if undistorted_frame is None:
+            self.snapshot = self.snapshot.with_pose(self.rvec, self.tvec, self.R, self.camera_pos)
+        else:
+            self.snapshot = FrameSnapshot(undistorted_frame, frame_id, time.time(), self.rvec, self.tvec, self.R, self.camera_pos)
+
+    def update_pose(self, force_update=False, undistort_frame=True):
         """
         ArUcoマーカーを検出し、カメラの姿勢(rvec, tvec, R, camera_pos)を更新する。
         姿勢が正常に更新された場合はTrue、それ以外はFalseを返す。
         計算負荷を減らすため、短期間は姿勢をキャッシュする。
+
+        マーカー検出は歪み補正前の画像で行い、検出したコーナー4点のみを歪み補正してsolvePnPに渡す。
+        フレーム全体の歪み補正は undistort_frame=True の場合（物体検出・色判定・表示など
+        画素が必要な場合）にのみ行う。
         """
         with self.state_lock:
             if not force_update and time.time() - self.last_pose_update_time < self.pose_cache_duration:
-                return self.rvec is not None
+                if not undistort_frame or self.last_frame_id == self.last_pose_frame_id:
+                    return self.rvec is not None
 
-        with self.cap_lock:
-            ret, frame = self.cap.read()
+        ret, frame, frame_id = self.grabber.read()
         if not ret:
-            self.rvec, self.tvec, self.R, self.camera_pos = None, None, None, None
+            with self.state_lock:
+                self.rvec, self.tvec, self.R, self.camera_pos = None, None, None, None
+                self._publish_snapshot()
             return False
 
-        undistorted_frame = cv2.undistort(frame, self.mtx, self.dist, None, self.mtx)
-        gray = cv2.cvtColor(undistorted_frame, cv2.COLOR_BGR2GRAY)
-        corners, ids, _ = self.detector.detectMarkers(gray)
+        # 既に処理済みのフレームであれば再計算しない
+        with self.state_lock:
+            pose_done = frame_id == self.last_pose_frame_id
+            pixels_done = frame_id == self.last_frame_id
+        if pose_done and (pixels_done or not undistort_frame):
+            return self.rvec is not None
 
-        if ids is not None and self.marker_id in ids:
-            idx = np.where(ids == self.marker_id)[0][0]
+        undistorted_frame = self._undistort(frame) if undistort_frame and not pixels_done else None
+
+        if pose_done:
+            with self.state_lock:
+                self._publish_snapshot(undistorted_frame, frame_id)
+                return self.rvec is not None
+
+        # 姿勢ロック中はマーカー検出・solvePnPを省略し、固定された姿勢を使い続ける
+        if self.pose_locked:
+            with self.state_lock:
+                self.last_detection_path = 'locked'
+                self.detection_path_counts['locked'] += 1
+                if undistorted_frame is not None:
+                    self._publish_snapshot(undistorted_frame, frame_id)
+                self.last_pose_frame_id = frame_id
+                self.last_pose_update_time = time.time()
+                return self.rvec is not None
+
+        with timed("marker_detect"):
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            raw_corners, detection_path = self._detect_marker(gray)
+
+        success = False
+        if raw_corners is not None:
             # solvePnPは歪み補正済みの画像座標と歪み係数=0で使うのが望ましい
-            ret_pnp, rvec, tvec = cv2.solvePnP(self.obj_points, corners[idx], self.mtx, np.zeros((5, 1)))
-
-            if ret_pnp:
-                with self.state_lock:
-                    self.last_processed_frame = undistorted_frame
-                    self.last_frame_capture_time = time.time()
-                    self.rvec, self.tvec = rvec, tvec
-                    self.R, _ = cv2.Rodrigues(rvec)
-                    self.camera_pos = -np.dot(self.R.T, tvec.flatten())
-                    self.last_pose_update_time = time.time()
-                    return True
+            with timed("solvepnp"):
+                marker_corners = self._undistort_corners(raw_corners)
+                ret_pnp, rvec, tvec = cv2.solvePnP(self.obj_points, marker_corners, self.mtx, np.zeros((5, 1)))
+            success = bool(ret_pnp)
 
         with self.state_lock:
-            self.last_processed_frame = undistorted_frame
-            self.last_frame_capture_time = time.time()
-            self.rvec, self.tvec, self.R, self.camera_pos = None, None, None, None
-            return False
+            self.last_detection_path = detection_path
+            self.detection_path_counts[detection_path] += 1
+            self.last_pose_frame_id = frame_id
+
+            if success:
+                self.rvec, self.tvec = rvec, tvec
+                self.R, _ = cv2.Rodrigues(rvec)
+                self.camera_pos = -np.dot(self.R.T, tvec.flatten())
+                self.last_pose_update_time = time.time()
+                self._update_pose_lock_streak(self.camera_pos)
+            else:
+                self.rvec, self.tvec, self.R, self.camera_pos = None, None, None, None
+                self._pose_lock_streak = 0
+                self._pose_lock_prev_pos = None
+            # フレームと姿勢をまとめて公開する
+            self._publish_snapshot(undistorted_frame, frame_id)
+            return success
 
     def _draw_trajectory(self, frame, rvec=None, tvec=None):
         """Pick & Placeの軌道を描画する"""
@@ -165,434 +435,566 @@ class VisionSystem:
              cv2.circle(frame, tuple(pts[0]), 5, (255, 0, 255), -1) # Pick
              cv2.circle(frame, tuple(pts[3]), 5, (255, 0, 0), -1)   # Place
 
-    def get_undistorted_image_base64(self, display=False, draw_axes=False):
+    def _draw_axes(self, frame, rvec, tvec):
+        """座標軸とX/Y/Zラベルを描画する"""
+        length = self.marker_size_mm * 0.8
+        cv2.drawFrameAxes(frame, self.mtx, np.zeros((5, 1)), rvec, tvec, length)
+
+        # 3D軸のラベル位置座標を定義 (軸より少し外側)
+        label_len = length * 1.1
+        axis_points_3d = np.float32([[label_len, 0, 0], [0, label_len, 0], [0, 0, label_len]]).reshape(-1, 3)
+        # 3D座標を2D画像座標に投影
+        axis_points_2d, _ = cv2.projectPoints(axis_points_3d, rvec, tvec, self.mtx, np.zeros((5, 1)))
+        # 各軸のラベルを描画
+        font = cv2.FONT_HERSHEY_SIMPLEX
+        cv2.putText(frame, 'X', tuple(axis_points_2d[0].ravel().astype(int)), font, 0.7, (0, 0, 255), 2)
+        cv2.putText(frame, 'Y', tuple(axis_points_2d[1].ravel().astype(int)), font, 0.7, (0, 255, 0), 2)
+        cv2.putText(frame, 'Z', tuple(axis_points_2d[2].ravel().astype(int)), font, 0.7, (255, 0, 0), 2)
+
+    def _annotated_renderer(self, frame, rvec, tvec, draw_axes):
+        """
+        JPEGキャッシュ用に (描画内容の識別子, 描画関数) を返す。
+        描画が不要な場合はフレームをコピーせずにそのまま返す。
+        """
+        if draw_axes and rvec is not None and tvec is not None:
+            def render():
+                annotated = frame.copy()
+                self._draw_axes(annotated, rvec, tvec)
+                return annotated
+            return 'axes', render
+        return 'none', lambda: frame
+
+    def get_undistorted_image_base64(self, display=False, draw_axes=False, quality=95, max_width=None):
         """
         フレームをキャプチャして歪み補正を行い、Base64エンコードされたJPEG文字列として返す。
+        同じフレーム・同じ描画条件のJPEGはキャッシュから再利用する。
         """
         # 直近に処理されたフレームがあればそれを使用する（描画と検出の同期のため）
         undistorted_frame = None
         current_rvec, current_tvec = None, None
+        frame_id = 0
 
-        with self.state_lock:
-            if self.last_processed_frame is not None and (time.time() - self.last_frame_capture_time < 0.5):
-                undistorted_frame = self.last_processed_frame.copy()
-                current_rvec = self.rvec.copy() if self.rvec is not None else None
-                current_tvec = self.tvec.copy() if self.tvec is not None else None
+        snapshot = self.snapshot
+        if snapshot.has_frame and snapshot.age() < 0.5:
+            undistorted_frame = snapshot.frame
+            frame_id = snapshot.frame_id
+            current_rvec, current_tvec = snapshot.rvec, snapshot.tvec
         
         if undistorted_frame is None:
-             with self.cap_lock:
-                 ret, frame = self.cap.read()
+             ret, frame, frame_id = self.grabber.read()
              if not ret: return None
-             undistorted_frame = cv2.undistort(frame, self.mtx, self.dist, None, self.mtx)
+             undistorted_frame = self._undistort(frame)
         
         # 姿勢が既知であれば座標軸を描画
-        if current_rvec is not None and current_tvec is not None and draw_axes:
-            length = self.marker_size_mm * 0.8
-            cv2.drawFrameAxes(undistorted_frame, self.mtx, np.zeros((5, 1)), current_rvec, current_tvec, length)
-
-            # 3D軸のラベル位置座標を定義 (軸より少し外側)
-            label_len = length * 1.1
-            axis_points_3d = np.float32([[label_len, 0, 0], [0, label_len, 0], [0, 0, label_len]]).reshape(-1, 3)
-            # 3D座標を2D画像座標に投影
-            axis_points_2d, _ = cv2.projectPoints(axis_points_3d, current_rvec, current_tvec, self.mtx, np.zeros((5, 1)))
-            # 各軸のラベルを描画
-            font = cv2.FONT_HERSHEY_SIMPLEX
-            cv2.putText(undistorted_frame, 'X', tuple(axis_points_2d[0].ravel().astype(int)), font, 0.7, (0, 0, 255), 2)
-            cv2.putText(undistorted_frame, 'Y', tuple(axis_points_2d[1].ravel().astype(int)), font, 0.7, (0, 255, 0), 2)
-            cv2.putText(undistorted_frame, 'Z', tuple(axis_points_2d[2].ravel().astype(int)), font, 0.7, (255, 0, 0), 2)
+        overlay, render = self._annotated_renderer(undistorted_frame, current_rvec, current_tvec, draw_axes)
 
         if display:
+            display_frame = render()
+            render = lambda: display_frame
             if self.display_width:
-                h, w = undistorted_frame.shape[:2]
+                h, w = display_frame.shape[:2]
                 display_height = int(h * (self.display_width / w))
-                cv2.imshow("Robot Camera View", cv2.resize(undistorted_frame, (self.display_width, display_height)))
+                cv2.imshow("Robot Camera View", cv2.resize(display_frame, (self.display_width, display_height)))
             else:
-                cv2.imshow("Robot Camera View", undistorted_frame)
+                cv2.imshow("Robot Camera View", display_frame)
             cv2.waitKey(1)
 
-        _, buffer = cv2.imencode('.jpg', undistorted_frame)
-        return base64.b64encode(buffer).decode('utf-8')
+        jpeg = self.jpeg_cache.get_or_encode(frame_id, overlay, render, quality, max_width)
+        if jpeg is None:
+            return None
+        with timed("base64"):
+            return base64.b64encode(jpeg).decode('utf-8')
 
     def get_jpeg_bytes(self, draw_axes=True):
         """MJPEG配信用のJPEGバイト列を取得"""
+        _, jpeg_bytes = self.get_jpeg_frame(draw_axes)
+        return jpeg_bytes
+
+    def get_jpeg_frame(self, draw_axes=True, quality=95, max_width=None):
+        """
+        最新フレームで姿勢更新を行い、座標軸を描画したJPEGを返す。
+
+        Returns:
+            tuple: (frame_id, JPEGバイト列)。フレームがない場合は (0, None)。
+        """
         # 最新フレームで姿勢更新を行う
         self.update_pose(force_update=True)
         
-        with self.state_lock:
-            if self.last_processed_frame is None:
-                return None
-            frame = self.last_processed_frame.copy()
-            current_rvec = self.rvec.copy() if self.rvec is not None else None
-            current_tvec = self.tvec.copy() if self.tvec is not None else None
+        snapshot = self.snapshot
+        if not snapshot.has_frame:
+            return 0, None
+        frame_id = snapshot.frame_id
             
-        # 軸の描画
-        if current_rvec is not None and current_tvec is not None and draw_axes:
-             length = self.marker_size_mm * 0.8
-             cv2.drawFrameAxes(frame, self.mtx, np.zeros((5, 1)), current_rvec, current_tvec, length)
-
-             # 3D軸のラベル位置座標を定義 (軸より少し外側)
-             label_len = length * 1.1
-             axis_points_3d = np.float32([[label_len, 0, 0], [0, label_len, 0], [0, 0, label_len]]).reshape(-1, 3)
-             # 3D座標を2D画像座標に投影
-             axis_points_2d, _ = cv2.projectPoints(axis_points_3d, current_rvec, current_tvec, self.mtx, np.zeros((5, 1)))
-             # 各軸のラベルを描画
-             font = cv2.FONT_HERSHEY_SIMPLEX
-             cv2.putText(frame, 'X', tuple(axis_points_2d[0].ravel().astype(int)), font, 0.7, (0, 0, 255), 2)
-             cv2.putText(frame, 'Y', tuple(axis_points_2d[1].ravel().astype(int)), font, 0.7, (0, 255, 0), 2)
-             cv2.putText(frame, 'Z', tuple(axis_points_2d[2].ravel().astype(int)), font, 0.7, (255, 0, 0), 2)
-             
-        _, buffer = cv2.imencode('.jpg', frame)
-        return buffer.tobytes()
+        # 軸の描画とエンコード (同じフレームは一度だけエンコードされる)
+        overlay, render = self._annotated_renderer(snapshot.frame, snapshot.rvec, snapshot.tvec, draw_axes)
+        return frame_id, self.jpeg_cache.get_or_encode(frame_id, overlay, render, quality, max_width)
 
     def _estimate_cylinder_3d(self, box_norm, rvec, tvec, R, camera_pos):
         """
-        広角カメラによる円柱の接地中心推定（5ステップ）
+        1個のバウンディングボックスについて円柱の接地中心を推定する。
+        計算本体は _estimate_cylinders_3d (バッチ版) を参照。
+        """
+        return self._estimate_cylinders_3d([box_norm], rvec, tvec, R, camera_pos)[0]
+
+    def _estimate_cylinders_3d(self, boxes_norm, rvec, tvec, R, camera_pos, image_size=None):
+        """
+        広角カメラによる円柱の接地中心推定（5ステップ）をN個の検出についてまとめて行う。
 
         本設計では、対象物はすべて「垂直に立つ円柱」であると仮定します。
         カメラのロール・ヨー・ピッチがいかなる角度であっても対応するため、
         World Z軸（鉛直方向）の画像への投影ベクトルを基準に、
         AABBの境界との交点から接地点と天面点を特定します。
+        各ステップは (N,) / (N, 3) の配列演算で計算し、再投影も
+        cv2.projectPoints を1回呼ぶだけなので、検出数が増えても処理時間はほぼ一定です。
+
+        Args:
+            boxes_norm (array-like): (N, 4) の [ymin, xmin, ymax, xmax] (0-1000正規化座標)。
+            rvec, tvec: カメラ姿勢。
+            R (np.ndarray): rvec の回転行列。
+            camera_pos (np.ndarray): マーカー座標系でのカメラ位置。
+            image_size (tuple, optional): (width, height)。Noneの場合は最後に処理したフレームのサイズ。
+
+        Returns:
+            list: 各ボックスの推定結果の辞書（推定できない場合はNone）。
 
         戻り値の座標系:
             ArUcoマーカーの右下を原点とする「マーカー座標系」です。
             単位はミリメートル(mm)です。
         """
-        if rvec is None or tvec is None:
-            return None
+        boxes = np.asarray(boxes_norm, dtype=np.float64).reshape(-1, 4)
+        n = len(boxes)
+        if rvec is None or tvec is None or n == 0:
+            return [None] * n
 
         # 画像サイズ
-        h_img, w_img = self.last_processed_frame.shape[:2]
+        if image_size is not None:
+            w_img, h_img = image_size
+        else:
+            w_img, h_img = self.snapshot.image_size
         fx, fy = self.mtx[0, 0], self.mtx[1, 1]
         cx, cy = self.mtx[0, 2], self.mtx[1, 2]
-        
+
         # BB座標 (ピクセル)
-        ymin, xmin, ymax, xmax = box_norm
+        ymin, xmin, ymax, xmax = boxes.T
         u_min, v_min = xmin * w_img / 1000, ymin * h_img / 1000
         u_max, v_max = xmax * w_img / 1000, ymax * h_img / 1000
-        
+
         # AABB中心
         u_c = (u_min + u_max) / 2
         v_c = (v_min + v_max) / 2
-        
-        # --- 1. 画像上の「鉛直上方向」ベクトルを算出 ---
-        # AABB中心に対応する視線ベクトル(カメラ座標系)
-        # Z=1 平面上の点として扱う
-        p_center_cam = np.array([(u_c - cx) / fx, (v_c - cy) / fy, 1.0])
-        
-        # World Z軸 (0,0,1) のカメラ座標系ベクトル (Rの第3列)
-        axis_z_cam = R[:, 2]
-        
-        # 視線上の点から、World Z方向に少し移動した点を画像に投影し、方向を得る
-        # p_up_cam = p_center_cam + axis_z_cam * alpha
-        p_up_cam = p_center_cam + axis_z_cam * 0.1
-        
-        dir_up = np.array([0.0, -1.0]) # デフォルトは画像上方向(-Y)
-        
-        if p_up_cam[2] > 1e-3: # カメラの前方にある場合
-            u_up = p_up_cam[0] / p_up_cam[2] * fx + cx
-            v_up = p_up_cam[1] / p_up_cam[2] * fy + cy
-            vec = np.array([u_up - u_c, v_up - v_c])
-            norm = np.linalg.norm(vec)
-            if norm > 1e-3:
-                dir_up = vec / norm
 
+        # --- 1. 画像上の「鉛直上方向」ベクトルを算出 ---
+        # AABB中心に対応する視線ベクトル(カメラ座標系, Z=1 平面上の点)から
+        # World Z方向に少し移動した点を画像に投影し、方向を得る
+        p_center_cam = np.stack([(u_c - cx) / fx, (v_c - cy) / fy, np.ones(n)], axis=1)
+        p_up_cam = p_center_cam + R[:, 2] * 0.1
+
+        dir_up = np.tile([0.0, -1.0], (n, 1)) # デフォルトは画像上方向(-Y)
+        in_front = p_up_cam[:, 2] > 1e-3 # カメラの前方にある場合
+        z_up = np.where(in_front, p_up_cam[:, 2], 1.0)
+        vec = np.stack([p_up_cam[:, 0] / z_up * fx + cx - u_c,
+                        p_up_cam[:, 1] / z_up * fy + cy - v_c], axis=1)
+        norm = np.linalg.norm(vec, axis=1)
+        valid = in_front & (norm > 1e-3)
+        dir_up[valid] = vec[valid] / norm[valid, None]
         dir_down = -dir_up
-        
+
         # --- 2. AABB境界との交点を計算 (Bottom, Top, Width) ---
-        def get_dist_to_boundary(start_u, start_v, direction):
-            du, dv = direction
-            ts = []
-            # u = u_min
-            if abs(du) > 1e-6:
-                t = (u_min - start_u) / du
-                if t > 0: ts.append(t)
-                t = (u_max - start_u) / du
-                if t > 0: ts.append(t)
-            # v = v_min
-            if abs(dv) > 1e-6:
-                t = (v_min - start_v) / dv
-                if t > 0: ts.append(t)
-                t = (v_max - start_v) / dv
-                if t > 0: ts.append(t)
-            
-            return min(ts) if ts else 0.0
+        def get_dist_to_boundary(direction):
+            du, dv = direction[:, 0], direction[:, 1]
+            has_u = np.abs(du) > 1e-6
+            has_v = np.abs(dv) > 1e-6
+            safe_du = np.where(has_u, du, 1.0)
+            safe_dv = np.where(has_v, dv, 1.0)
+            ts = np.stack([
+                np.where(has_u, (u_min - u_c) / safe_du, np.inf),
+                np.where(has_u, (u_max - u_c) / safe_du, np.inf),
+                np.where(has_v, (v_min - v_c) / safe_dv, np.inf),
+                np.where(has_v, (v_max - v_c) / safe_dv, np.inf),
+            ])
+            ts[ts <= 0] = np.inf
+            t = ts.min(axis=0)
+            t[np.isinf(t)] = 0.0
+            return t
 
         # Bottom (接地点方向)
-        t_bottom = get_dist_to_boundary(u_c, v_c, dir_down)
-        u_contact = u_c + dir_down[0] * t_bottom
-        v_contact = v_c + dir_down[1] * t_bottom
-        
+        t_bottom = get_dist_to_boundary(dir_down)
+        u_contact = u_c + dir_down[:, 0] * t_bottom
+        v_contact = v_c + dir_down[:, 1] * t_bottom
+
         # Top (天面方向)
-        t_top = get_dist_to_boundary(u_c, v_c, dir_up)
-        u_top = u_c + dir_up[0] * t_top
-        v_top = v_c + dir_up[1] * t_top
-        
+        t_top = get_dist_to_boundary(dir_up)
+        u_top = u_c + dir_up[:, 0] * t_top
+        v_top = v_c + dir_up[:, 1] * t_top
+
         # --- 3. 直径(Width)の推定 ---
-        # AABBの幅・高さと、円筒軸の傾きから直径を逆算する
+        # AABBの幅・高さと、円筒軸の傾き (C: 横成分, S: 縦成分) から直径を逆算する
         aabb_w = u_max - u_min
         aabb_h = v_max - v_min
-        
-        # 円筒軸の傾き成分 (C: 横成分, S: 縦成分)
-        # dir_up は画像上の円筒軸ベクトル(正規化済み)
-        C = abs(dir_up[0])
-        S = abs(dir_up[1])
-        
+        aabb_short = np.minimum(aabb_w, aabb_h)
+        C = np.abs(dir_up[:, 0])
+        S = np.abs(dir_up[:, 1])
+
         # 解析的推定: D = |H*C - W*S| / |C^2 - S^2|
-        # 45度付近(|C^2 - S^2| ≈ 0)では不安定になるため、重み付けでフォールバックする
-        denom = abs(C**2 - S**2)
-        if denom > 1e-2:
-            D_poly = abs(aabb_h * C - aabb_w * S) / denom
-        else:
-            D_poly = min(aabb_w, aabb_h)
+        # 45度付近(|C^2 - S^2| ≈ 0)では不安定になるため、短辺でフォールバックする
+        denom = np.abs(C**2 - S**2)
+        stable = denom > 1e-2
+        D_poly = np.where(stable, np.abs(aabb_h * C - aabb_w * S) / np.where(stable, denom, 1.0), aabb_short)
 
         # クランプ: 直径はAABBの短辺より大きくなることはない
-        D_poly = min(D_poly, aabb_w, aabb_h)
-        
-        # ヒューリスティック推定: 45度付近ではAABBが緩くなるため、細長さを仮定して補正
-        # 0/90度では1.0倍、45度では0.6倍にする
-        heuristic_factor = 1.0 - 0.4 * (2 * C * S)
-        D_heuristic = min(aabb_w, aabb_h) * heuristic_factor
-        
-        # ブレンド: 軸に平行なほど解析解(D_poly)を信頼し、45度に近いほどヒューリスティック(D_heuristic)を使う
+        D_poly = np.minimum(D_poly, aabb_short)
+
+        # ヒューリスティック推定: 0/90度では1.0倍、45度では0.6倍にする
+        D_heuristic = aabb_short * (1.0 - 0.4 * (2 * C * S))
+
+        # ブレンド: 軸に平行なほど解析解(D_poly)を信頼し、45度に近いほどヒューリスティックを使う
         weight = denom ** 2
         width_px = weight * D_poly + (1.0 - weight) * D_heuristic
-        
+
         # --- 4. 接地位置 (X, Y, 0) の推定 ---
-        # 画像上の接地点 u_contact, v_contact からレイを飛ばす
-        coords, _ = self.convert_2d_to_3d(u_contact, v_contact, rvec=rvec, tvec=tvec)
-        if not coords: return None
-        P_ground_edge = np.array([coords['xm'], coords['ym'], 0.0])
-        
-        # カメラ位置
-        C_pos = camera_pos
-        dist_cam_obj = np.linalg.norm(P_ground_edge - camera_pos)
-        
-        # 半径推定 (簡易版)
-        # width_px は円筒の直径に相当するとみなす
-        # 以前は cos_alpha * 0.9 の補正があったが、過小評価の原因となるため削除
-        r_est = (width_px * dist_cam_obj / (2 * fx))
-        
+        # 画像上の接地点 u_contact, v_contact からレイを飛ばし、Z=0 平面との交点を求める
+        # (convert_2d_to_3d と同じ計算)
+        R_ground, _ = cv2.Rodrigues(rvec)
+        ground_origin = -np.dot(R_ground.T, tvec.flatten())
+        ray_cam = np.stack([(u_contact - cx) / fx, (v_contact - cy) / fy, np.ones(n)], axis=1)
+        ray_world = ray_cam @ R_ground
+        hits_ground = np.abs(ray_world[:, 2]) > 1e-6
+        s = -ground_origin[2] / np.where(hits_ground, ray_world[:, 2], 1.0)
+        P_ground_edge = ground_origin + s[:, None] * ray_world
+        P_ground_edge[:, 2] = 0.0
+
+        # 半径推定 (簡易版): width_px は円筒の直径に相当するとみなす
+        dist_cam_obj = np.linalg.norm(P_ground_edge - camera_pos, axis=1)
+        r_est = width_px * dist_cam_obj / (2 * fx)
+
         # 中心位置補正: P_ground_edge は「手前の縁」。ここから半径分だけ「奥」へずらす。
-        vec_cam_to_pt = P_ground_edge - np.array([C_pos[0], C_pos[1], 0.0])
-        vec_cam_to_pt_norm = np.linalg.norm(vec_cam_to_pt)
-        if vec_cam_to_pt_norm < 1e-3:
-            direction = np.array([1.0, 0.0, 0.0])
-        else:
-            direction = vec_cam_to_pt / vec_cam_to_pt_norm
-            
-        P_center = P_ground_edge + direction * r_est
-        
+        vec_cam_to_pt = P_ground_edge - np.array([camera_pos[0], camera_pos[1], 0.0])
+        vec_cam_to_pt_norm = np.linalg.norm(vec_cam_to_pt, axis=1)
+        near = vec_cam_to_pt_norm < 1e-3
+        direction = vec_cam_to_pt / np.where(near, 1.0, vec_cam_to_pt_norm)[:, None]
+        direction[near] = [1.0, 0.0, 0.0]
+        P_center = P_ground_edge + direction * r_est[:, None]
+
         # --- 5. 高さ推定 ---
-        # Top点に対応する視線ベクトル
-        ray_top_cam = np.array([(u_top - cx) / fx, (v_top - cy) / fy, 1.0])
-        ray_top_world = np.dot(R.T, ray_top_cam)
-        ray_top_world /= np.linalg.norm(ray_top_world)
-        
-        # 円筒軸の始点 B = P_center, 方向 V = (0,0,1)
-        # 視線の始点 A = C_pos, 方向 U = ray_top_world
-        # 2直線の最接近点のうち、円筒軸上の点のパラメータ h を求める。
+        # 円筒軸 (始点 B = P_center, 方向 V = (0,0,1)) と Top点の視線
+        # (始点 A = camera_pos, 方向 U) の最接近点のうち、円筒軸上の点のパラメータ h を求める。
         # 公式: h = ( (A-B)・V - ((A-B)・U)(U・V) ) / ( 1 - (U・V)^2 )
-        
-        B = P_center
-        V = np.array([0.0, 0.0, 1.0])
-        A = camera_pos
-        U = ray_top_world
-        
-        AB = A - B
-        UV = np.dot(U, V)
+        ray_top_cam = np.stack([(u_top - cx) / fx, (v_top - cy) / fy, np.ones(n)], axis=1)
+        U = ray_top_cam @ R
+        U /= np.linalg.norm(U, axis=1)[:, None]
+
+        AB = camera_pos - P_center
+        UV = U[:, 2]
         denom = 1.0 - UV**2
-        
-        if abs(denom) < 1e-6:
-            h_est = 0.0
-        else:
-            h_est = (np.dot(AB, V) - np.dot(AB, U) * UV) / denom
+        solvable = np.abs(denom) >= 1e-6
+        h_est = np.where(solvable, (AB[:, 2] - np.sum(AB * U, axis=1) * UV) / np.where(solvable, denom, 1.0), 0.0)
 
         # --- 高さの補正 ---
-        # AABBの上端(v_min)は円筒上面の「奥側の縁」に対応するため、
-        # そのまま軸との交点を求めると、視線の傾き分だけ高い位置(手前)で交差したと計算されてしまう。
-        # 視線と軸のなす角 phi を用いて、半径 r 分の高さズレを補正する。
-        # delta_h = r * cot(phi)
+        # AABBの上端は円筒上面の「奥側の縁」に対応するため、視線と軸のなす角 phi を用いて
+        # 半径 r 分の高さズレを補正する。 delta_h = r * cot(phi)
+        # 真上(sin_phi~0)や真横(cos_phi~0)の特異点は避ける
         cos_phi = UV
-        sin_phi = np.sqrt(max(0.0, 1.0 - cos_phi**2))
-        
-        # 真上(sin_phi~0)や真横(cos_phi~0)の特異点を避ける
-        if sin_phi > 0.1:
-            # 見下ろし時: cos_phi < 0 -> delta_h < 0 (高さを下げる)
-            # 見上げ時: cos_phi > 0 -> delta_h > 0 (高さを上げる...通常ありえないが)
-            delta_h = r_est * (cos_phi / sin_phi)
-            h_est += delta_h
+        sin_phi = np.sqrt(np.maximum(0.0, 1.0 - cos_phi**2))
+        tilted = sin_phi > 0.1
+        h_est = h_est + np.where(tilted, r_est * cos_phi / np.where(tilted, sin_phi, 1.0), 0.0)
+        h_est = np.maximum(0.0, h_est)
 
         # --- 6. 出力値の計算 ---
-        # 3D中心座標を2D画像座標(u, v)に再投影
-        imgpts, _ = cv2.projectPoints(np.array([P_center], dtype=np.float32), rvec, tvec, self.mtx, np.zeros((5, 1)))
-        u_center_reproj, v_center_reproj = imgpts[0][0]
-
-        # 高さ位置の再投影
-        P_top = P_center + np.array([0.0, 0.0, max(0.0, h_est)])
-        imgpts_top, _ = cv2.projectPoints(np.array([P_top], dtype=np.float32), rvec, tvec, self.mtx, np.zeros((5, 1)))
-        u_top_reproj, v_top_reproj = imgpts_top[0][0]
+        # 中心と高さ位置の 2N 点をまとめて2D画像座標(u, v)に再投影
+        P_top = P_center.copy()
+        P_top[:, 2] += h_est
+        object_points = np.concatenate([P_center, P_top]).astype(np.float32)
+        imgpts, _ = cv2.projectPoints(object_points, rvec, tvec, self.mtx, np.zeros((5, 1)))
+        imgpts = imgpts.reshape(-1, 2)
 
         # 0-1000正規化座標
-        u_norm = int(u_center_reproj / w_img * 1000)
-        v_norm = int(v_center_reproj / h_img * 1000)
-        u_top_norm = int(u_top_reproj / w_img * 1000)
-        v_top_norm = int(v_top_reproj / h_img * 1000)
+        u_norm = imgpts[:n, 0] / w_img * 1000
+        v_norm = imgpts[:n, 1] / h_img * 1000
+        u_top_norm = imgpts[n:, 0] / w_img * 1000
+        v_top_norm = imgpts[n:, 1] / h_img * 1000
 
-        # 半径のピクセル換算
-        # 推定された実半径 r_est (mm) を、距離に基づいて画像上のピクセルサイズに逆投影します
-        dist_cam_center = np.linalg.norm(P_center - camera_pos)
-        radius_px = (r_est * fx) / dist_cam_center if dist_cam_center > 0 else 0
+        # 半径のピクセル換算 (推定された実半径 r_est (mm) を距離に基づいて逆投影)
+        dist_cam_center = np.linalg.norm(P_center - camera_pos, axis=1)
+        radius_px = np.where(dist_cam_center > 0, r_est * fx / np.where(dist_cam_center > 0, dist_cam_center, 1.0), 0.0)
 
         # 視線角度による楕円化 (見かけの縦半径を圧縮)
         view_cos = abs(R[2, 2]) if R is not None else 0.5
-        
+
         # 0-1000正規化半径
         radius_u_norm = (radius_px / w_img) * 1000
         radius_v_norm = (radius_px * view_cos / h_img) * 1000
 
-        return {
-            "xm": float(P_center[0]),
-            "ym": float(P_center[1]),
-            "zm": 0.0,
-            "r": float(r_est),
-            "h": float(max(0.0, h_est)),
-            "u_norm": u_norm,
-            "v_norm": v_norm,
-            "u_top_norm": u_top_norm,
-            "v_top_norm": v_top_norm,
-            "radius_u_norm": float(radius_u_norm),
-            "radius_v_norm": float(radius_v_norm)
-        }
-
-    def _get_dominant_color(self, img_roi):
-        """
-        ROIの代表色をHSVで算出する。
-        K-means法(k=1)を使用して主要な色を抽出する。
-        """
-        if img_roi.size == 0:
-            return None
-            
-        # 計算量削減のためリサイズ (最大50x50程度)
-        h, w = img_roi.shape[:2]
-        if h > 50 or w > 50:
-            scale = min(50.0/h, 50.0/w)
-            # cv2.resize expects (width, height)
-            new_w = int(w * scale)
-            new_h = int(h * scale)
-            if new_w > 0 and new_h > 0:
-                img_roi = cv2.resize(img_roi, (new_w, new_h))
-            
-        # データをフラット化
-        pixels = img_roi.reshape(-1, 3).astype(np.float32)
-        
-        # K-means (k=1)
-        criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 10, 1.0)
-        _, _, centers = cv2.kmeans(pixels, 1, None, criteria, 10, cv2.KMEANS_RANDOM_CENTERS)
-        
-        dominant_bgr = centers[0].astype(np.uint8)
-        
-        # BGR -> HSV変換
-        dominant_hsv_img = cv2.cvtColor(np.array([[dominant_bgr]]), cv2.COLOR_BGR2HSV)
-        h_val, s_val, v_val = dominant_hsv_img[0][0]
-        
-        return {"h": int(h_val), "s": int(s_val), "v": int(v_val)}
+        results = []
+        for i in range(n):
+            if not hits_ground[i]:
+                results.append(None)
+                continue
+            results.append({
+                "xm": float(P_center[i, 0]),
+                "ym": float(P_center[i, 1]),
+                "zm": 0.0,
+                "r": float(r_est[i]),
+                "h": float(h_est[i]),
+                "u_norm": int(u_norm[i]),
+                "v_norm": int(v_norm[i]),
+                "u_top_norm": int(u_top_norm[i]),
+                "v_top_norm": int(v_top_norm[i]),
+                "radius_u_norm": float(radius_u_norm[i]),
+                "radius_v_norm": float(radius_v_norm[i])
+            })
+        return results
 
     def _hsv_to_color_name(self, h, s, v):
-        """HSV値から簡易的な色名を判定する"""
-        # 彩度(S)と明度(V)に基づいて、白・黒・グレーを先に判定
-        # 明度が極端に低い場合は黒
-        if v < 65:
-            return "black"
-
-        # 彩度しきい値を色相によって動的に調整
-        # 白が青っぽく誤判定されるのを防ぐため、青色領域(90-125)では彩度しきい値を上げる
-        s_thresh = 55
-        if 90 <= h < 125:
-            s_thresh = 80
-
-        # 彩度が低い場合は白かグレー
-        if s < s_thresh:
-            if v > 190:
-                return "white"
-            return "gray"
-
-        # 色相による判定 (OpenCV H: 0-179)
-        color_name = "unknown"
-        if h < 5 or h >= 179:
-            color_name = "red"
-        elif h < 35:
-            color_name = "orange"
-        elif h < 60:
-            color_name = "yellow"
-        elif h < 95:
-            color_name = "green"
-        elif h < 115:
-            color_name = "blue"
-        elif h < 175:
-            color_name = "purple"
-        elif h < 179:
-            color_name = "pink"
-        # print(f"Debug: Detected {color_name} color with HSV=({h}, {s}, {v})")
-        return color_name
+        """HSV値から簡易的な色名を判定する (color_engine のルックアップテーブルを使用)"""
+        return hsv_to_color_name(h, s, v)
 
     def detect_objects(self, model, confidence=0.7):
         """
         YOLOモデルを使用して、現在のフレームから物体検出を行います。
         
         Args:
-            model: YOLOモデルインスタンス (ultralytics.YOLO)
+            model: YOLOモデルインスタンス (ultralytics.YOLO)、または predict_boxes() を持つ
+                   推論バックエンド (inference_backend の各バックエンド、DetectionWorkerClient など)
             confidence (float): 信頼度しきい値
             
         Returns:
             list: 検出結果のリスト [{"label": str, "confidence": float, "box_2d": [...]}, ...]
         """
-        frame = None
-        current_rvec, current_tvec, current_R, current_camera_pos = None, None, None, None
+        detections, _ = self.detect_objects_ex(model, confidence)
+        return detections
+
+    def detect_objects_ex(self, model, confidence=0.7, use_motion_gate=None):
+        """
+        detect_objects と同じ検出を行い、検出結果と付加情報を返します。
 
-        with self.state_lock:
-            if self.last_processed_frame is None:
-                return []
-            frame = self.last_processed_frame.copy()
-            current_rvec = self.rvec.copy() if self.rvec is not None else None
-            current_tvec = self.tvec.copy() if self.tvec is not None else None
-            current_R = self.R.copy() if self.R is not None else None
-            current_camera_pos = self.camera_pos.copy() if self.camera_pos is not None else None
+        同じフレームIDに対する結果はキャッシュされ、フレームが更新されるまで再推論しません。
+        推論は min(confidence, detection_floor_confidence) で行うため、
+        しきい値だけが異なる呼び出しもキャッシュから絞り込んで返します。
+        モーションゲートを使う場合、前回推論したフレームからワークスペース内の画像が
+        変化していなければ、推論・円柱推定・色判定を省略して前回の結果を返します。
+
+        Args:
+            use_motion_gate (bool, optional): モーションゲートを使うか。Noneの場合は motion_gate_enabled に従う。
+
+        Returns:
+            tuple: (検出結果のリスト, {"frame_id": int, "cached": bool, "reused": bool, "change_ratio": float})
+                   reused は前回の結果を再利用した場合にTrue (frame_id は前回推論したフレーム)。
+        """
+        snapshot = self.snapshot
+        frame_id, frame = snapshot.frame_id, snapshot.frame
+        rvec, tvec = snapshot.rvec, snapshot.tvec
+        if frame is not None:
+            # モーションゲートの判定もワークスペース内に限定する
+            roi = self.workspace_pixel_roi(rvec, tvec, (frame.shape[1], frame.shape[0]))
+            self.motion_gate.set_roi(roi)
+            self.object_tracker.motion_gate.set_roi(roi)
+        if frame_id:
+            with self.detection_cache_lock:
+                cached = self.detection_cache.get((frame_id, id(model)))
+                if cached is not None and cached[0] <= confidence:
+                    self.detection_cache.move_to_end((frame_id, id(model)))
+                    self.detection_cache_hits += 1
+                    return self._filter_detections(cached[1], confidence), {"frame_id": frame_id, "cached": True, "reused": False, "change_ratio": None}
+
+        if use_motion_gate is None:
+            use_motion_gate = self.motion_gate_enabled
+        change, thumb = None, None
+        if use_motion_gate and frame is not None:
+            with timed("motion_gate"):
+                changed, change, thumb = self.motion_gate.check(frame)
+            previous = self.gated_detections
+            if not changed and previous is not None and previous[0] <= confidence:
+                return self._filter_detections(previous[2], confidence), {"frame_id": previous[1], "cached": False, "reused": True, "change_ratio": change}
+
+        floor = min(confidence, self.detection_floor_confidence)
+        # ゲートの判定と推論に同じスナップショットを使う (参照サムネイルと検出結果のフレームを一致させる)
+        frame_id, detections = self._run_detection(model, floor, snapshot)
+        self.gated_detections = (floor, frame_id, detections)
+        if thumb is not None:
+            self.motion_gate.commit(thumb)
+
+        if frame_id:
+            key = (frame_id, id(model))
+            with self.detection_cache_lock:
+                self.detection_cache_misses += 1
+                self.detection_cache[key] = (floor, detections)
+                self.detection_cache.move_to_end(key)
+                while len(self.detection_cache) > self.detection_cache_capacity:
+                    self.detection_cache.popitem(last=False)
+        return self._filter_detections(detections, confidence), {"frame_id": frame_id, "cached": False, "reused": False, "change_ratio": change}
+
+    def track_objects(self, model, confidence=0.7):
+        """
+        物体検出に追跡IDを付けて返します。
+
+        YOLOはキーフレーム (object_tracker.keyframe_interval フレーム毎、
+        またはキーフレームからの画像変化を検出した時) にだけ実行し、
+        その間はトラックの接地中心をカルマンフィルタで予測して返します。
+        各検出結果には "track_id" が付き、同じ物体には呼び出しをまたいで同じIDが割り当てられます。
+
+        Returns:
+            tuple: (検出結果のリスト, {"frame_id": int, "keyframe": bool})
+        """
+        snapshot = self.snapshot
+        if not snapshot.has_frame:
+            return [], {"frame_id": 0, "keyframe": False}
+        frame_id, frame = snapshot.frame_id, snapshot.frame
+
+        with self.tracker_lock:
+            tracker = self.object_tracker
+            keyframe = tracker.needs_keyframe(frame_id, frame)
+            if keyframe:
+                # トラックは下限信頼度の検出で更新し、出力時にしきい値で絞り込む
+                detections, info = self.detect_objects_ex(model, min(confidence, self.detection_floor_confidence))
+                tracked = tracker.update(detections, time.monotonic(), info["frame_id"])
+            else:
+                tracked = tracker.predict(time.monotonic(), frame_id)
+        return [det for det in tracked if det["confidence"] >= confidence], {"frame_id": frame_id, "keyframe": keyframe}
+
+    def set_workspace(self, rect, height_mm=None):
+        """
+        ワークスペースを設定します。物体検出はワークスペースを画像に投影した領域だけで行われます。
+
+        Args:
+            rect (tuple): マーカー座標系の矩形 (xm_min, ym_min, xm_max, ym_max) [mm]。Noneで解除。
+            height_mm (float, optional): ワークスペース内の物体の最大高さ [mm]。物体の上端が切れないよう投影に含める。
+        """
+        if rect is not None:
+            xm_min, ym_min, xm_max, ym_max = (float(v) for v in rect)
+            rect = (min(xm_min, xm_max), min(ym_min, ym_max), max(xm_min, xm_max), max(ym_min, ym_max))
+        self.workspace = rect
+        if height_mm is not None:
+            self.workspace_height_mm = float(height_mm)
+        # 検出領域が変わるので、以前の検出結果は再利用しない
+        with self.detection_cache_lock:
+            self.detection_cache.clear()
+        self.gated_detections = None
+
+    def workspace_pixel_roi(self, rvec=None, tvec=None, image_size=None):
+        """
+        ワークスペース (高さを含む直方体) を現在の姿勢で画像に投影し、外接矩形のピクセルROIを返します。
+
+        Args:
+            rvec, tvec: カメラ姿勢。Noneの場合は現在の姿勢を使用。
+            image_size (tuple, optional): (width, height)。Noneの場合は最後に処理したフレームのサイズ。
+
+        Returns:
+            tuple: (x1, y1, x2, y2) ピクセル座標。ワークスペース未設定・姿勢不明・画像外の場合はNone。
+        """
+        if self.workspace is None:
+            return None
+        snapshot = self.snapshot
+        if rvec is None or tvec is None:
+            rvec, tvec = snapshot.rvec, snapshot.tvec
+        if rvec is None or tvec is None:
+            return None
+        if image_size is None:
+            image_size = snapshot.image_size
+            if image_size is None:
+                return None
+        w, h = image_size
+
+        xm_min, ym_min, xm_max, ym_max = self.workspace
+        corners = np.array([[x, y, z]
+                            for z in (0.0, self.workspace_height_mm)
+                            for x in (xm_min, xm_max)
+                            for y in (ym_min, ym_max)], dtype=np.float32)
+        imgpts, _ = cv2.projectPoints(corners, rvec, tvec, self.mtx, np.zeros((5, 1)))
+        imgpts = imgpts.reshape(-1, 2)
+
+        margin, grid = self.workspace_margin_px, self.workspace_grid_px
+        x1 = int(np.floor((imgpts[:, 0].min() - margin) / grid) * grid)
+        y1 = int(np.floor((imgpts[:, 1].min() - margin) / grid) * grid)
+        x2 = int(np.ceil((imgpts[:, 0].max() + margin) / grid) * grid)
+        y2 = int(np.ceil((imgpts[:, 1].max() + margin) / grid) * grid)
+        x1, y1 = max(0, x1), max(0, y1)
+        x2, y2 = min(w, x2), min(h, y2)
+        if x2 - x1 < grid or y2 - y1 < grid:
+            return None
+        if (x1, y1, x2, y2) == (0, 0, w, h):
+            return None
+        return (x1, y1, x2, y2)
+
+    def _filter_detections(self, detections, confidence):
+        """キャッシュ済みの検出結果を信頼度で絞り込み、呼び出し側が変更できるようコピーを返す"""
+        return [copy.deepcopy(det) for det in detections if det["confidence"] >= confidence]
+
+    def _run_detection(self, model, confidence, snapshot=None):
+        """
+        スナップショットのフレームで推論・円柱推定・色判定を行う。
+
+        Args:
+            snapshot (FrameSnapshot, optional): 推論するスナップショット。Noneの場合は現在のスナップショット。
+
+        Returns:
+            tuple: (推論に使ったフレームのID, 検出結果のリスト)
+        """
+        # スナップショットは不変なので、コピーせずに参照だけを保持する
+        if snapshot is None:
+            snapshot = self.snapshot
+        if not snapshot.has_frame:
+            return 0, []
+        frame_id, frame = snapshot.frame_id, snapshot.frame
+        current_rvec, current_tvec = snapshot.rvec, snapshot.tvec
+        current_R, current_camera_pos = snapshot.R, snapshot.camera_pos
 
         h, w = frame.shape[:2]
 
-        # 推論実行
-        results = model.predict(frame, conf=confidence, verbose=False)
-        result = results[0]
+        # ワークスペースが設定されていれば、その領域だけを切り出して推論する
+        roi = self.workspace_pixel_roi(current_rvec, current_tvec, (w, h))
+        if roi is not None:
+            x_off, y_off = roi[0], roi[1]
+            infer_frame = np.ascontiguousarray(frame[roi[1]:roi[3], roi[0]:roi[2]])
+            if hasattr(model, 'reserve'):
+                # 検出ワーカーのフレームバスはフルフレームの大きさで確保し、クロップはその一部に書き込む
+                model.reserve(frame.shape)
+        else:
+            x_off, y_off = 0, 0
+            infer_frame = frame
+
+        # 推論実行 (プロセス内のモデル、または別プロセスの検出ワーカー)
+        with timed("yolo"):
+            if hasattr(model, 'predict_boxes'):
+                # クロップの画素は frame_id だけでは決まらない (ワークスペース変更で同じフレームから別の領域を切り出す)
+                # ため、フレームバスの重複書き込み省略を使わない
+                boxes = model.predict_boxes(infer_frame, confidence, frame_id=frame_id if roi is None else 0)
+            else:
+                with self.inference_lock:
+                    boxes = predict_boxes(model, infer_frame, confidence)
+
+        # クロップ座標をフレーム全体のピクセル座標に戻す
+        if roi is not None:
+            for box in boxes:
+                x1, y1, x2, y2 = box["xyxy"]
+                box["xyxy"] = [x1 + x_off, y1 + y_off, x2 + x_off, y2 + y_off]
         
-        detections = []
-        for box in result.boxes:
-            # box.xyxy is [x1, y1, x2, y2] in pixels
-            x1, y1, x2, y2 = box.xyxy[0].tolist()
-            cls_id = int(box.cls[0])
-            label = result.names[cls_id]
-            conf = float(box.conf[0])
-            
-            # クライアント側描画用に 0-1000 スケールに正規化
-            norm_box = [
+        # クライアント側描画用に 0-1000 スケールに正規化 (xyxy はピクセル単位の [x1, y1, x2, y2])
+        norm_boxes = []
+        for box in boxes:
+            x1, y1, x2, y2 = box["xyxy"]
+            norm_boxes.append([
                 (y1 / h) * 1000,
                 (x1 / w) * 1000,
                 (y2 / h) * 1000,
                 (x2 / w) * 1000
-            ]
-            
-            det = {"label": label, "confidence": conf, "box_2d": norm_box}
+            ])
+
+        # 円柱としての3D位置推定 (全検出をまとめて計算)
+        with timed("cylinder"):
+            cylinders = self._estimate_cylinders_3d(norm_boxes, current_rvec, current_tvec, current_R, current_camera_pos, image_size=(w, h))
+
+        detections = []
+        sample_rects = []   # 全検出の色サンプリング領域 (x1, y1, x2, y2)
+        sample_slices = []  # 検出毎の (円筒サンプルの範囲, フォールバック領域のインデックス)
+        for box, norm_box, cyl_3d in zip(boxes, norm_boxes, cylinders):
+            x1, y1, x2, y2 = box["xyxy"]
+            det = {"label": box["label"], "confidence": box["conf"], "box_2d": norm_box}
             
-            # 円柱としての3D位置推定
-            cyl_3d = self._estimate_cylinder_3d(norm_box, current_rvec, current_tvec, current_R, current_camera_pos)
             if cyl_3d:
                 det["ground_center"] = cyl_3d
             
             # 色判定 (円筒モデルがある場合はZ軸に沿ってサンプリングして多数決)
-            box_w = x2 - x1
-            box_h = y2 - y1
-            
-            color_samples = []
-            
+            start = len(sample_rects)
             if cyl_3d:
                 u_base = cyl_3d['u_norm'] * w / 1000
                 v_base = cyl_3d['v_norm'] * h / 1000
@@ -608,29 +1010,23 @@ class VisionSystem:
                     t = 0.2 + (0.6 * i / (num_samples - 1)) if num_samples > 1 else 0.5
                     cx = int(u_base + (u_top - u_base) * t)
                     cy = int(v_base + (v_top - v_base) * t)
-                    
-                    x1_c, y1_c = max(0, cx - roi_r), max(0, cy - roi_r)
-                    x2_c, y2_c = min(w, cx + roi_r), min(h, cy + roi_r)
-                    
-                    if x2_c > x1_c and y2_c > y1_c:
-                        roi = frame[y1_c:y2_c, x1_c:x2_c]
-                        color = self._get_dominant_color(roi)
-                        if color:
-                            c_name = self._hsv_to_color_name(color['h'], color['s'], color['v'])
-                            color_samples.append({'hsv': color, 'name': c_name})
-
-            if not color_samples:
-                # フォールバック: バウンディングボックスの中心50%
-                margin_w, margin_h = box_w * 0.25, box_h * 0.25
-                x1_c, y1_c = max(0, int(x1 + margin_w)), max(0, int(y1 + margin_h))
-                x2_c, y2_c = min(w, int(x2 - margin_w)), min(h, int(y2 - margin_h))
-                
-                if x2_c > x1_c and y2_c > y1_c:
-                    roi = frame[y1_c:y2_c, x1_c:x2_c]
-                    color = self._get_dominant_color(roi)
-                    if color:
-                        c_name = self._hsv_to_color_name(color['h'], color['s'], color['v'])
-                        color_samples.append({'hsv': color, 'name': c_name})
+                    sample_rects.append((cx - roi_r, cy - roi_r, cx + roi_r, cy + roi_r))
+            end = len(sample_rects)
+
+            # フォールバック: バウンディングボックスの中心50%
+            margin_w, margin_h = (x2 - x1) * 0.25, (y2 - y1) * 0.25
+            sample_rects.append((int(x1 + margin_w), int(y1 + margin_h), int(x2 - margin_w), int(y2 - margin_h)))
+            sample_slices.append((start, end, end))
+            detections.append(det)
+
+        # 全サンプル領域の代表色をまとめて算出
+        with timed("color"):
+            colors = self.color_engine.roi_colors(frame, sample_rects, frame_id)
+
+        for det, (start, end, fallback) in zip(detections, sample_slices):
+            color_samples = [c for c in colors[start:end] if c]
+            if not color_samples and colors[fallback]:
+                color_samples = [colors[fallback]]
 
             if color_samples:
                 names = [s['name'] for s in color_samples]
@@ -642,10 +1038,8 @@ class VisionSystem:
                 
                 det["color_hsv"] = {"h": avg_h, "s": avg_s, "v": avg_v}
                 det["color_name"] = winner_name
-
-            detections.append(det)
             
-        return detections
+        return frame_id, detections
 
     def convert_marker_coords_to_image(self, xm: float, ym: float, zm: float):
         """
@@ -681,22 +1075,20 @@ class VisionSystem:
             R, _ = cv2.Rodrigues(rvec)
             camera_pos = -np.dot(R.T, tvec.flatten())
         else:
-            # 現在のシステム姿勢を使用
-            # Note: This uses the cached state without lock, might be slightly inconsistent if update_pose is running
-            # But convert_2d_to_3d is usually called from interactive mode or tools where update_pose was just called.
-            with self.state_lock:
-                if self.rvec is None:
-                    return None, None
-                current_rvec, current_tvec = self.rvec, self.tvec
-                R, camera_pos = self.R, self.camera_pos
+            # 現在のシステム姿勢を使用 (スナップショットのフレームと姿勢は常に一貫している)
+            snapshot = self.snapshot
+            if snapshot.rvec is None:
+                return None, None
+            current_rvec, current_tvec = snapshot.rvec, snapshot.tvec
+            R, camera_pos = snapshot.R, snapshot.camera_pos
 
         fx, fy, cx, cy = self.mtx[0, 0], self.mtx[1, 1], self.mtx[0, 2], self.mtx[1, 2]
         ray_cam = np.array([(u - cx) / fx, (v - cy) / fy, 1.0])
         ray_world = np.dot(R.T, ray_cam)
 
         annotated_frame = None
-        if draw_target and self.last_processed_frame is not None:
-            annotated_frame = self.last_processed_frame.copy()
+        if draw_target and self.snapshot.has_frame:
+            annotated_frame = self.snapshot.copy_frame()
             # ターゲット位置に円を描画
             cv2.circle(annotated_frame, (u, v), 10, (0, 255, 255), 2)
             # 座標軸も描画
@@ -746,8 +1138,8 @@ class VisionSystem:
         """マウスイベントのコールバック関数"""
         if event == cv2.EVENT_LBUTTONDOWN:
             # Clearボタンの判定 (右上の領域)
-            if self.last_processed_frame is not None:
-                h, w = self.last_processed_frame.shape[:2]
+            if self.snapshot.has_frame:
+                w, h = self.snapshot.image_size
                 
                 # ボタン配置設定
                 margin = 10
@@ -832,10 +1224,11 @@ class VisionSystem:
                 # キャプチャ要求があれば更新
                 if self.need_capture:
                     self.update_pose(force_update=True)
-                    if self.last_processed_frame is not None:
-                        display_frame = self.last_processed_frame.copy()
-                        self.static_rvec = self.rvec.copy() if self.rvec is not None else None
-                        self.static_tvec = self.tvec.copy() if self.tvec is not None else None
+                    snapshot = self.snapshot
+                    if snapshot.has_frame:
+                        # 不変のスナップショットなのでコピー不要 (描画時に frame_to_show としてコピーする)
+                        display_frame = snapshot.frame
+                        self.static_rvec, self.static_tvec = snapshot.rvec, snapshot.tvec
                     self.need_capture = False
                 
                 if display_frame is None:
@@ -974,4 +1367,6 @@ class VisionSystem:
 
     def release(self):
         """カメラリソースを解放する。"""
+        self._pose_lock_stop.set()
+        self.grabber.stop()
         self.cap.release()
\ No newline at end of file
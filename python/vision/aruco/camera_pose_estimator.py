@@ -1,6 +1,10 @@
 import cv2
 import numpy as np
 import argparse
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from undistortion import undistort
 
 """
 ================================================================================
@@ -109,8 +113,8 @@ def main():
         ret, frame = cap.read()
         if not ret: break
 
-        # 最初にフレーム全体の歪みを補正する
-        undistorted_frame = cv2.undistort(frame, mtx, dist, None, mtx)
+        # 最初にフレーム全体の歪みを補正する (補正マップはキャッシュして再利用)
+        undistorted_frame = undistort(frame, mtx, dist)
 
         # 歪み補正後の画像でマーカー検出を行う
         gray = cv2.cvtColor(undistorted_frame, cv2.COLOR_BGR2GRAY)
@@ -1,6 +1,10 @@
 import numpy as np
 import cv2
 import argparse
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from undistortion import undistort
 
 def run_calibration(chessboard_size=(9, 6), square_size=25.0, output_filename="calibration_data.npz", camera_source=0):
     """
@@ -100,7 +104,8 @@ def run_view_mode(calibration_file="calibration_data.npz", camera_source=0):
         if newcameramtx is None:
             newcameramtx, roi = cv2.getOptimalNewCameraMatrix(mtx, dist, (w, h), 1, (w, h))
 
-        dst = cv2.undistort(frame, mtx, dist, None, newcameramtx)
+        # 歪み補正マップは初回のみ作成され、以降はリマップのみ行う
+        dst = undistort(frame, mtx, dist, newcameramtx)
         
         # 横に並べて結合
         combined = np.hstack((frame, dst))
@@ -0,0 +1,101 @@
+import os
+import hashlib
+import threading
+import cv2
+import numpy as np
+
+"""
+歪み補正(undistort)の共通モジュール。
+
+cv2.undistort は呼び出しのたびに歪み補正用の座標マップを作り直すため、
+1920x1080のライブ映像に毎フレーム適用すると大きなCPU負荷になります。
+本モジュールでは initUndistortRectifyMap で作成したマップを
+(mtx, dist, 解像度, 新カメラ行列) ごとに一度だけ作成してキャッシュし、
+固定小数点形式(CV_16SC2)のマップを用いた cv2.remap で補正を行います。
+"""
+
+_undistorters = {}
+_undistorters_lock = threading.Lock()
+
+def _cache_key(mtx, dist, size, new_mtx):
+    """パラメータからキャッシュキー(ハッシュ文字列)を生成する"""
+    h = hashlib.sha1()
+    for arr in (mtx, dist, new_mtx):
+        h.update(np.ascontiguousarray(arr, dtype=np.float64).tobytes())
+    h.update(f"{size[0]}x{size[1]}".encode('utf-8'))
+    return h.hexdigest()[:16]
+
+def _maps_file_path(persist_path, size, key):
+    """キャリブレーションファイルの隣に置くマップ保存ファイルのパス"""
+    base, _ = os.path.splitext(os.path.abspath(persist_path))
+    return f"{base}.remap_{size[0]}x{size[1]}_{key}.npz"
+
+class Undistorter:
+    """
+    事前計算済みのリマップテーブルを保持し、フレームの歪み補正を行うクラス。
+    """
+    def __init__(self, map1, map2, size, new_mtx):
+        self.map1 = map1
+        self.map2 = map2
+        self.size = size
+        self.new_mtx = new_mtx
+
+    def apply(self, frame, interpolation=cv2.INTER_LINEAR):
+        """
+        フレームの歪みを補正する。cv2.undistort(frame, mtx, dist, None, new_mtx) と同等。
+        """
+        h, w = frame.shape[:2]
+        if (w, h) != self.size:
+            raise ValueError(f"フレームサイズ {w}x{h} がマップのサイズ {self.size[0]}x{self.size[1]} と一致しません。")
+        return cv2.remap(frame, self.map1, self.map2, interpolation)
+
+def get_undistorter(mtx, dist, size, new_mtx=None, persist_path=None):
+    """
+    指定されたパラメータ用の Undistorter を返す（プロセス内でキャッシュ）。
+
+    Args:
+        mtx (np.ndarray): カメラ行列。
+        dist (np.ndarray): 歪み係数。
+        size (tuple): 画像サイズ (width, height)。
+        new_mtx (np.ndarray, optional): 補正後のカメラ行列。Noneの場合は mtx を使用。
+        persist_path (str, optional): キャリブレーションファイル(.npz)のパス。
+            指定した場合、マップをその隣にファイル保存し、次回起動時に再利用する。
+    """
+    if new_mtx is None:
+        new_mtx = mtx
+    size = (int(size[0]), int(size[1]))
+    key = _cache_key(mtx, dist, size, new_mtx)
+
+    with _undistorters_lock:
+        undistorter = _undistorters.get(key)
+        if undistorter is not None:
+            return undistorter
+
+        map1, map2 = None, None
+        maps_file = _maps_file_path(persist_path, size, key) if persist_path else None
+        if maps_file and os.path.exists(maps_file):
+            try:
+                with np.load(maps_file) as data:
+                    map1, map2 = data['map1'], data['map2']
+            except Exception as e:
+                print(f"Warning: 歪み補正マップの読み込みに失敗しました {maps_file}: {e}")
+                map1, map2 = None, None
+
+        if map1 is None:
+            map1, map2 = cv2.initUndistortRectifyMap(mtx, dist, None, new_mtx, size, cv2.CV_16SC2)
+            if maps_file:
+                try:
+                    np.savez(maps_file, map1=map1, map2=map2)
+                except Exception as e:
+                    print(f"Warning: 歪み補正マップを保存できません {maps_file}: {e}")
+
+        undistorter = Undistorter(map1, map2, size, new_mtx)
+        _undistorters[key] = undistorter
+        return undistorter
+
+def undistort(frame, mtx, dist, new_mtx=None, persist_path=None):
+    """
+    cv2.undistort の置き換え。フレームサイズに応じたキャッシュ済みマップで歪みを補正する。
+    """
+    h, w = frame.shape[:2]
+    return get_undistorter(mtx, dist, (w, h), new_mtx, persist_path).apply(frame)
@@ -5,6 +5,9 @@ import glob
 import re
 import numpy as np
 import subprocess
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../python/vision'))
+from undistortion import undistort
 
 def get_next_save_path(output_dir, prefix="img_", ext=".jpg"):
     """
@@ -100,7 +103,7 @@ class CameraApp:
                 self.mtx, self.dist, (w, h), 1, (w, h)
             )
             
-        dst = cv2.undistort(frame, self.mtx, self.dist, None, self.newcameramtx)
+        dst = undistort(frame, self.mtx, self.dist, self.newcameramtx)
         x, y, w_roi, h_roi = self.roi
         dst = dst[y:y+h_roi, x:x+w_roi]
         return dst